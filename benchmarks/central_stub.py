@@ -0,0 +1,335 @@
+"""
+benchmarks.central_stub
+-----------------------
+
+Local stand-in for an ODK Central server that serves synthetic WHO 2016 VA
+submissions, used by the ingest benchmarks (so they do not need a live
+server).  The records are generated on the fly from the columns and values in
+tests/ODKFiles/odk_export_new_who_v151.csv (each value is drawn from the
+values of the same column in the sample records), so every request for the
+same number of records returns the same data.
+
+The server answers the ODK Central endpoints used by
+:class:`openva_pipeline.odk.ODK`:
+
+- forms/{formId}/submissions.csv (and submissions.csv.zip)
+- forms/{formId}/submissions (submission list)
+- forms/{formId}/fields?odata=true
+- forms/{formId}.svc/Submissions (OData, with $top, $skip, $count,
+  $select, a $filter on __id (e.g., __id eq 'uuid:...' or ...), and
+  single submissions with Submissions('uuid:...'))
+
+and can add a fixed latency to each response and limit the bandwidth.
+Standalone usage::
+
+    $ python benchmarks/central_stub.py --records 10000 --latency 0.2 \\
+        --bandwidth 1000000
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                        "tests", "ODKFiles", "odk_export_new_who_v151.csv")
+
+
+class SyntheticVA:
+    """Synthetic WHO 2016 VA records.
+
+    :parameter n_records: Number of records.
+    :type n_records: int
+    :parameter seed: Seed for the random number generator (the same seed
+     gives the same records).
+    :type seed: int
+    :parameter template: CSV export with the columns and sample values.
+    :type template: str
+    """
+
+    def __init__(self, n_records, seed=1, template=TEMPLATE):
+
+        self.n_records = n_records
+        self.seed = seed
+        with open(template, "r", newline="") as f:
+            reader = csv.reader(f)
+            self.header = next(reader)
+            rows = list(reader)
+        self.values = [sorted({row[i] for row in rows if i < len(row)})
+                       for i in range(len(self.header))]
+        self.id_columns = [i for i, col in enumerate(self.header)
+                           if "instanceid" in col.lower() or col == "KEY"]
+
+    def instance_id(self, index):
+        """Instance ID of the record number index."""
+
+        return "uuid:" + str(uuid.UUID(int=(self.seed << 64) + index))
+
+    def rows(self, start=0, stop=None):
+        """Generate the records (as lists of values).
+
+        :parameter start: Number of the first record.
+        :type start: int
+        :parameter stop: Number after the last record (default: all records).
+        :type stop: int
+        """
+
+        stop = self.n_records if stop is None else min(stop, self.n_records)
+        for index in range(start, stop):
+            rng = random.Random(self.seed * 1000003 + index)
+            row = [rng.choice(values) if values else ""
+                   for values in self.values]
+            for i in self.id_columns:
+                row[i] = self.instance_id(index)
+            yield row
+
+    def csv_chunks(self, chunk_size=64 * 1024):
+        """Generate the CSV export in chunks of (about) chunk_size bytes."""
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.header)
+        for row in self.rows():
+            writer.writerow(row)
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode()
+
+    def submission(self, row):
+        """Convert a record to an OData submission (nested by group)."""
+
+        instance_id = row[self.id_columns[0]]
+        submission = {"__id": instance_id,
+                      "__system": {"submissionDate":
+                                   "2021-01-01T00:00:00.000Z",
+                                   "submitterId": "1",
+                                   "reviewState": None}}
+        for column, value in zip(self.header, row):
+            if column in ("SubmissionDate", "KEY"):
+                continue
+            *groups, name = column.split("-")
+            node = submission
+            for group in groups:
+                node = node.setdefault(group, {})
+                if not isinstance(node, dict):
+                    break
+            else:
+                node[name] = value if value != "" else None
+        return submission
+
+    def fields(self):
+        """Form fields (as returned by forms/{formId}/fields?odata=true)."""
+
+        return [{"name": column.split("-")[-1],
+                 "path": "/" + column.replace("-", "/"),
+                 "type": "string"}
+                for column in self.header
+                if column not in ("SubmissionDate", "KEY")]
+
+
+class CentralStub:
+    """Serve synthetic VA records with the ODK Central API.
+
+    :parameter n_records: Number of records on the server.
+    :type n_records: int
+    :parameter latency: Number of seconds to wait before each response.
+    :type latency: float
+    :parameter bandwidth: Maximum number of bytes per second sent in each
+     response (None for no limit).
+    :type bandwidth: int
+    :parameter seed: Seed for the synthetic records.
+    :type seed: int
+    """
+
+    def __init__(self, n_records, latency=0.0, bandwidth=None, seed=1):
+
+        self.data = SyntheticVA(n_records, seed)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._zip_file = None
+        self._zip_lock = threading.Lock()
+        self._server = None
+        #: Paths (with the query) of the requests received.
+        self.requests = []
+
+    @property
+    def url(self):
+        """Address of the running server."""
+
+        return "http://127.0.0.1:{0}".format(self._server.server_port)
+
+    def start(self, port=0):
+        """Start the server in a (daemon) thread."""
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop the server and remove the zipped export (if any)."""
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._zip_file is not None and os.path.isfile(self._zip_file):
+            os.remove(self._zip_file)
+
+    def _send(self, handler, status, chunks, content_type,
+              content_length=None):
+
+        time.sleep(self.latency)
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        if content_length is None:
+            handler.send_header("Transfer-Encoding", "chunked")
+        else:
+            handler.send_header("Content-Length", str(content_length))
+        handler.end_headers()
+        for chunk in chunks:
+            if not chunk:
+                continue
+            start = time.perf_counter()
+            if content_length is None:
+                handler.wfile.write(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+            else:
+                handler.wfile.write(chunk)
+            if self.bandwidth:
+                wait = len(chunk) / self.bandwidth - (time.perf_counter() -
+                                                      start)
+                if wait > 0:
+                    time.sleep(wait)
+        if content_length is None:
+            handler.wfile.write(b"0\r\n\r\n")
+
+    def _send_json(self, handler, body, status=200):
+
+        body = json.dumps(body).encode()
+        self._send(handler, status, _split(body), "application/json",
+                   len(body))
+
+    def _handle(self, handler):
+
+        self.requests.append(handler.path)
+        url = urlparse(handler.path)
+        path = unquote(url.path)
+        query = parse_qs(url.query)
+        if path.endswith("/submissions.csv"):
+            self._send(handler, 200, self.data.csv_chunks(),
+                       "text/csv; charset=utf-8")
+        elif path.endswith("/submissions.csv.zip"):
+            zip_file = self._zipped_export(path.split("/")[-2])
+            with open(zip_file, "rb") as f:
+                self._send(handler, 200,
+                           iter(lambda: f.read(64 * 1024), b""),
+                           "application/zip", os.path.getsize(zip_file))
+        elif path.endswith("/submissions"):
+            listing = [{"instanceId": self.data.instance_id(i),
+                        "createdAt": "2021-01-01T00:00:00.000Z"}
+                       for i in range(self.data.n_records)]
+            self._send_json(handler, listing)
+        elif path.endswith("/fields"):
+            self._send_json(handler, self.data.fields())
+        elif ".svc/Submissions" in path:
+            match = re.search(r"Submissions\('(.*)'\)$", path)
+            id_filter = re.findall(r"__id eq '((?:[^']|'')*)'",
+                                   query.get("$filter", [""])[0])
+            if match or id_filter:
+                instance_ids = [match.group(1)] if match else id_filter
+                rows = []
+                for instance_id in instance_ids:
+                    index = uuid.UUID(instance_id[5:]).int & (2**64 - 1)
+                    rows.extend(self.data.rows(index, index + 1))
+                body = {"value": [self.data.submission(r) for r in rows]}
+            else:
+                skip = int(query.get("$skip", ["0"])[0])
+                top = int(query.get("$top", [self.data.n_records])[0])
+                rows = self.data.rows(skip, skip + top)
+                body = {"value": [self.data.submission(r) for r in rows]}
+                if "$count" in query:
+                    body["@odata.count"] = self.data.n_records
+            if "$select" in query:
+                paths = query["$select"][0].split(",")
+                body["value"] = [_select(i, paths) for i in body["value"]]
+            self._send_json(handler, body)
+        else:
+            self._send_json(handler, {"message": "Not found"}, 404)
+
+    def _zipped_export(self, form_id):
+
+        with self._zip_lock:
+            if self._zip_file is None:
+                fd, self._zip_file = tempfile.mkstemp(suffix=".zip")
+                os.close(fd)
+                with zipfile.ZipFile(self._zip_file, "w",
+                                     zipfile.ZIP_DEFLATED) as z:
+                    with z.open(form_id + ".csv", "w") as f:
+                        for chunk in self.data.csv_chunks():
+                            f.write(chunk)
+            return self._zip_file
+
+
+def _select(submission, paths):
+    """Keep the fields of a submission listed in $select (paths of fields
+    or groups, e.g., __id or group/field)."""
+
+    selected = {}
+    for path in paths:
+        *groups, name = path.split("/")
+        node, target = submission, selected
+        for group in groups:
+            node = node.get(group, {})
+            target = target.setdefault(group, {})
+        if name in node:
+            target[name] = node[name]
+    return selected
+
+
+def _split(body, chunk_size=64 * 1024):
+
+    for i in range(0, len(body), chunk_size):
+        yield body[i:(i + chunk_size)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added before each response")
+    parser.add_argument("--bandwidth", type=int, default=None,
+                        help="bytes per second (default: no limit)")
+    parser.add_argument("--port", type=int, default=8383)
+    args = parser.parse_args()
+    server = CentralStub(args.records, args.latency, args.bandwidth)
+    server.start(args.port)
+    print("Serving {0} records at {1} (Ctrl-C to stop)".format(args.records,
+                                                               server.url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
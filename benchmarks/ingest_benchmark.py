@@ -0,0 +1,280 @@
+"""
+benchmarks.ingest_benchmark
+---------------------------
+
+Benchmark the ingest steps of the pipeline -- ODK.central(),
+ODK.merge_to_prev_export(), and TransferDB.check_duplicates() -- against a
+local ODK Central stand-in (see central_stub.py) serving synthetic WHO 2016
+VA records.
+
+Each step runs in a fresh child process, so the reported peak resident set
+size (RSS) belongs to that step alone.  For every step the benchmark reports
+the number of records, wall time, throughput (records and MB per second),
+and peak RSS.  Example::
+
+    $ python benchmarks/ingest_benchmark.py --records 1000 10000 \\
+        --modes csv stream compressed --latency 0.1 --bandwidth 5000000 \\
+        --json results.json
+
+The merge step uses a previous export with half of its records in common
+with the download, and the duplicate check uses a Transfer DB that already
+stores half of the downloaded records.
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from central_stub import CentralStub, SyntheticVA  # noqa: E402
+
+DB_FILE_NAME = "Pipeline.db"
+DB_KEY = "enilepiP"
+CENTRAL_MODES = {
+    "csv": {},
+    "stream": {"stream": True},
+    "compressed": {"compressed": True},
+    "odata": None,
+}
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process (in MB)."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+def _odk_settings(url, working_directory):
+
+    nt_odk = namedtuple("nt_odk",
+                        ["odk_id", "odk_url", "odk_user", "odk_password",
+                         "odk_form_id", "odk_last_run", "odk_last_run_date",
+                         "odk_last_run_date_prev", "odk_use_central",
+                         "odk_project_number"])
+    nt_pipeline = namedtuple("nt_pipeline", ["working_directory"])
+    settings_odk = nt_odk(None, url, "user", "password", "va_who_v1_5_1",
+                          "1900-01-01_00:00:01", "1900/01/01", "1899/12/31",
+                          "True", "1")
+    return {"odk": settings_odk,
+            "pipeline": nt_pipeline(working_directory)}
+
+
+def _run_central(url, working_directory, mode):
+
+    from openva_pipeline.odk import ODK
+
+    pipeline_odk = ODK(_odk_settings(url, working_directory))
+    start = time.perf_counter()
+    if CENTRAL_MODES[mode] is None:
+        pipeline_odk.central_odata()
+    else:
+        pipeline_odk.central(**CENTRAL_MODES[mode])
+    wall = time.perf_counter() - start
+    export_file = os.path.join(working_directory, "ODKFiles",
+                               "odk_export_new.csv")
+    return {"records": pipeline_odk.n_records, "wall": wall,
+            "bytes": os.path.getsize(export_file)}
+
+
+def _run_merge(url, working_directory):
+
+    from openva_pipeline.odk import ODK
+
+    export_dir = os.path.join(working_directory, "ODKFiles")
+    n_bytes = sum(os.path.getsize(os.path.join(export_dir, i))
+                  for i in ["odk_export_new.csv", "odk_export_prev.csv"])
+    pipeline_odk = ODK(_odk_settings(url, working_directory))
+    start = time.perf_counter()
+    pipeline_odk.merge_to_prev_export()
+    wall = time.perf_counter() - start
+    with open(os.path.join(export_dir, "odk_export_prev.csv"), "r",
+              newline="") as f:
+        n_records = sum(1 for _ in csv.reader(f)) - 1
+    return {"records": n_records, "wall": wall, "bytes": n_bytes}
+
+
+def _run_check_duplicates(working_directory):
+
+    from openva_pipeline.transfer_db import TransferDB
+
+    xfer_db = TransferDB(db_file_name=DB_FILE_NAME,
+                         db_directory=working_directory,
+                         db_key=DB_KEY,
+                         pl_run_date=True)
+    xfer_db.config_pipeline()
+    export_file = os.path.join(working_directory, "ODKFiles",
+                               "odk_export_new.csv")
+    n_bytes = os.path.getsize(export_file)
+    start = time.perf_counter()
+    results = xfer_db.check_duplicates(use_dhis=False)
+    wall = time.perf_counter() - start
+    return {"records": results["n_records"], "wall": wall, "bytes": n_bytes,
+            "duplicates": results["n_duplicates"]}
+
+
+def _child(queue, target, args):
+
+    try:
+        result = target(*args)
+        result["peak_rss_mb"] = _peak_rss_mb()
+        queue.put(result)
+    except Exception as exc:
+        queue.put({"error": repr(exc)})
+
+
+def run_stage(target, *args):
+    """Run one step of the benchmark in a new process.
+
+    :parameter target: Function that runs the step and returns the number
+     of records, wall time, and number of bytes processed.
+    :type target: function
+    :returns: Results for the step (including peak RSS).
+    :rtype: dict
+    """
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(queue, target, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+
+def _write_previous_export(file_name, n_records):
+    """Previous export sharing half of its records with the download."""
+
+    data = SyntheticVA(n_records + n_records // 2)
+    with open(file_name, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(data.header)
+        writer.writerows(data.rows(n_records // 2))
+
+
+def _setup_transfer_db(working_directory, n_records):
+    """Transfer DB that already stores half of the downloaded records."""
+
+    from openva_pipeline.run_pipeline import create_transfer_db
+    from openva_pipeline.transfer_db import TransferDB
+
+    create_transfer_db(DB_FILE_NAME, working_directory, DB_KEY)
+    xfer_db = TransferDB(db_file_name=DB_FILE_NAME,
+                         db_directory=working_directory,
+                         db_key=DB_KEY,
+                         pl_run_date=True)
+    xfer_db.update_table("Pipeline_Conf", "workingDirectory",
+                         working_directory)
+    data = SyntheticVA(n_records)
+    conn = xfer_db._connect_db()
+    conn.executemany(
+        "INSERT INTO VA_Storage (id, outcome) VALUES (?, ?)",
+        [(data.instance_id(i), "Pushed to DHIS2")
+         for i in range(0, n_records, 2)])
+    conn.commit()
+    conn.close()
+
+
+def benchmark(n_records, modes, latency, bandwidth):
+    """Run all steps for one size of the ODK Central server.
+
+    :parameter n_records: Number of records on the server.
+    :type n_records: int
+    :parameter modes: Download modes for ODK.central() (csv, stream,
+     compressed, odata).
+    :type modes: list
+    :parameter latency: Seconds added before each response.
+    :type latency: float
+    :parameter bandwidth: Bytes per second (None for no limit).
+    :type bandwidth: int
+    :returns: Results for each step.
+    :rtype: list of dict
+    """
+
+    results = []
+    stub = CentralStub(n_records, latency, bandwidth).start()
+    working_directory = tempfile.mkdtemp(prefix="ingest_benchmark_")
+    export_dir = os.path.join(working_directory, "ODKFiles")
+    export_file = os.path.join(export_dir, "odk_export_new.csv")
+    try:
+        for mode in modes:
+            result = run_stage(_run_central, stub.url, working_directory,
+                               mode)
+            result["stage"] = "central ({0})".format(mode)
+            results.append(result)
+        shutil.copy(export_file, export_file + ".bak")
+
+        _write_previous_export(
+            os.path.join(export_dir, "odk_export_prev.csv"), n_records)
+        result = run_stage(_run_merge, stub.url, working_directory)
+        result["stage"] = "merge_to_prev_export"
+        results.append(result)
+
+        shutil.move(export_file + ".bak", export_file)
+        _setup_transfer_db(working_directory, n_records)
+        result = run_stage(_run_check_duplicates, working_directory)
+        result["stage"] = "check_duplicates"
+        results.append(result)
+    finally:
+        stub.stop()
+        shutil.rmtree(working_directory, ignore_errors=True)
+    for result in results:
+        result["n_server_records"] = n_records
+        result["records_per_s"] = result["records"] / result["wall"]
+        result["mb_per_s"] = result["bytes"] / 2 ** 20 / result["wall"]
+    return results
+
+
+def print_results(results):
+    """Print a table with the results."""
+
+    line = "{0:>9} {1:<22} {2:>9} {3:>9} {4:>11} {5:>8} {6:>9}"
+    print(line.format("server", "stage", "records", "wall (s)", "records/s",
+                      "MB/s", "RSS (MB)"))
+    for r in results:
+        print(line.format(r["n_server_records"], r["stage"], r["records"],
+                          "{0:.2f}".format(r["wall"]),
+                          "{0:.0f}".format(r["records_per_s"]),
+                          "{0:.1f}".format(r["mb_per_s"]),
+                          "{0:.0f}".format(r["peak_rss_mb"])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ODK ingest steps of the openVA Pipeline.")
+    parser.add_argument("--records", type=int, nargs="+", default=[1000],
+                        help="number(s) of records on the server")
+    parser.add_argument("--modes", nargs="+", default=["csv", "stream"],
+                        choices=sorted(CENTRAL_MODES),
+                        help="download modes for ODK.central()")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added before each response")
+    parser.add_argument("--bandwidth", type=int, default=None,
+                        help="bytes per second (default: no limit)")
+    parser.add_argument("--json", default=None,
+                        help="file for saving the results")
+    args = parser.parse_args()
+
+    all_results = []
+    for n in args.records:
+        all_results.extend(benchmark(n, args.modes, args.latency,
+                                     args.bandwidth))
+    print_results(all_results)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(all_results, f, indent=2)
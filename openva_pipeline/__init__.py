@@ -8,12 +8,15 @@ from .pipeline import Pipeline
 from .transfer_db import TransferDB
 from .odk import ODK
 from .openva import OpenVA
+from .r_worker import RWorker
+from .supervisor import run_supervised
 from .dhis import API
 from .dhis import VerbalAutopsyEvent
 from .dhis import create_db
 from .dhis import get_cod_code
 from .dhis import find_key_value
 from .dhis import DHIS
+from .va_data import read_va_csv
 from .exceptions import PipelineError
 from .exceptions import DatabaseConnectionError
 from .exceptions import PipelineConfigurationError
@@ -23,4 +26,8 @@ from .exceptions import DHISConfigurationError
 from .exceptions import ODKError
 from .exceptions import OpenVAError
 from .exceptions import SmartVAError
+from .exceptions import OpenVATimeoutError
+from .exceptions import OpenVAMemoryError
+from .exceptions import SmartVATimeoutError
+from .exceptions import SmartVAMemoryError
 from .exceptions import DHISError
@@ -20,6 +20,7 @@ from typing import Union, Dict
 
 import openva_pipeline
 from .exceptions import DHISError
+from .va_data import find_va_file, read_va_file, record_storage_to_eva
 
 
 class API(object):
@@ -526,9 +527,12 @@ class DHIS:
     def post_va(self, xfer_db: openva_pipeline.transfer_db.TransferDB) -> Dict:
         """Post VA records to DHIS.
 
-        This method reads in a CSV file ("entity_attributes_value.csv") with
-        cause of death results (from openVA) then formats events and posts
-        them to a VA Program (installed on DHIS2 server).
+        This method reads in a CSV file ("record_storage.csv") with cause of
+        death results (from openVA) then formats events and posts them to a
+        VA Program (installed on DHIS2 server).  The blob of each event (the
+        record in Entity-Attribute-Value format) is created from the records
+        that are posted (see :func:`record_storage_to_eva()
+        <openva_pipeline.va_data.record_storage_to_eva>`).
 
         :parameter xfer_db: Transfer Database instance
         :type xfer_db: openva_pipeline.transfer_db.TransferDB
@@ -538,11 +542,7 @@ class DHIS:
         :raises: DHISError
         """
 
-        eva_path = os.path.join(self.dir_openva, "entity_attribute_value.csv")
-        if not os.path.isfile(eva_path):
-            raise DHISError("Missing: " + eva_path)
-        record_storage_path = os.path.join(self.dir_openva,
-                                           "record_storage.csv")
+        record_storage_path = find_va_file(self.dir_openva, "record_storage")
         if not os.path.isfile(record_storage_path):
             raise DHISError("Missing: " + record_storage_path)
         new_storage_path = os.path.join(self.dir_openva, "new_storage.csv")
@@ -555,9 +555,10 @@ class DHIS:
             raise DHISError(
                 "Unable to create directory for DHIS blobs.") from exc
 
-        df_dhis = read_csv(eva_path)
-        grouped = df_dhis.groupby(["ID"])
-        df_record_storage = read_csv(record_storage_path)
+        df_record_storage = read_va_file(record_storage_path)
+        has_cod = df_record_storage["cod"] != "MISSING"
+        df_eva = record_storage_to_eva(df_record_storage[has_cod])
+        grouped = df_eva.groupby("ID", sort=False)
 
         va_org_units = self._get_org_units(va_program=True)
         valid_org_unit_ids = list(va_org_units.values())
@@ -44,3 +44,19 @@ class OpenVAError(PipelineError):
 
 class SmartVAError(PipelineError):
     """An error occurred with the openVA module."""
+
+
+class OpenVATimeoutError(OpenVAError):
+    """The openVA R script ran longer than Pipeline_Conf.openvaTimeout."""
+
+
+class OpenVAMemoryError(OpenVAError):
+    """The openVA R script used more memory than it was allowed."""
+
+
+class SmartVATimeoutError(SmartVAError):
+    """SmartVA ran longer than Pipeline_Conf.openvaTimeout."""
+
+
+class SmartVAMemoryError(SmartVAError):
+    """SmartVA used more memory than it was allowed."""
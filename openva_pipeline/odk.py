@@ -7,9 +7,18 @@ This module uses ODK Briefcase to pull VA records from an ODK Aggregate server.
 
 import subprocess
 import os
+import re
 import shutil
 import requests
 import csv
+import json
+import hashlib
+import zipfile
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
 
 from .exceptions import ODKError
 
@@ -32,6 +41,7 @@ class ODK:
 
         odk_settings = settings["odk"]
         pipeline_settings = settings["pipeline"]
+        self.settings = settings
         self.odk_id = odk_settings.odk_id
         self.odk_url = odk_settings.odk_url
         self.odk_user = odk_settings.odk_user
@@ -52,6 +62,15 @@ class ODK:
         self.storage_dir = odk_path
         self.file_name = "odk_export_new.csv"
         self.n_records = None
+        self.sources_succeeded = []
+        self.sources_failed = []
+        self.timings = {}
+        self.algorithm = getattr(pipeline_settings, "algorithm", None)
+        self.algorithm_metadata_code = getattr(pipeline_settings,
+                                               "algorithm_metadata_code", None)
+        self.dhis_org_unit = None
+        if "dhis" in settings.keys():
+            self.dhis_org_unit = str(settings["dhis"][0].dhis_org_unit)
 
         try:
             if not os.path.isdir(odk_path):
@@ -60,7 +79,16 @@ class ODK:
             raise ODKError("Unable to create directory " + odk_path) from exc
 
     def merge_to_prev_export(self):
-        """Merge previous ODK Briefcase export files."""
+        """Merge previous ODK Briefcase export files.
+
+        The VA records in odk_export_new.csv are appended to
+        odk_export_prev.csv unless a record with the same instance ID is
+        already there.  Both files are streamed (only the instance IDs of the
+        previous export are kept in memory, in a set), so the merge runs in
+        linear time.  If the exports have different columns, the previous
+        export is rewritten with the union of both headers.  Exports without
+        an instance ID column are matched on the (hashed) text of the records.
+        """
 
         export_file_prev = os.path.join(self.export_dir,
                                         "odk_export_prev.csv")
@@ -70,19 +98,114 @@ class ODK:
         is_export_file_new = os.path.isfile(export_file_new)
 
         if is_export_file_prev and is_export_file_new:
-            with open(export_file_new, "r", newline="") as f_new:
-                f_new_lines = f_new.readlines()
-            with open(export_file_prev, "r", newline="") as f_prev:
-                f_prev_lines = f_prev.readlines()
-            with open(export_file_prev, "a", newline="") as f_combined:
-                for line in f_new_lines:
-                    if line not in f_prev_lines:
-                        f_combined.write(line)
-            os.remove(export_file_new)
+            with open(export_file_prev, "r", newline="") as f_prev, \
+                    open(export_file_new, "r", newline="") as f_new:
+                prev_records = _RecordReader(f_prev)
+                new_records = _RecordReader(f_new)
+                id_prev = self._find_id_column(prev_records.header)
+                id_new = self._find_id_column(new_records.header)
+                if id_prev is None or id_new is None:
+                    id_prev = id_new = None
+                keys = {prev_records.key(row, raw, id_prev)
+                        for row, raw in prev_records}
+                if prev_records.header is None:
+                    is_export_file_prev = False
+                elif new_records.header == prev_records.header:
+                    self._append_records(export_file_prev, new_records,
+                                         keys, id_new)
+                elif new_records.header is not None:
+                    header = prev_records.header + [
+                        i for i in new_records.header
+                        if i not in prev_records.header]
+                    self._rewrite_records(export_file_prev, header,
+                                          new_records, keys, id_new)
+            if is_export_file_prev:
+                os.remove(export_file_new)
 
         if is_export_file_new and not is_export_file_prev:
             shutil.move(export_file_new, export_file_prev)
 
+    def _find_id_column(self, header):
+        """Find the instance ID column in an export header.
+
+        :parameter header: Column names of an ODK export.
+        :type header: list or None
+        :rtype: str or None
+        """
+
+        if header is None:
+            return None
+        if self.odk_id is not None and self.odk_id in header:
+            return self.odk_id
+        match_instanceid = [i for i in header if "instanceid" in i.lower()]
+        if len(match_instanceid) == 0:
+            return None
+        return match_instanceid[0]
+
+    @staticmethod
+    def _append_records(file_name, records, keys, id_column):
+        """Append (raw) records with new keys to an export with the same
+        header.
+
+        :parameter file_name: Path of the export the records are added to.
+        :type file_name: str
+        :parameter records: Records from an export with the same header.
+        :type records: _RecordReader
+        :parameter keys: Keys of the records already in file_name.
+        :type keys: set
+        :parameter id_column: Name of the instance ID column (or None).
+        :type id_column: str or None
+        """
+
+        with open(file_name, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            ends_with_newline = True
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                ends_with_newline = f.read(1) in (b"\n", b"\r")
+        with open(file_name, "a", newline="") as f_combined:
+            if not ends_with_newline:
+                f_combined.write("\n")
+            for row, raw in records:
+                key = records.key(row, raw, id_column)
+                if key not in keys:
+                    keys.add(key)
+                    f_combined.write(raw)
+
+    @staticmethod
+    def _rewrite_records(file_name, header, records, keys, id_column):
+        """Rewrite an export with a new header and append records with new
+        keys.
+
+        :parameter file_name: Path of the export the records are added to.
+        :type file_name: str
+        :parameter header: Union of the column names of both exports.
+        :type header: list
+        :parameter records: Records from an export with a different header.
+        :type records: _RecordReader
+        :parameter keys: Keys of the records already in file_name.
+        :type keys: set
+        :parameter id_column: Name of the instance ID column (or None).
+        :type id_column: str or None
+        """
+
+        part_file = file_name + ".part"
+        with open(part_file, "w", newline="") as f_combined:
+            writer = csv.writer(f_combined)
+            writer.writerow(header)
+            with open(file_name, "r", newline="") as f_prev:
+                prev_records = _RecordReader(f_prev)
+                for row, _ in prev_records:
+                    row = dict(zip(prev_records.header, row))
+                    writer.writerow([row.get(i, "") for i in header])
+            for row, raw in records:
+                key = records.key(row, raw, id_column)
+                if key not in keys:
+                    keys.add(key)
+                    row = dict(zip(records.header, row))
+                    writer.writerow([row.get(i, "") for i in header])
+        os.replace(part_file, file_name)
+
     def briefcase(self):
         """Calls ODK Briefcase.
 
@@ -90,7 +213,16 @@ class ODK:
         application (via a command-line interface) to download a CSV file
         with verbal autopsy records from an ODK Aggregate server.
 
-        :returns: Return value from method subprocess.run()
+        After the pull, the submissions in the Briefcase storage directory
+        are compared with the manifest saved after the last export (see
+        :meth:`ODK._storage_manifest() <_storage_manifest>`).  If nothing
+        has changed (and there is no previous export waiting to be
+        processed), the export is skipped, no export file is created, and
+        n_records is set to 0.  The time (in seconds) spent in each step is
+        saved in the timings attribute.
+
+        :returns: Return value from method subprocess.run() (for the export,
+         or for the pull if the export was skipped)
         :rtype: subprocess.CompletedProcess
         :raises: ODKError
         """
@@ -124,8 +256,10 @@ class ODK:
             "--form_id",
             str('"' + self.odk_form_id + '"'),
         ]
+        self.timings = {}
+        start_time = time.perf_counter()
         try:
-            subprocess.run(
+            completed_pull = subprocess.run(
                 args=bc_args_plla,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
@@ -134,6 +268,25 @@ class ODK:
             )
         except subprocess.CalledProcessError as exc:
             raise ODKError(str(exc.stderr)) from exc
+        self.timings["pull"] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        manifest = self._storage_manifest()
+        manifest_file = os.path.join(self.storage_dir,
+                                     "briefcase_storage_manifest.json")
+        try:
+            with open(manifest_file, "r") as f:
+                prev_manifest = json.load(f)
+        except (OSError, ValueError):
+            prev_manifest = None
+        self.timings["scan"] = time.perf_counter() - start_time
+        export_file_prev = os.path.join(self.export_dir,
+                                        "odk_export_prev.csv")
+        if manifest == prev_manifest and not os.path.isfile(export_file_prev):
+            self.n_records = 0
+            self.timings["export"] = None
+            return completed_pull
+
         bc_args_export = [
             "java",
             "-jar",
@@ -152,6 +305,7 @@ class ODK:
             "--overwrite_csv_export",
             "--exclude_media_export",
         ]
+        start_time = time.perf_counter()
         try:
             completed_export = subprocess.run(
                 args=bc_args_export,
@@ -162,18 +316,86 @@ class ODK:
             )
         except subprocess.CalledProcessError as exc:
             raise ODKError(str(exc.stderr)) from exc
+        self.timings["export"] = time.perf_counter() - start_time
+        try:
+            with open(manifest_file, "w") as f:
+                json.dump(manifest, f)
+        except OSError as exc:
+            raise ODKError("Unable to write " + manifest_file) from exc
         return completed_export
 
-    def central(self):
+    def _storage_manifest(self):
+        """Summarise the submissions in the ODK Briefcase storage directory.
+
+        The path, modification time, and size of every submission.xml file
+        are hashed into a single digest, so any new, removed, or updated
+        submission changes the manifest (without reading the files).
+
+        :returns: Form ID, number of submissions, and digest.
+        :rtype: dict
+        """
+
+        storage = os.path.join(self.storage_dir, "ODK Briefcase Storage")
+        digest = hashlib.sha1()
+        n_instances = 0
+        for root, dirs, files in os.walk(storage):
+            dirs.sort()
+            if "submission.xml" in files:
+                path = os.path.join(root, "submission.xml")
+                stat = os.stat(path)
+                digest.update("{0}|{1}|{2}\n".format(
+                    os.path.relpath(path, storage), stat.st_mtime_ns,
+                    stat.st_size).encode())
+                n_instances += 1
+        return {"form_id": self.odk_form_id,
+                "n_instances": n_instances,
+                "digest": digest.hexdigest()}
+
+    def central(self, stream=False, select_columns=False, compressed=False,
+                retries=0, backoff=2.0):
         """Connects to ODK Central through api.
 
         This method calls requests.get to download a CSV file with verbal
-        autopsy records from an ODK Collect server.
+        autopsy records from an ODK Collect server.  With stream=True, the
+        response is written to disk in chunks as it arrives (and the records
+        are counted on the fly), so the export is never held in memory.
+        With select_columns=True, only the columns used by the later steps
+        are downloaded (see :meth:`ODK.select_columns() <select_columns>`)
+        through :meth:`ODK.central_odata() <central_odata>`, since the CSV
+        export does not support column selection (so select_columns cannot
+        be combined with stream, compressed, or retries; see
+        :meth:`ODK.check_central_options() <check_central_options>`).
+        With compressed=True, the zipped export (submissions.csv.zip, without
+        attachments) is streamed to disk and the CSV file is then extracted
+        in chunks to odk_export_new.csv.  (The plain CSV download is already
+        gzip-compressed in transit when the server supports it, and is
+        decompressed on the fly by requests.)
+        Streamed downloads are retried (after a connection error, timeout,
+        or server error) up to retries times, waiting backoff, 2 * backoff,
+        4 * backoff, ... seconds between attempts.  The partial download is
+        kept, and the next attempt (or the next run of the pipeline) resumes
+        it with an HTTP Range request if the server supports it.
 
+        :parameter stream: Indicator for streaming the export to disk.
+        :type stream: bool
+        :parameter select_columns: Indicator for only downloading the columns
+         needed by the configured algorithm.
+        :type select_columns: bool
+        :parameter compressed: Indicator for downloading the zipped export.
+        :type compressed: bool
+        :parameter retries: Number of times a failed download is resumed
+         (implies stream=True if greater than 0).
+        :type retries: int
+        :parameter backoff: Number of seconds to wait before the first retry.
+        :type backoff: float
         :returns: Returns a string indicating the number of downloaded records.
         :rtype: string
         :raises: ODKError
         """
+        self.check_central_options(select_columns, stream, compressed,
+                                   retries)
+        if select_columns:
+            return self.central_odata(select_columns=True)
         export_file_new = os.path.join(self.export_dir, self.file_name)
         url = os.path.join(
             self.odk_url,
@@ -187,10 +409,723 @@ class ODK:
             "?$filter=__system/submissionDate%20ge%20"
             + self.odk_last_run_date.replace("/", "-")
         )
+        if compressed:
+            url += ".zip"
+            data_filter += "&attachments=false"
+
+        if compressed:
+            zip_file = export_file_new + ".zip"
+            self._download(url + data_filter, zip_file, retries, backoff)
+            try:
+                n_lines = self._extract_export(zip_file, export_file_new)
+            finally:
+                os.remove(zip_file)
+            self.n_records = n_lines - 1
+            return f"Downloaded {self.n_records} records."
+
+        if stream or retries > 0:
+            n_lines = self._download(url + data_filter, export_file_new,
+                                     retries, backoff)
+            self.n_records = n_lines - 1
+            return f"Downloaded {self.n_records} records."
+
+        r = self._get_central(url + data_filter)
+        if r.status_code != 200:
+            raise ODKError(
+                "Error getting data from ODK Central: {0}".format(r.text))
+
+        odk_text = r.text.splitlines()
+        self.n_records = len(odk_text) - 1
+        odk_reader = csv.reader(odk_text, delimiter=',', quotechar='"')
+        odk_data = [row for row in odk_reader]
+        with open(export_file_new, "w") as f:
+            writer = csv.writer(f)
+            writer.writerows(odk_data)
+        return f"Downloaded {self.n_records} records."
+
+    @staticmethod
+    def check_central_options(odata=False, stream=False, compressed=False,
+                              retries=0):
+        """Check that the ODK Central download options can be combined.
+
+        The OData API (used by :meth:`ODK.central_odata() <central_odata>`,
+        :meth:`ODK.central_missing() <central_missing>`, and for
+        select_columns) returns the records in JSON pages, so the options
+        of the CSV export (stream, compressed, and retries) do not apply to
+        it.
+
+        :parameter odata: Indicator for downloading through the OData API.
+        :type odata: bool
+        :parameter stream: Indicator for streaming the CSV export to disk.
+        :type stream: bool
+        :parameter compressed: Indicator for downloading the zipped export.
+        :type compressed: bool
+        :parameter retries: Number of times a failed download is resumed.
+        :type retries: int
+        :raises: ODKError if the OData API is combined with stream,
+         compressed, or retries.
+        """
+
+        if odata and (stream or compressed or retries > 0):
+            raise ODKError("Downloads through the OData API (odata, "
+                           "skip_stored, or select_columns) cannot be "
+                           "combined with stream, compressed, or retries")
+
+    def central_sources(self, sources, max_workers=4, stored_ids=None,
+                        odata=False, **kwargs):
+        """Download VA records from several ODK Central forms/projects.
+
+        Each source (e.g., a different version of the VA questionnaire, or
+        the same form in another project) is downloaded with
+        :meth:`ODK.central() <central>` -- or with
+        :meth:`ODK.central_missing() <central_missing>` if stored_ids is
+        given, or :meth:`ODK.central_odata() <central_odata>` if odata is
+        True -- in its own thread, to a separate export file.  The exports
+        are then combined into odk_export_new.csv (see
+        :meth:`ODK._combine_exports() <_combine_exports>`).  A source
+        that fails does not stop the others: its error is kept in
+        sources_failed (and its records are downloaded in the next run, since
+        only the sources in sources_succeeded should have their last run date
+        updated).
+
+        :parameter sources: ODK settings for each source (as returned by
+         :meth:`TransferDB.config_odk_sources()
+         <openva_pipeline.transfer_db.TransferDB.config_odk_sources>`).
+        :type sources: list of (named) tuples
+        :parameter max_workers: Number of sources downloaded at the same time.
+        :type max_workers: int
+        :parameter stored_ids: Instance IDs of the stored VA records, or a
+         function that returns the stored IDs among a list of IDs (see
+         :meth:`ODK.central_missing() <central_missing>`).
+        :type stored_ids: list or function
+        :parameter odata: Indicator for downloading each source through the
+         OData API.
+        :type odata: bool
+        :parameter kwargs: Options passed on to ODK.central() (e.g.,
+         stream=True); only select_columns is passed on to
+         ODK.central_missing() and ODK.central_odata() (see
+         :meth:`ODK.check_central_options() <check_central_options>`).
+        :returns: Returns a string indicating the number of downloaded records.
+        :rtype: string
+        :raises: ODKError
+        """
+
+        self.check_central_options(
+            stored_ids is not None or odata or
+            kwargs.get("select_columns", False),
+            kwargs.get("stream", False), kwargs.get("compressed", False),
+            kwargs.get("retries", 0))
+        export_file_new = os.path.join(self.export_dir, self.file_name)
+
+        def fetch(source):
+            source_odk = ODK(dict(self.settings, odk=source))
+            source_odk.file_name = "odk_export_{0}_{1}.csv".format(
+                source.odk_project_number, source.odk_form_id)
+            if stored_ids is not None:
+                source_odk.central_missing(
+                    stored_ids,
+                    select_columns=kwargs.get("select_columns", False))
+            elif odata:
+                source_odk.central_odata(
+                    select_columns=kwargs.get("select_columns", False))
+            else:
+                source_odk.central(**kwargs)
+            return os.path.join(self.export_dir, source_odk.file_name)
+
+        self.sources_succeeded = []
+        self.sources_failed = []
+        source_files = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fetch, i) for i in sources]
+            for source, future in zip(sources, futures):
+                try:
+                    source_files.append(future.result())
+                    self.sources_succeeded.append(source)
+                except ODKError as exc:
+                    self.sources_failed.append(
+                        (source, "Unable to download form {0} (project {1}): "
+                         "{2}".format(source.odk_form_id,
+                                      source.odk_project_number, exc)))
+        if len(self.sources_succeeded) == 0:
+            raise ODKError("; ".join(i[1] for i in self.sources_failed))
+        try:
+            self.n_records = self._combine_exports(source_files,
+                                                   export_file_new)
+        finally:
+            for source_file in source_files:
+                if os.path.isfile(source_file):
+                    os.remove(source_file)
+        return (f"Downloaded {self.n_records} records from "
+                f"{len(self.sources_succeeded)} of {len(sources)} forms.")
+
+    def _combine_exports(self, source_files, file_name):
+        """Combine the exports from several forms into one file.
+
+        The header of the combined export is the union of the headers of the
+        exports, and the columns are matched on their full names.  Forms
+        with different group structures (e.g., different versions of the VA
+        questionnaire) can export a field under different column names, and
+        the later steps only use the last part of the name (after the final
+        "-"), so exports with different columns that end in the same name
+        (e.g., group1-age and group2-age) are not combined: it cannot be
+        told whether they hold the same question.  Records whose instance
+        ID was already written are skipped.
+
+        :parameter source_files: Paths of the exports.
+        :type source_files: list
+        :parameter file_name: Path of the combined export.
+        :type file_name: str
+        :returns: Number of records written to file_name.
+        :rtype: int
+        :raises: ODKError if columns of different exports end in the same
+         name.
+        """
+
+        def last_part(column):
+            return column.split("-")[-1].lower()
+
+        header = []
+        # last part of the name -> column, for the columns of the previous
+        # exports
+        names = {}
+        for source_file in source_files:
+            with open(source_file, "r", newline="") as f:
+                source_header = _RecordReader(f).header or []
+            for column in source_header:
+                previous = names.get(last_part(column))
+                if previous is not None and previous != column and \
+                        column not in header:
+                    raise ODKError(
+                        "Unable to combine the exports of the ODK Central "
+                        "forms: the columns {0} and {1} end in the same "
+                        "name".format(previous, column))
+            for column in source_header:
+                if column not in header:
+                    header.append(column)
+                    names.setdefault(last_part(column), column)
+
+        id_column = self._find_id_column(header)
+        keys = set()
+        n_records = 0
+        part_file = file_name + ".part"
+        with open(part_file, "w", newline="") as f_combined:
+            writer = csv.writer(f_combined)
+            writer.writerow(header)
+            for source_file in source_files:
+                with open(source_file, "r", newline="") as f:
+                    records = _RecordReader(f)
+                    for row, _ in records:
+                        row = dict(zip(records.header, row))
+                        key = row.get(id_column) if id_column else None
+                        if key:
+                            if key in keys:
+                                continue
+                            keys.add(key)
+                        writer.writerow([row.get(i, "") for i in header])
+                        n_records += 1
+        os.replace(part_file, file_name)
+        return n_records
+
+    def central_odata(self, page_size=1000, max_workers=4, page_retries=2,
+                      select_columns=False):
+        """Download VA records from the ODK Central OData Submissions feed.
+
+        This method is an alternative to :meth:`ODK.central() <central>`. It
+        requests the submissions in pages (using $top and $skip) and fetches
+        the pages concurrently with a small pool of worker threads.  A page
+        that fails is retried on its own (up to page_retries times) instead
+        of restarting the whole download.  The pages are then assembled into
+        the same CSV export (i.e., group names joined with "-" in the column
+        names, plus the SubmissionDate, KEY, etc. columns) produced by
+        ODK.central().
+
+        :parameter page_size: Number of submissions requested per page.
+        :type page_size: int
+        :parameter max_workers: Number of pages downloaded at the same time.
+        :type max_workers: int
+        :parameter page_retries: Number of times a failed page is requested
+         again before giving up.
+        :type page_retries: int
+        :parameter select_columns: Indicator for only downloading the columns
+         needed by the configured algorithm (see
+         :meth:`ODK.select_columns() <select_columns>`).
+        :type select_columns: bool
+        :returns: Returns a string indicating the number of downloaded records.
+        :rtype: string
+        :raises: ODKError
+        """
+
+        export_file_new = os.path.join(self.export_dir, self.file_name)
+        url = os.path.join(
+            self.odk_url,
+            "v1/projects",
+            self.odk_project_number,
+            "forms",
+            self.odk_form_id + ".svc",
+            "Submissions",
+        )
+        params = self._odata_params(page_size, select_columns)
+        self.n_records = self._download_odata_pages(
+            url, params, export_file_new, max_workers, page_retries)
+        return f"Downloaded {self.n_records} records."
+
+    def _odata_params(self, page_size, select_columns):
+        """OData query options for the submissions since the last run.
+
+        :parameter page_size: Number of submissions requested per page.
+        :type page_size: int
+        :parameter select_columns: Indicator for only requesting the columns
+         needed by the configured algorithm.
+        :type select_columns: bool
+        :returns: Query options (without $skip).
+        :rtype: dict
+        """
+
+        # the upper bound keeps the pages stable if new submissions arrive
+        # while the download is running (they are picked up by the next run)
+        start_time = datetime.now(timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%S.000Z")
+        params = {
+            "$filter": ("__system/submissionDate ge " +
+                        self.odk_last_run_date.replace("/", "-") +
+                        " and __system/submissionDate le " + start_time),
+            "$top": page_size,
+        }
+        if select_columns:
+            columns = self.select_columns()
+            if columns is not None:
+                params["$select"] = ",".join(["__id", "__system"] + columns)
+        return params
+
+    def _download_odata_pages(self, url, params, file_name, max_workers,
+                              page_retries):
+        """Download the pages of the OData Submissions feed concurrently and
+        assemble them into one CSV export.
+
+        :parameter url: Address of the OData Submissions feed.
+        :type url: str
+        :parameter params: OData query options (see :meth:`_odata_params`).
+        :type params: dict
+        :parameter file_name: Path of the CSV export.
+        :type file_name: str
+        :parameter max_workers: Number of pages downloaded at the same time.
+        :type max_workers: int
+        :parameter page_retries: Number of times a failed page is requested
+         again before giving up.
+        :type page_retries: int
+        :returns: Number of records in the export.
+        :rtype: int
+        :raises: ODKError
+        """
+
+        page_size = params["$top"]
+        first_page = self._get_odata_page(
+            url, dict(params, **{"$skip": 0, "$count": "true"}), page_retries)
+        n_total = first_page.get("@odata.count", len(first_page["value"]))
+        pages = [first_page] + [dict(params, **{"$skip": skip})
+                                for skip in range(page_size, n_total,
+                                                  page_size)]
+        return self._download_odata_requests(url, pages, file_name,
+                                             max_workers, page_retries)
+
+    def _download_odata_requests(self, url, pages, file_name, max_workers,
+                                 page_retries):
+        """Request pages of the OData Submissions feed concurrently and
+        assemble them into one CSV export (in the order of pages).
+
+        :parameter url: Address of the OData Submissions feed.
+        :type url: str
+        :parameter pages: OData query options of each page (or the decoded
+         response, for a page that was already requested).
+        :type pages: list of dict
+        :parameter file_name: Path of the CSV export.
+        :type file_name: str
+        :parameter max_workers: Number of pages downloaded at the same time.
+        :type max_workers: int
+        :parameter page_retries: Number of times a failed page is requested
+         again before giving up.
+        :type page_retries: int
+        :returns: Number of records in the export.
+        :rtype: int
+        :raises: ODKError
+        """
+
+        page_names = [file_name + f".page{i}" for i in range(len(pages))]
+
+        def fetch(page_number):
+            page = pages[page_number]
+            if "value" not in page:
+                page = self._get_odata_page(url, page, page_retries)
+            return self._write_odata_page(page["value"],
+                                          page_names[page_number])
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                page_files = list(executor.map(fetch,
+                                               range(len(page_names))))
+            return self._assemble_pages(page_files, file_name)
+        finally:
+            for page_name in page_names:
+                if os.path.isfile(page_name):
+                    os.remove(page_name)
+
+    def central_missing(self, stored_ids, page_size=1000, max_workers=4,
+                        page_retries=2, select_columns=False, batch_size=50):
+        """Download only the VA records that are not already stored.
+
+        This method first requests the instance IDs of the submissions since
+        the last run date from the OData API (in pages of page_size IDs,
+        with $select=__id, so no form data is sent).  The IDs that are not
+        stored are then requested in batches of batch_size records (with a
+        $filter on __id) and written to the same CSV export as
+        :meth:`ODK.central() <central>`, so only the missing records are
+        downloaded.  Nothing else is downloaded when all of the new
+        submissions are already stored.
+
+        :parameter stored_ids: Instance IDs of the VA records already in the
+         Transfer database, or a function that takes a list of instance IDs
+         and returns those that are stored (e.g.,
+         :meth:`TransferDB.find_stored_va_ids()
+         <openva_pipeline.transfer_db.TransferDB.find_stored_va_ids>`).
+        :type stored_ids: list or function
+        :parameter page_size: Number of instance IDs requested per page.
+        :type page_size: int
+        :parameter max_workers: Number of pages (or batches) downloaded at
+         the same time.
+        :type max_workers: int
+        :parameter page_retries: Number of times a failed request is repeated.
+        :type page_retries: int
+        :parameter select_columns: Indicator for only downloading the columns
+         needed by the configured algorithm (see
+         :meth:`ODK.select_columns() <select_columns>`).
+        :type select_columns: bool
+        :parameter batch_size: Number of missing records requested at once
+         (the instance IDs are sent in the URL, which limits its size).
+        :type batch_size: int
+        :returns: Returns a string indicating the number of downloaded records.
+        :rtype: string
+        :raises: ODKError
+        """
+
+        export_file_new = os.path.join(self.export_dir, self.file_name)
+        url = os.path.join(
+            self.odk_url,
+            "v1/projects",
+            self.odk_project_number,
+            "forms",
+            self.odk_form_id + ".svc",
+            "Submissions",
+        )
+        params = self._odata_params(page_size, select_columns)
+        new_ids = self._odata_ids(url, params, max_workers, page_retries)
+        if callable(stored_ids):
+            stored_ids = stored_ids(new_ids)
+        stored_ids = set(stored_ids)
+        missing_ids = [i for i in new_ids if i not in stored_ids]
+
+        batches = []
+        for i in range(0, len(missing_ids), batch_size):
+            batch = missing_ids[i:(i + batch_size)]
+            id_filter = " or ".join(
+                "__id eq '{0}'".format(va_id.replace("'", "''"))
+                for va_id in batch)
+            batch_params = {"$filter": id_filter}
+            if "$select" in params:
+                batch_params["$select"] = params["$select"]
+            batches.append(batch_params)
+        self.n_records = self._download_odata_requests(
+            url, batches, export_file_new, max_workers, page_retries)
+        return f"Downloaded {self.n_records} records."
+
+    def _odata_ids(self, url, params, max_workers, page_retries):
+        """Request the instance IDs of the submissions since the last run.
+
+        :parameter url: Address of the OData Submissions feed.
+        :type url: str
+        :parameter params: OData query options (see :meth:`_odata_params`).
+        :type params: dict
+        :parameter max_workers: Number of pages downloaded at the same time.
+        :type max_workers: int
+        :parameter page_retries: Number of times a failed request is repeated.
+        :type page_retries: int
+        :returns: Instance IDs (in the order of the feed).
+        :rtype: list
+        :raises: ODKError
+        """
+
+        params = dict(params, **{"$select": "__id"})
+        page_size = params["$top"]
+        first_page = self._get_odata_page(
+            url, dict(params, **{"$skip": 0, "$count": "true"}), page_retries)
+        n_total = first_page.get("@odata.count", len(first_page["value"]))
+
+        def fetch(skip):
+            page = self._get_odata_page(url, dict(params, **{"$skip": skip}),
+                                        page_retries)
+            return page["value"]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pages = [first_page["value"]] + list(executor.map(
+                fetch, range(page_size, n_total, page_size)))
+        new_ids = []
+        seen = set()
+        for submission in chain.from_iterable(pages):
+            va_id = submission.get("__id")
+            if va_id and va_id not in seen:
+                seen.add(va_id)
+                new_ids.append(va_id)
+        return new_ids
+
+    def select_columns(self):
+        """Find the form fields needed by the configured algorithm.
+
+        The fields are the input columns of the pycrossva mapping for the
+        configured WHO instrument version, the fields used in the R scripts
+        (instance ID, sex, dates of birth and death, and age), and the fields
+        matching the DHIS2 organisation unit setting (DHIS_Conf.dhisOrgUnit).
+        SmartVA uses the whole questionnaire, so no selection is made for it.
+
+        :returns: Paths of the selected fields (in OData $select format), or
+         None if all columns should be downloaded.
+        :rtype: list or None
+        """
+
+        if self.algorithm in (None, "SmartVA") or \
+                self.algorithm_metadata_code is None:
+            return None
+        needed = {"instanceid", "id10019", "id10021", "id10023",
+                  "ageinyears", "ageinyears2", "ageinmonths", "ageindays",
+                  "isneonatal", "ischild", "isadult"}
+        if self.odk_id is not None:
+            needed.add(self.odk_id.split("-")[-1].lower())
+        mapping_columns = self._pycrossva_source_columns()
+        if mapping_columns is None:
+            return None
+        needed.update(mapping_columns)
+        org_units = []
+        if self.dhis_org_unit is not None:
+            org_units = [i.lower() for i in re.split(r"\s|,",
+                                                     self.dhis_org_unit)
+                         if i != ""]
+
+        url = os.path.join(
+            self.odk_url,
+            "v1/projects",
+            self.odk_project_number,
+            "forms",
+            self.odk_form_id,
+            "fields?odata=true",
+        )
+        try:
+            r = self._get_central(url)
+            fields = r.json() if r.status_code == 200 else None
+        except (ODKError, ValueError):
+            fields = None
+        if not fields:
+            return None
+        columns = []
+        for field in fields:
+            if field.get("type") in ("structure", "repeat"):
+                continue
+            path = field["path"].strip("/")
+            name = path.split("/")[-1].lower()
+            if name in needed or any(ou in name for ou in org_units):
+                columns.append(path)
+        return columns
+
+    def _pycrossva_source_columns(self):
+        """Read the input columns from the pycrossva mapping file.
+
+        :returns: Lower case names of the source columns (or None if the
+         mapping file cannot be found).
+        :rtype: set or None
+        """
+
+        who_instrument_version = self.algorithm_metadata_code.split("|")[5]
+        if who_instrument_version == "v1_4_1":
+            pycva_instrument_version = "2016WHOv141"
+        else:
+            pycva_instrument_version = "2016WHOv151"
+        try:
+            import pycrossva
+        except ImportError:
+            return None
+        mapping_file = os.path.join(
+            os.path.dirname(pycrossva.__file__),
+            "resources",
+            "mapping_configuration_files",
+            pycva_instrument_version + "_to_InterVA5.csv"
+        )
+        try:
+            with open(mapping_file, "r", newline="") as f:
+                return {row["Source Column ID"].strip().lower()
+                        for row in csv.DictReader(f)
+                        if row.get("Source Column ID")}
+        except (OSError, KeyError):
+            return None
+
+    def _get_odata_page(self, url, params, page_retries):
+        """Request one page of the OData Submissions feed (with retries).
+
+        :parameter url: Address of the OData Submissions feed.
+        :type url: str
+        :parameter params: OData query options for the page.
+        :type params: dict
+        :parameter page_retries: Number of times a failed request is repeated.
+        :type page_retries: int
+        :returns: Decoded JSON response.
+        :rtype: dict
+        :raises: ODKError
+        """
+
+        for attempt in range(page_retries + 1):
+            if attempt > 0:
+                time.sleep(attempt)
+            try:
+                r = self._get_central(url, params=params)
+            except ODKError as exc:
+                error = exc
+                continue
+            if r.status_code == 200:
+                return r.json()
+            error = ODKError(
+                "Error getting data from ODK Central: {0}".format(r.text))
+            if r.status_code < 500:
+                break
+        raise error
+
+    def _write_odata_page(self, submissions, file_name):
+        """Flatten a page of OData submissions and write them to a CSV file.
+
+        :parameter submissions: Submissions from the "value" of an OData page.
+        :type submissions: list
+        :parameter file_name: Path of the CSV file for this page.
+        :type file_name: str
+        :returns: The path of the file and the column names (in order).
+        :rtype: tuple
+        """
+
+        rows = [self._flatten_submission(i) for i in submissions]
+        header = []
+        for row in rows:
+            header.extend(k for k in row if k not in header)
+        with open(file_name, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=header, restval="")
+            writer.writeheader()
+            writer.writerows(rows)
+        return file_name, header
+
+    @staticmethod
+    def _assemble_pages(page_files, file_name):
+        """Combine the page files into one export (in page order).
+
+        :parameter page_files: Page file names and their column names.
+        :type page_files: list of tuples
+        :parameter file_name: Path of the combined CSV export.
+        :type file_name: str
+        :returns: Number of (unique) records written to file_name.
+        :rtype: int
+        """
+
+        system_cols = ["KEY", "SubmitterID", "SubmitterName",
+                       "AttachmentsPresent", "AttachmentsExpected", "Status",
+                       "ReviewState", "DeviceID", "Edits", "FormVersion"]
+        header = ["SubmissionDate"]
+        for _, page_header in page_files:
+            header.extend(k for k in page_header
+                          if k not in header and k not in system_cols)
+        header.extend(k for k in system_cols
+                      if any(k in h for _, h in page_files))
+        # an export without records still needs the ID columns (which are
+        # checked in TransferDB.check_duplicates)
+        if not any("instanceid" in k.lower() for k in header):
+            header.insert(1, "meta-instanceID")
+        if "KEY" not in header:
+            header.append("KEY")
+        keys = set()
+        part_file = file_name + ".part"
+        with open(part_file, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=header, restval="")
+            writer.writeheader()
+            for page_file, _ in page_files:
+                with open(page_file, "r", newline="") as f_page:
+                    for row in csv.DictReader(f_page):
+                        if row.get("KEY") in keys:
+                            continue
+                        keys.add(row.get("KEY"))
+                        writer.writerow(row)
+        os.replace(part_file, file_name)
+        return len(keys)
+
+    @staticmethod
+    def _flatten_submission(submission, prefix=""):
+        """Convert an OData submission to a row of the CSV export.
+
+        :parameter submission: Submission (or group) from the OData feed.
+        :type submission: dict
+        :parameter prefix: Names of the enclosing groups.
+        :type prefix: str
+        :rtype: dict
+        """
+
+        system_names = {"submissionDate": "SubmissionDate",
+                        "submitterId": "SubmitterID",
+                        "submitterName": "SubmitterName",
+                        "attachmentsPresent": "AttachmentsPresent",
+                        "attachmentsExpected": "AttachmentsExpected",
+                        "status": "Status",
+                        "reviewState": "ReviewState",
+                        "deviceId": "DeviceID",
+                        "edits": "Edits",
+                        "formVersion": "FormVersion"}
+        row = {}
+        for key, value in submission.items():
+            if "@odata" in key:
+                continue
+            if key == "__id":
+                row["KEY"] = value
+            elif key == "__system":
+                for k, v in value.items():
+                    if k in system_names:
+                        row[system_names[k]] = "" if v is None else str(v)
+            elif isinstance(value, dict) and value.get("type") == "Point":
+                coordinates = [str(i) for i in value.get("coordinates", [])]
+                coordinates += [""] * 3
+                accuracy = str(value.get("properties", {}).get("accuracy", ""))
+                row[prefix + key + "-Latitude"] = coordinates[1]
+                row[prefix + key + "-Longitude"] = coordinates[0]
+                row[prefix + key + "-Altitude"] = coordinates[2]
+                row[prefix + key + "-Accuracy"] = accuracy
+            elif isinstance(value, dict):
+                row.update(ODK._flatten_submission(value, prefix + key + "-"))
+            elif isinstance(value, list):
+                row[prefix + key] = json.dumps(value)
+            elif value is None:
+                row[prefix + key] = ""
+            else:
+                row[prefix + key] = str(value)
+        return row
+
+    def _get_central(self, url, stream=False, params=None):
+        """Send a GET request to the ODK Central API.
+
+        :parameter url: Address of the API endpoint (including any query).
+        :type url: str
+        :parameter stream: Indicator for deferring the download of the
+         response body (see requests.get).
+        :type stream: bool
+        :parameter params: Query parameters added to the url.
+        :type params: dict
+        :returns: Response from the ODK Central server.
+        :rtype: requests.Response
+        :raises: ODKError
+        """
+
         username = self.odk_user
         password = self.odk_password
         try:
-            r = requests.get(url + data_filter, auth=(username, password))
+            r = requests.get(url, auth=(username, password), stream=stream,
+                             params=params)
         except requests.exceptions.ConnectionError as e:
             raise ODKError(
                 "Network problem, unable to connect to ODK Central" +
@@ -206,16 +1141,322 @@ class ODK:
                 "Exceeded number of maximum redirections from ODK Central " +
                 " server (using requests): {0}".format(e)
             )
+        return r
 
-        if r.status_code != 200:
-            raise ODKError(
-                "Error getting data from ODK Central: {0}".format(r.text))
+    def _download(self, url, file_name, retries=0, backoff=2.0,
+                  timeout=300, chunk_size=64 * 1024):
+        """Download a file from ODK Central, with retries and resumption.
 
-        odk_text = r.text.splitlines()
-        self.n_records = len(odk_text) - 1
-        odk_reader = csv.reader(odk_text, delimiter=',', quotechar='"')
-        odk_data = [row for row in odk_reader]
-        with open(export_file_new, "w") as f:
-            writer = csv.writer(f)
-            writer.writerows(odk_data)
-        return f"Downloaded {self.n_records} records."
+        The response is written one chunk at a time to a partial file
+        (file_name + ".part").  Along with the partial file, the url and the
+        validator (ETag or Last-Modified header) of the response are saved,
+        so an interrupted download can be resumed with an HTTP Range request
+        (with If-Range, so the server sends the whole file again if it has
+        changed).  The partial file only replaces file_name once it has been
+        checked (see :meth:`ODK._check_download() <_check_download>`).
+        A resumed request asks for the file without content encoding
+        (Accept-Encoding: identity), since the offset is the number of
+        decoded bytes already written.  The lines are counted as the chunks
+        are written.
+
+        :parameter url: Address of the file (including any query).
+        :type url: str
+        :parameter file_name: Path of the downloaded file.
+        :type file_name: str
+        :parameter retries: Number of times a failed download is resumed.
+        :type retries: int
+        :parameter backoff: Number of seconds to wait before the first retry
+         (the wait is doubled after each attempt).
+        :type backoff: float
+        :parameter timeout: Number of seconds to wait for the server.
+        :type timeout: float
+        :parameter chunk_size: Number of bytes read into memory at a time.
+        :type chunk_size: int
+        :returns: Number of lines in the downloaded file (including a last
+         line without a trailing newline).
+        :rtype: int
+        :raises: ODKError
+        """
+
+        part_file = file_name + ".part"
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                time.sleep(backoff * 2 ** (attempt - 1))
+            try:
+                complete = self._download_part(url, part_file, timeout,
+                                               chunk_size)
+            except requests.exceptions.ConnectionError as e:
+                error = ODKError(
+                    "Network problem, unable to connect to ODK Central" +
+                    " (using requests): {0}".format(e)
+                )
+                continue
+            except requests.exceptions.Timeout as e:
+                error = ODKError(
+                    "ODK Central server failing to respond after " +
+                    "establishing a connection (using requests): {0}".format(e)
+                )
+                continue
+            except requests.exceptions.ChunkedEncodingError as e:
+                error = ODKError(
+                    "Connection to ODK Central lost while downloading" +
+                    " (using requests): {0}".format(e)
+                )
+                continue
+            except requests.exceptions.TooManyRedirects as e:
+                raise ODKError(
+                    "Exceeded number of maximum redirections from ODK " +
+                    "Central server (using requests): {0}".format(e)
+                )
+            except requests.exceptions.RequestException as e:
+                # (a subclass of OSError, so it is caught before OSError)
+                error = ODKError(
+                    "Error downloading from ODK Central (using requests): " +
+                    "{0}".format(e)
+                )
+                continue
+            except OSError as e:
+                raise ODKError("Unable to write " + file_name) from e
+            if isinstance(complete, ODKError):
+                error = complete
+                continue
+            os.replace(part_file, file_name)
+            os.remove(part_file + ".json")
+            return complete
+        raise error
+
+    def _download_part(self, url, part_file, timeout, chunk_size):
+        """Request the (rest of the) file and append it to the partial file.
+
+        :parameter url: Address of the file (including any query).
+        :type url: str
+        :parameter part_file: Path of the partial file.
+        :type part_file: str
+        :parameter timeout: Number of seconds to wait for the server.
+        :type timeout: float
+        :parameter chunk_size: Number of bytes read into memory at a time.
+        :type chunk_size: int
+        :returns: Number of lines in the file if the download is complete,
+         or an ODKError (to be raised if there are no retries left) if it
+         should be retried.
+        :rtype: int or ODKError
+        :raises: ODKError, requests.exceptions.RequestException, OSError
+        """
+
+        state_file = part_file + ".json"
+        state = {}
+        if os.path.isfile(state_file) and os.path.isfile(part_file):
+            try:
+                with open(state_file, "r") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+        offset = 0
+        headers = {}
+        if state.get("url") == url and state.get("validator"):
+            offset = os.path.getsize(part_file)
+        if offset > 0:
+            # the range applies to the (unencoded) bytes already written
+            headers["Range"] = "bytes={0}-".format(offset)
+            headers["If-Range"] = state["validator"]
+            headers["Accept-Encoding"] = "identity"
+
+        r = requests.get(url, auth=(self.odk_user, self.odk_password),
+                         headers=headers, stream=True, timeout=timeout)
+        try:
+            if r.status_code == 416 or (
+                    r.status_code == 206 and
+                    r.headers.get("Content-Encoding",
+                                  "identity") != "identity"):
+                # the partial file cannot be resumed, so start again
+                os.remove(part_file)
+                os.remove(state_file)
+                return ODKError("Unable to resume download from ODK Central")
+            if r.status_code >= 500:
+                return ODKError(
+                    "Error getting data from ODK Central: {0}".format(r.text))
+            if r.status_code not in (200, 206):
+                raise ODKError(
+                    "Error getting data from ODK Central: {0}".format(r.text))
+            n_lines = 0
+            last_byte = b"\n"
+            expected_size = None
+            if r.status_code == 206:
+                expected_size = r.headers.get("Content-Range",
+                                              "").split("/")[-1]
+                # lines already downloaded (only read when resuming)
+                with open(part_file, "rb") as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b""):
+                        n_lines += chunk.count(b"\n")
+                        last_byte = chunk[-1:]
+                chunks = self._raw_chunks(r, chunk_size)
+            else:
+                offset = 0
+                if "Content-Encoding" not in r.headers:
+                    expected_size = r.headers.get("Content-Length")
+                chunks = r.iter_content(chunk_size=chunk_size)
+            validator = r.headers.get("ETag", r.headers.get("Last-Modified"))
+            with open(state_file, "w") as f:
+                json.dump({"url": url, "validator": validator}, f)
+            with open(part_file, "ab" if offset > 0 else "wb") as f:
+                for chunk in chunks:
+                    if chunk:
+                        f.write(chunk)
+                        n_lines += chunk.count(b"\n")
+                        last_byte = chunk[-1:]
+        finally:
+            r.close()
+        complete = self._check_download(part_file, expected_size)
+        if isinstance(complete, ODKError):
+            return complete
+        if last_byte != b"\n":
+            n_lines += 1
+        return n_lines
+
+    @staticmethod
+    def _raw_chunks(r, chunk_size):
+        """Read the body of a response as sent (without decoding it), with
+        the errors raised as by requests.Response.iter_content.
+
+        :parameter r: Response returned by requests.get(..., stream=True).
+        :type r: requests.Response
+        :parameter chunk_size: Number of bytes read into memory at a time.
+        :type chunk_size: int
+        :raises: requests.exceptions.RequestException
+        """
+
+        try:
+            yield from r.raw.stream(chunk_size, decode_content=False)
+        except ProtocolError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        except ReadTimeoutError as e:
+            raise requests.exceptions.ConnectionError(e)
+
+    @staticmethod
+    def _check_download(part_file, expected_size):
+        """Check that a partial file holds the complete download.
+
+        The size of the file must match the size announced by the server
+        (if any), a zip file must be readable, and a CSV file must at least
+        have a header line.
+
+        :parameter part_file: Path of the partial file.
+        :type part_file: str
+        :parameter expected_size: Size of the complete file (from the
+         Content-Length or Content-Range headers).
+        :type expected_size: str or None
+        :returns: True if the file is complete, otherwise an ODKError.
+        :rtype: bool or ODKError
+        """
+
+        size = os.path.getsize(part_file)
+        if expected_size not in (None, "", "*") and \
+                size != int(expected_size):
+            if size > int(expected_size):
+                os.remove(part_file)
+            return ODKError(
+                "Incomplete download from ODK Central ({0} of {1} bytes)"
+                .format(size, expected_size))
+        if part_file.endswith(".zip.part"):
+            if not zipfile.is_zipfile(part_file):
+                os.remove(part_file)
+                return ODKError("Invalid zip file downloaded from ODK Central")
+        elif size == 0:
+            return ODKError("Empty file downloaded from ODK Central")
+        return True
+
+    def _extract_export(self, zip_file, file_name, chunk_size=1024 * 1024):
+        """Extract the CSV export of the form from a zipped export.
+
+        The zipped export also contains a CSV file for each repeat group, so
+        only the file named after the form ID is extracted (through a
+        temporary .part file, one chunk at a time).
+
+        :parameter zip_file: Path of the zipped export (submissions.csv.zip).
+        :type zip_file: str
+        :parameter file_name: Path of the extracted CSV export.
+        :type file_name: str
+        :parameter chunk_size: Number of bytes read into memory at a time.
+        :type chunk_size: int
+        :returns: Number of lines written to file_name.
+        :rtype: int
+        :raises: ODKError
+        """
+
+        part_file = file_name + ".part"
+        n_lines = 0
+        last_byte = b"\n"
+        try:
+            with zipfile.ZipFile(zip_file) as z:
+                member = self.odk_form_id + ".csv"
+                if member not in z.namelist():
+                    raise ODKError("Unable to find " + member +
+                                   " in export from ODK Central")
+                with z.open(member) as f_in, open(part_file, "wb") as f_out:
+                    for chunk in iter(lambda: f_in.read(chunk_size), b""):
+                        f_out.write(chunk)
+                        n_lines += chunk.count(b"\n")
+                        last_byte = chunk[-1:]
+            os.replace(part_file, file_name)
+        except (zipfile.BadZipFile, OSError) as e:
+            if os.path.isfile(part_file):
+                os.remove(part_file)
+            raise ODKError("Unable to extract " + file_name +
+                           " from export from ODK Central") from e
+        if last_byte != b"\n":
+            n_lines += 1
+        return n_lines
+
+
+class _RecordReader:
+    """Iterate over the records of a CSV export along with their raw text.
+
+    Records may span several lines (e.g., text fields with line breaks), so
+    the lines consumed by the csv reader for each record are kept and
+    returned with the parsed row.
+
+    :parameter f: File object of a CSV export (opened with newline="").
+    :type f: file object
+    """
+
+    def __init__(self, f):
+
+        self._lines = []
+        self._reader = csv.reader(self._read_lines(f))
+        self._index = {}
+        self.header = None
+        for row, _ in self:
+            self.header = row
+            break
+
+    def _read_lines(self, f):
+
+        for line in f:
+            self._lines.append(line)
+            yield line
+
+    def __iter__(self):
+
+        for row in self._reader:
+            raw = "".join(self._lines)
+            self._lines = []
+            yield row, raw
+
+    def key(self, row, raw, id_column):
+        """Key used to match records across exports.
+
+        :parameter row: Parsed record.
+        :type row: list
+        :parameter raw: Text of the record.
+        :type raw: str
+        :parameter id_column: Name of the instance ID column (or None).
+        :type id_column: str or None
+        :rtype: str or bytes
+        """
+
+        if id_column is not None:
+            if id_column not in self._index:
+                self._index[id_column] = self.header.index(id_column)
+            index = self._index[id_column]
+            return row[index] if index < len(row) else ""
+        return hashlib.sha1(raw.rstrip("\r\n").encode()).digest()
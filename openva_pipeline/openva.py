@@ -9,15 +9,48 @@ import subprocess
 import shutil
 import os
 import re
-from pandas import read_csv
+import csv
+import json
+import hashlib
+import io
+import math
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import wait
+from itertools import repeat
 from pandas import DataFrame
 from pandas import concat
 from pandas import merge
+from pandas import read_csv
 import numpy as np
 from pycrossva.transform import transform
 
 from .exceptions import OpenVAError
+from .exceptions import OpenVATimeoutError
+from .exceptions import OpenVAMemoryError
 from .exceptions import SmartVAError
+from .exceptions import SmartVATimeoutError
+from .exceptions import SmartVAMemoryError
+from .supervisor import run_supervised, MemoryLimitExceeded
+from .va_data import read_va_csv, expand_va_data
+from .va_data import (interchange_extension, find_va_file, read_va_file,
+                      write_va_file)
+
+#: Number of seconds between reads of the progress file while an R script
+#: runs.
+PROGRESS_INTERVAL = 5
+
+#: Number of seconds without new progress lines after which a heartbeat
+#: (a progress event with the phase running) is added while an R script runs.
+HEARTBEAT_INTERVAL = 60
+
+#: First field of the progress lines written by the R scripts.
+PROGRESS_PREFIX = "PROGRESS"
+
+#: Phases of the progress events added while a phase runs (the heartbeats
+#: and the InSilicoVA chains); they do not end a phase.
+RUNNING_PHASES = ("running", "chain")
 
 
 class OpenVA:
@@ -60,7 +93,21 @@ class OpenVA:
             self.dhis_org_units = re.split(r"\s|,", self.dhis_org_unit)
             self.dhis_org_units = [i for i in self.dhis_org_units if i != ""]
 
+        # Pipeline_Conf.interchangeFormat; the input files are CSV files for
+        # SmartVA (its CLI only reads CSV)
+        self.file_ext = interchange_extension(
+            getattr(self.pipeline_args, "interchange_format", "csv"))
+        self.input_ext = self.file_ext
+        if self.pipeline_args.algorithm == "SmartVA":
+            self.input_ext = ".csv"
+
         self.successful_run = None
+        self.cache_keys = {}
+        self.cached_results = {}
+        self.shards = None
+        self.progress = None
+        self.progress_events = []
+        self._progress_lock = threading.Lock()
 
         try:
             if not os.path.isdir(dir_openva):
@@ -69,10 +116,20 @@ class OpenVA:
             raise OpenVAError("Unable to create directory" +
                               dir_openva) from exc
 
-    def prep_va_data(self):
+    def prep_va_data(self, va_data=None):
         """Create data file for openVA by merging ODK export files & converting
            with pycrossva.
 
+        :parameter va_data: The new ODK export (without duplicate records),
+         as returned by :meth:`TransferDB.check_duplicates()
+         <openva_pipeline.transfer_db.TransferDB.check_duplicates>` with
+         return_data=True.  If it is given, odk_export_new.csv is not read
+         again (it may still hold the duplicate records) and the DataFrame is
+         passed directly to pycrossva.  Only the files read by the algorithm
+         are written: pycrossva_input and openva_input (as CSV or Feather
+         files; see Pipeline_Conf.interchangeFormat) for the R script, and
+         openva_input.csv for SmartVA.
+        :type va_data: pandas.DataFrame
         :returns: Summary of the number of VA records at each step -- previous
          ODK export (0 if there isn't one), new ODK export, and number of VA
          records sent to openVA.
@@ -84,11 +141,14 @@ class OpenVA:
                    "n_to_openva": None}
         export_file_prev = os.path.join(self.dir_odk, "odk_export_prev.csv")
         export_file_new = os.path.join(self.dir_odk, "odk_export_new.csv")
-        pycva_input = os.path.join(self.dir_openva, "pycrossva_input.csv")
-        openva_input_file = os.path.join(self.dir_openva, "openva_input.csv")
+        pycva_input = self._input_file("pycrossva_input")
+        openva_input_file = self._input_file("openva_input")
+        csv_input = self.input_ext == ".csv"
 
         is_export_file_prev = os.path.isfile(export_file_prev)
         is_export_file_new = os.path.isfile(export_file_new)
+        if va_data is not None:
+            is_export_file_new = True
 
         algorithm_metadata = \
             self.pipeline_args.algorithm_metadata_code.split("|")
@@ -106,24 +166,31 @@ class OpenVA:
             # summary["n_to_openva"] = len(f_new_lines) - 1
             # if len(f_new_lines) == 1:
             #     return summary
-            export_df_new = read_csv(export_file_new)
+            if va_data is None:
+                export_df_new = read_va_csv(export_file_new)
+            else:
+                export_df_new = va_data
             export_n_rows = export_df_new.shape[0]
             summary["n_export_prev"] = 0
             summary["n_export_new"] = export_n_rows
             summary["n_to_openva"] = export_n_rows
             if export_n_rows == 0:
                 return summary
-            shutil.copy(export_file_new, pycva_input)
             if self.pipeline_args.algorithm == "SmartVA":
-                shutil.copy(pycva_input, openva_input_file)
-            else:
-                final_data = transform(mapping=(pycva_instrument_version,
-                                                "InterVA5"),
-                                       raw_data=pycva_input,
-                                       raw_data_id=self.odk_id,
-                                       verbose=0)
-                final_data.to_csv(openva_input_file, index=False)
+                if va_data is None:
+                    shutil.copy(export_file_new, openva_input_file)
+                else:
+                    export_df_new.to_csv(openva_input_file, index=False)
                 return summary
+            if va_data is None and csv_input:
+                shutil.copy(export_file_new, pycva_input)
+                raw_data = pycva_input
+            else:
+                write_va_file(export_df_new, pycva_input)
+                raw_data = expand_va_data(export_df_new)
+            final_data = self._transform(raw_data, pycva_instrument_version)
+            write_va_file(final_data, openva_input_file)
+            return summary
         # if is_export_file_new and is_export_file_prev:
         else:
             # with open(export_file_new, "r", newline="") as f_new:
@@ -142,9 +209,12 @@ class OpenVA:
             #         if line not in f_new_lines:
             #             f_combined.write(line)
             #             n_to_openva += 1
-            export_df_new = read_csv(export_file_new)
+            if va_data is None:
+                export_df_new = read_va_csv(export_file_new)
+            else:
+                export_df_new = va_data
             export_new_n_rows = export_df_new.shape[0]
-            export_df_prev = read_csv(export_file_prev)
+            export_df_prev = read_va_csv(export_file_prev)
             export_prev_n_rows = export_df_prev.shape[0]
             summary["n_export_prev"] = export_prev_n_rows
             summary["n_export_new"] = export_new_n_rows
@@ -160,46 +230,346 @@ class OpenVA:
                 match_col = match_instanceid[0]
             exports_combined.drop_duplicates(subset=match_col,
                                              inplace=True)
-            exports_combined.to_csv(pycva_input, index=False)
             summary["n_to_openva"] = exports_combined.shape[0]
 
             if self.pipeline_args.algorithm == "SmartVA":
-                shutil.copy(pycva_input, openva_input_file)
+                exports_combined.to_csv(openva_input_file, index=False)
+                return summary
+            write_va_file(exports_combined, pycva_input)
+            if va_data is None and csv_input:
+                raw_data = pycva_input
             else:
-                final_data = transform(mapping=(pycva_instrument_version,
-                                                "InterVA5"),
-                                       raw_data=pycva_input,
-                                       raw_data_id=self.odk_id,
-                                       verbose=0)
-                final_data.to_csv(openva_input_file, index=False)
+                raw_data = expand_va_data(exports_combined)
+            final_data = self._transform(raw_data, pycva_instrument_version)
+            write_va_file(final_data, openva_input_file)
         return summary
 
-    def r_script(self):
-        """Create an R script for running openVA and assigning CODs."""
+    def _input_file(self, name: str, data_dir: str = None) -> str:
+        """Path of an input file (pycrossva_input or openva_input) for the
+        algorithm, in the format set by Pipeline_Conf.interchangeFormat."""
+
+        if data_dir is None:
+            data_dir = self.dir_openva
+        return os.path.join(data_dir, name + self.input_ext)
+
+    @staticmethod
+    def _read_input(file_name: str):
+        """Read an input file (the values of a CSV file are kept as text,
+        so they are written back unchanged)."""
+
+        if file_name.endswith(".csv"):
+            return read_csv(file_name, dtype=str, keep_default_na=False)
+        return read_va_file(file_name, compact=False)
+
+    def _transform(self, raw_data, instrument_version):
+        """Convert the VA records with pycrossva.
+
+        If Pipeline_Conf.pycrossvaWorkers is larger than 1, the records are
+        split by row into shards of Pipeline_Conf.pycrossvaShardSize records,
+        which are converted by a pool of worker processes.  The converted
+        shards are combined in their original order, so the result is the
+        same as converting all the records at once.
+
+        :parameter raw_data: VA records (or the path of a CSV file with them).
+        :type raw_data: pandas.DataFrame or str
+        :parameter instrument_version: pycrossva name of the WHO instrument
+         version (e.g., 2016WHOv151).
+        :type instrument_version: str
+        :returns: VA records in the InterVA5 input format.
+        :rtype: pandas.DataFrame
+        """
+
+        mapping = (instrument_version, "InterVA5")
+        shard_size = getattr(self.pipeline_args, "pycrossva_shard_size", 1000)
+        n_workers = getattr(self.pipeline_args, "pycrossva_workers", 1)
+        if n_workers > 1:
+            if isinstance(raw_data, str):
+                raw_data = expand_va_data(read_va_csv(raw_data))
+            n_records = raw_data.shape[0]
+            if n_records > shard_size:
+                shards = [raw_data.iloc[i:(i + shard_size)]
+                          for i in range(0, n_records, shard_size)]
+                with ProcessPoolExecutor(
+                        max_workers=min(n_workers, len(shards))) as executor:
+                    results = list(executor.map(
+                        _transform_shard, repeat(mapping), shards,
+                        repeat(self.odk_id)))
+                return concat(results, ignore_index=True)
+        return transform(mapping=mapping,
+                         raw_data=raw_data,
+                         raw_data_id=self.odk_id,
+                         verbose=0)
+
+    def use_cod_cache(self, get_cached) -> int:
+        """Take the VA records with cached results out of the openVA input.
+
+        Records stay in the ODK export across runs (e.g., when they could not
+        be posted to DHIS2), so the same records are sent to the algorithm
+        again.  This method creates a key for each record in openva_input
+        from a hash of the record (the pycrossva output and the ODK record in
+        pycrossva_input) and the algorithm settings
+        (algorithm_metadata_code, the settings returned by
+        :meth:`TransferDB.config_openva()
+        <openva_pipeline.transfer_db.TransferDB.config_openva>`, and the DHIS2
+        org unit).  The records with cached results are removed from the
+        input files and their results are added to the output files by
+        :meth:`merge_cod_cache`.  Nothing is cached if the VA IDs are not
+        unique.
+
+        Only the results of InterVA are cached, since InterVA assigns the
+        cause of each record on its own.  InSilicoVA estimates the
+        distribution of the causes from all of the records in a run, so the
+        cause of a record depends on the other records (and a cached result
+        would not match the one from a new run).  For InSilicoVA and
+        SmartVA, all of the records are sent to the algorithm and 0 is
+        returned.
+
+        :parameter get_cached: Function that returns the cached results for
+         a list of keys (e.g., :meth:`TransferDB.get_cod_cache()
+         <openva_pipeline.transfer_db.TransferDB.get_cod_cache>`).
+        :type get_cached: function
+        :returns: Number of VA records with cached results.
+        :rtype: int
+        """
+
+        self.cache_keys = {}
+        self.cached_results = {}
+        if self.pipeline_args.algorithm != "InterVA":
+            return 0
+        openva_input_file = self._input_file("openva_input")
+        pycva_input = self._input_file("pycrossva_input")
+        openva_input = self._read_input(openva_input_file)
+        raw_data = self._read_input(pycva_input)
+        if raw_data[self.odk_id].duplicated().any():
+            return 0
+        raw_records = {record[self.odk_id]: record for record in
+                       raw_data.to_dict(orient="records")}
+        id_column = "ID"
+        va_ids = openva_input[id_column]
+        if va_ids.duplicated().any():
+            return 0
+
+        settings = [self.pipeline_args.algorithm_metadata_code,
+                    list(self.va_args), self.dhis_org_unit]
+        for record in openva_input.to_dict(orient="records"):
+            va_id = record[id_column]
+            content = json.dumps([settings, record, raw_records.get(va_id)],
+                                 default=str)
+            self.cache_keys[va_id] = hashlib.sha256(
+                content.encode("utf-8")).hexdigest()
+        cached = get_cached(list(self.cache_keys.values()))
+        self.cached_results = {va_id: cached[key] for va_id, key in
+                               self.cache_keys.items() if key in cached}
+        if len(self.cached_results) > 0:
+            write_va_file(openva_input[~va_ids.isin(self.cached_results)],
+                          openva_input_file)
+            is_cached = raw_data[self.odk_id].isin(self.cached_results)
+            write_va_file(raw_data[~is_cached], pycva_input)
+        return len(self.cached_results)
+
+    def merge_cod_cache(self) -> dict:
+        """Add the cached results to the openVA output file.
+
+        The rows for the records taken out by :meth:`use_cod_cache` are
+        added to record_storage (which is created from the cached rows if
+        all records were cached, i.e., when the algorithm was not run).  The
+        rows are cached as they are written to record_storage.csv, so the
+        cache does not depend on Pipeline_Conf.interchangeFormat.
+
+        :returns: The VA ID and the row of record_storage.csv (as JSON) for
+         each key of the records that were assigned a cause by the algorithm
+         (for :meth:`TransferDB.store_cod_cache()
+         <openva_pipeline.transfer_db.TransferDB.store_cod_cache>`).
+        :rtype: dict
+        """
+
+        record_storage_file = os.path.join(self.dir_openva,
+                                           "record_storage" + self.file_ext)
+        header = None
+        rows = []
+        entries = {}
+        if len(self.cached_results) < len(self.cache_keys):
+            header, rows = _read_rows(record_storage_file)
+            cod_index = [i for i, column in enumerate(header)
+                         if column in ("cod", "cause34")]
+            for row in rows:
+                # the VA ID is the first column
+                va_id = row[0]
+                key = self.cache_keys.get(va_id)
+                if key is None:
+                    continue
+                if len(cod_index) == 0 or \
+                        row[cod_index[0]] in ("", "MISSING"):
+                    continue
+                entries[key] = (va_id, json.dumps(list(zip(header, row))))
+
+        if len(self.cached_results) > 0:
+            for record in self.cached_results.values():
+                record = json.loads(record)
+                if header is None:
+                    header = [column for column, _ in record]
+                if [column for column, _ in record] == header:
+                    rows.append([value for _, value in record])
+                else:
+                    values = dict(record)
+                    rows.append([values.get(column, "") for column in header])
+            _write_rows(record_storage_file, header, rows)
+        return entries
+
+    def r_script(self, shard: int = None):
+        """Create an R script for running openVA and assigning CODs.
+
+        If Pipeline_Conf.openvaShards is larger than 1 (see :meth:`n_shards`),
+        the records are split into shards and one R script is created for
+        each shard (in the folder OpenVAFiles/<run date>/shard_<number>, which
+        also holds the input and output files of the shard).
+
+        :parameter shard: Number of the shard (starting at 0) for which the
+         script is created.  If None, the script (or scripts) for all of the
+         records is created.
+        :type shard: int
+        """
+
+        if shard is None:
+            if not self.pipeline_args.algorithm == "SmartVA":
+                try:
+                    os.makedirs(
+                        os.path.join(self.dir_openva, self.run_date)
+                    )
+                except (PermissionError, OSError) as exc:
+                    raise OpenVAError("Unable to create openVA dir" +
+                                      str(exc)) from exc
+            n_shards = self.n_shards()
+            if n_shards > 1:
+                self.shards = self._split_shards(n_shards)
+                for i in range(self.shards):
+                    self.r_script(shard=i)
+                return
+
+        if self.pipeline_args.algorithm == "InSilicoVA":
+            self._r_script_insilicova(shard)
+        if self.pipeline_args.algorithm == "InterVA":
+            self._r_script_interva(shard)
+
+    def n_shards(self) -> int:
+        """Number of shards the records are split into for openVA.
+
+        This is Pipeline_Conf.openvaShards for InterVA, which assigns the
+        cause of each record independently, and for InSilicoVA with
+        updateCondProb = FALSE (the conditional probabilities are fixed); the
+        records are not split for InSilicoVA when the conditional
+        probabilities are updated from the data, or for SmartVA.
+
+        :rtype: int
+        """
+
+        n_shards = getattr(self.pipeline_args, "openva_shards", 1)
+        if self.pipeline_args.algorithm == "SmartVA":
+            return 1
+        if self.pipeline_args.algorithm == "InSilicoVA" and \
+                self.va_args.insilicova_update_cond_prob.upper() != "FALSE":
+            return 1
+        return n_shards
+
+    def _r_paths(self, shard: int = None) -> tuple:
+        """Paths of the R script, the folder with its input and output files
+        (pycrossva_input, openva_input, and record_storage), and
+        the folder for the results of the algorithm."""
+
+        results_dir = os.path.join(self.dir_openva, self.run_date)
+        data_dir = self.dir_openva
+        if shard is not None:
+            results_dir = os.path.join(results_dir, "shard_" + str(shard))
+            data_dir = results_dir
+        file_name = os.path.join(results_dir,
+                                 "r_script_" + self.run_date + ".R")
+        return file_name, data_dir, results_dir
+
+    def _split_shards(self, n_shards: int) -> int:
+        """Split openva_input and pycrossva_input into shards.
+
+        The records are sorted by ID and split into (at most) n_shards
+        shards of about the same size; the ODK records of each shard are the
+        ones with the IDs in its part of openva_input.
 
-        if not self.pipeline_args.algorithm == "SmartVA":
+        :returns: Number of shards.
+        :rtype: int
+        """
+
+        openva_input = self._read_input(self._input_file("openva_input"))
+        raw_data = self._read_input(self._input_file("pycrossva_input"))
+        openva_input = openva_input.sort_values(by="ID", kind="stable")
+        n_shards = max(1, min(n_shards, openva_input.shape[0]))
+        for shard, rows in enumerate(
+                np.array_split(np.arange(openva_input.shape[0]), n_shards)):
+            _, data_dir, _ = self._r_paths(shard)
             try:
-                os.makedirs(
-                    os.path.join(self.dir_openva, self.run_date)
-                )
+                os.makedirs(data_dir, exist_ok=True)
             except (PermissionError, OSError) as exc:
                 raise OpenVAError("Unable to create openVA dir" +
                                   str(exc)) from exc
+            shard_input = openva_input.iloc[rows]
+            write_va_file(shard_input,
+                          self._input_file("openva_input", data_dir))
+            shard_raw_data = raw_data[
+                raw_data[self.odk_id].isin(shard_input["ID"])]
+            write_va_file(shard_raw_data,
+                          self._input_file("pycrossva_input", data_dir))
+        return n_shards
 
-        if self.pipeline_args.algorithm == "InSilicoVA":
-            self._r_script_insilicova()
-        if self.pipeline_args.algorithm == "InterVA":
-            self._r_script_interva()
+    def _progress_file(self, shard: int = None) -> str:
+        """Path of the file with the progress lines of an R script."""
 
-    def _r_script_insilicova(self):
+        return os.path.splitext(self._r_paths(shard)[0])[0] + ".progress"
 
-        file_name = os.path.join(self.dir_openva,
-                                 self.run_date,
-                                 "r_script_" + self.run_date + ".R")
+    def _r_progress(self, f, shard: int = None) -> None:
+        """Write the R function that adds a progress line (see
+        :func:`parse_progress`) to the progress file of the script.  It is
+        called at the end of each phase (reading the input, the algorithm,
+        the merge with the ODK records, and writing the output), and by each
+        InSilicoVA chain when it finishes (the elapsed time is taken from
+        the clock, so it is also right in the R processes of the chains)."""
+
+        f.write("progress_file <- '" + self._progress_file(shard) + "' \n")
+        f.write("progress_start <- as.numeric(Sys.time()) \n")
+        f.write("progress <- function(phase, records = NA, iteration = NA) { \n")
+        f.write("  elapsed <- round(as.numeric(Sys.time()) - progress_start, 2) \n")
+        f.write("  cat(paste('" + PROGRESS_PREFIX + "', phase, records, iteration, elapsed, sep = '\\t'), \n")
+        f.write("      '\\n', sep = '', file = progress_file, append = TRUE) \n")
+        f.write("} \n")
+        f.write("progress('start') \n")
+
+    def _r_read(self, f, name: str, file_name: str) -> None:
+        """Write the R code that reads an input file into the data frame
+        name.  A Feather file is read with the arrow package and its columns
+        are given the names (and types) that read.csv would give them."""
+
+        if file_name.endswith(".csv"):
+            f.write(name + " <- read.csv('" + file_name + "') \n")
+            return
+        f.write(name + " <- as.data.frame(arrow::read_feather('" + file_name + "')) \n")
+        f.write("names(" + name + ") <- make.names(names(" + name + "), unique = TRUE) \n")
+        f.write(name + "[] <- lapply(" + name + ", function(x) if (is.factor(x)) as.character(x) else x) \n")
+
+    def _r_write(self, f, name: str, data_dir: str) -> None:
+        """Write the R code that saves the data frame name to record_storage
+        (with the dates as text, and unique column names as read_csv would
+        give them, in a Feather file)."""
+
+        if self.file_ext == ".csv":
+            f.write("write.csv(" + name + ", file='" + data_dir + "/record_storage.csv', row.names=FALSE, na='') \n")
+            return
+        f.write(name + "[] <- lapply(" + name + ", function(x) if (inherits(x, c('Date', 'POSIXt', 'factor'))) as.character(x) else x) \n")
+        f.write("names(" + name + ") <- make.unique(names(" + name + ")) \n")
+        f.write("arrow::write_feather(" + name + ", '" + data_dir + "/record_storage.feather') \n")
+
+    def _r_script_insilicova(self, shard: int = None):
+
+        file_name, data_dir, results_dir = self._r_paths(shard)
         algorithm_metadata = \
             self.pipeline_args.algorithm_metadata_code.split("|")
         who_instrument_version = algorithm_metadata[5]
-        raw_data_file = os.path.join(self.dir_openva, "pycrossva_input.csv")
+        raw_data_file = self._input_file("pycrossva_input", data_dir)
 
         if who_instrument_version not in ["v1_4_1", "v1_5_1", "v1_5_3"]:
             raise OpenVAError("pyCrossVA not able to process WHO " +
@@ -208,10 +578,11 @@ class OpenVA:
             with open(file_name, "w", newline="") as f:
                 f.write("date() \n")
                 f.write("library(openVA) \n")
+                self._r_progress(f, shard)
                 # TODO: add lubridate to handle different date formats across
                 # the rows
                 f.write("getwd() \n")
-                f.write("raw_data <- read.csv('" + raw_data_file + "') \n")
+                self._r_read(f, "raw_data", raw_data_file)
                 odk_id_for_r = self.odk_id.replace("-", ".")
                 odk_id_for_r = odk_id_for_r.replace(":", ".")
                 f.write("raw_data_sorted <- raw_data[order(raw_data$" + odk_id_for_r + "),] \n")
@@ -219,9 +590,37 @@ class OpenVA:
                 f.write("new_names <- lapply(strsplit(col_names, '\\\\.'), tail, n = 1) \n")
                 f.write("names(raw_data_sorted) <- tolower(unlist(new_names)) \n")
                 f.write("raw_data_sorted$ID <- sort(raw_data$" + odk_id_for_r + ") \n")
-                f.write("data_from_pycrossva <- read.csv('" + self.dir_openva + "/openva_input.csv') \n")
+                self._r_read(f, "data_from_pycrossva",
+                             self._input_file("openva_input", data_dir))
                 f.write("records_sorted <- data_from_pycrossva[order(data_from_pycrossva$ID),] \n")
-                f.write("results <- insilico(data = records_sorted, \n")
+                f.write("progress('read_input', nrow(records_sorted)) \n")
+                # MCMC iterations run by insilico() (more than Nsim if
+                # auto.length extended the chain)
+                f.write("iterations <- function(fit) { \n")
+                f.write("  csmf <- fit$csmf \n")
+                f.write("  if (!is.matrix(csmf)) csmf <- csmf[[1]] \n")
+                f.write("  " + str(int(float(self.va_args.insilicova_burnin))) +
+                        " + nrow(csmf) * " +
+                        str(max(int(float(self.va_args.insilicova_thin)), 1)) +
+                        " \n")
+                f.write("} \n")
+                n_chains = self.n_chains()
+                if n_chains > 1:
+                    # each chain writes its warnings to its own folder (the
+                    # file names are fixed by insilico()), and the files are
+                    # then moved to results_dir with a _chain<k> suffix
+                    f.write("run_chain <- function(chain, nsim, records_sorted) { \n")
+                    f.write("library(openVA) \n")
+                    f.write("seed <- " + self.va_args.insilicova_seed + " + chain - 1 \n")
+                    f.write("chain_dir <- file.path('" + results_dir + "', paste0('chain', chain)) \n")
+                    f.write("dir.create(chain_dir, showWarnings = FALSE) \n")
+                    f.write("chain_fit <- insilico(data = records_sorted, \n")
+                    nsim, seed, directory = "nsim", "seed", "chain_dir"
+                else:
+                    f.write("results <- insilico(data = records_sorted, \n")
+                    nsim = self.va_args.insilicova_nsim
+                    seed = self.va_args.insilicova_seed
+                    directory = "'" + results_dir + "'"
                 f.write("\t data.type = '" + self.va_args.insilicova_data_type + "', \n")
                 f.write("\t isNumeric = " + self.va_args.insilicova_is_numeric + ", \n")
                 f.write("\t updateCondProb = " + self.va_args.insilicova_update_cond_prob + ", \n")
@@ -231,9 +630,9 @@ class OpenVA:
                 f.write("\t datacheck = " + self.va_args.insilicova_datacheck + ", \n")
                 f.write("\t datacheck.missing = " + self.va_args.insilicova_datacheck_missing + ", \n")
                 f.write("\t warning.write = TRUE, \n")
-                f.write("\t directory = '" + os.path.join(self.dir_openva, self.run_date) + "', \n")
+                f.write("\t directory = " + directory + ", \n")
                 f.write("\t external.sep = " + self.va_args.insilicova_external_sep + ", \n")
-                f.write("\t Nsim = " + self.va_args.insilicova_nsim + ", \n")
+                f.write("\t Nsim = " + nsim + ", \n")
                 f.write("\t thin = " + self.va_args.insilicova_thin + ", \n")
                 f.write("\t burnin = " + self.va_args.insilicova_burnin + ", \n")
                 f.write("\t auto.length = " + self.va_args.insilicova_auto_length + ", \n")
@@ -245,7 +644,7 @@ class OpenVA:
                 f.write("\t trunc.max = " + self.va_args.insilicova_trunc_max + ", \n")
                 f.write("\t subpop = " + self.va_args.insilicova_subpop + ", \n")
                 f.write("\t java_option = '" + self.va_args.insilicova_java_option + "', \n")
-                f.write("\t seed = " + self.va_args.insilicova_seed + ", \n")
+                f.write("\t seed = " + seed + ", \n")
                 f.write("\t phy.code = " + self.va_args.insilicova_phy_code + ", \n")
                 f.write("\t phy.cat = " + self.va_args.insilicova_phy_cat + ", \n")
                 f.write("\t phy.unknown = " + self.va_args.insilicova_phy_unknown + ", \n")
@@ -255,6 +654,18 @@ class OpenVA:
                 f.write("\t no.is.missing = " + self.va_args.insilicova_no_is_missing + ", \n")
                 f.write("\t indiv.CI = " + self.va_args.insilicova_indiv_ci + ", \n")
                 f.write("\t groupcode = " + self.va_args.insilicova_no_is_missing + ") \n")
+                if n_chains > 1:
+                    f.write("for (log_file in list.files(chain_dir)) { \n")
+                    f.write("  file.rename(file.path(chain_dir, log_file), file.path('" + results_dir + "', \n")
+                    f.write("    sub('(\\\\.[^.]*)?$', paste0('_chain', chain, '\\\\1'), log_file))) \n")
+                    f.write("} \n")
+                    f.write("unlink(chain_dir, recursive = TRUE) \n")
+                    f.write("progress('chain', nrow(records_sorted), iterations(chain_fit)) \n")
+                    f.write("chain_fit \n")
+                    f.write("} \n")
+                    self._r_script_insilicova_chains(f, n_chains)
+                else:
+                    f.write("progress('insilico', nrow(records_sorted), iterations(results)) \n")
                 if self.va_args.insilicova_data_type == "WHO2012":
                     f.write("sex <- ifelse(tolower(records_sorted$MALE)=='y', 'Male', 'Female') \n")
                 if self.va_args.insilicova_data_type == "WHO2016":
@@ -290,18 +701,13 @@ class OpenVA:
                 f.write("  age[valid_age2] <- raw_data_sorted[valid_age2, index_ageinyears2]\n")
                 f.write("  age[is.na(age) & raw_data_sorted[, index_isneonatal] == 1] <- 0 \n")
                 f.write("} else {age <- rep('', nrow(raw_data_sorted))}\n")
-                f.write("## create matrices for DHIS2 blob (records2) and transfer database (records3) \n")
+                f.write("## create matrix for transfer database (records3) \n")
                 f.write("## first column must be ID \n")
                 f.write("metadataCode <- '" + self.pipeline_args.algorithm_metadata_code + "'\n")
                 #f.write("records2 <- merge(cod, records_sorted, by = 'ID', all = TRUE, sort = TRUE) \n")
                 f.write("records2 <- merge(cod, raw_data_sorted, by = 'ID', all = TRUE, sort = TRUE) \n")
                 f.write("records2[is.na(records2[, 'CAUSE1']), 'CAUSE1'] <- 'MISSING' \n")
                 f.write("cod2 <- records2[, 'CAUSE1'] \n")
-                f.write("names(records2)[which(names(records2) == 'CAUSE1')] <- 'Cause of Death' \n")
-                f.write("records2$Metadata <- metadataCode \n")
-                f.write("evaBlob <- cbind(rep(as.character(records2[,'ID']), each=ncol(records2)), rep(names(records2)), c(apply(records2, 1, c))) \n")
-                f.write("colnames(evaBlob) <- c('ID', 'Attribute', 'Value') \n")
-                f.write("write.csv(evaBlob, file='" + self.dir_openva + "/entity_attribute_value.csv', row.names=FALSE, na='') \n\n")
                 if self.dhis_org_unit is not None:
                     f.write("### check for DHIS org unit \n")
                     ou_list = []
@@ -328,22 +734,116 @@ class OpenVA:
                     f.write("### write out results to csv \n")
                     f.write("records3 <- cbind(as.character(records_sorted[,'ID']), sex, dob, dod, age, cod2, metadataCode, raw_data_sorted$instanceid, raw_data_sorted) \n")
                     f.write("names(records3) <- c('id', 'sex', 'dob', 'dod', 'age', 'cod', 'metadataCode', 'odkMetaInstanceID', names(raw_data_sorted)) \n")
-                f.write("write.csv(records3, file='" + self.dir_openva + "/record_storage.csv', row.names=FALSE, na='') \n")
+                f.write("progress('merge', nrow(records3)) \n")
+                self._r_write(f, "records3", data_dir)
+                f.write("progress('write_output', nrow(records3)) \n")
                 f.write("date() \n")
         except (PermissionError, OSError) as exc:
             raise OpenVAError("Problem writing R script " +
                               "for InSilicoVA.") from exc
 
-    def _r_script_interva(self):
+    def n_chains(self) -> int:
+        """Number of InSilicoVA chains run at the same time.
 
-        file_name = os.path.join(self.dir_openva,
-                                 self.run_date,
-                                 "r_script_" + self.run_date + ".R")
+        This is InSilicoVA_Conf.chains, except with subpopulations (where the
+        CSMF draws are kept per subpopulation) which are run with one chain.
+
+        :rtype: int
+        """
+
+        if self.pipeline_args.algorithm != "InSilicoVA":
+            return 1
+        if self.va_args.insilicova_subpop != "NULL":
+            return 1
+        return int(getattr(self.va_args, "insilicova_chains", 1))
+
+    def _r_script_insilicova_chains(self, f, n_chains: int) -> None:
+        """Write the R code that runs the InSilicoVA chains in parallel.
+
+        The chains (numbered 1, 2, ..., with seeds seed, seed + 1, ...) run
+        in separate R processes, each with the burn-in followed by its share
+        of the Nsim - burnin iterations, so one round of chains draws as many
+        samples as a single chain would.  After each round the Gelman-Rubin
+        statistic (R-hat) of the CSMF draws of all chains so far is compared
+        with InSilicoVA_Conf.chains_rhat, and another round of new chains
+        (which adds its draws to the earlier ones) is only run, up to
+        InSilicoVA_Conf.chains_rounds, if the CSMF has not converged.  Each
+        chain adds a progress line (phase chain) as soon as it finishes, and
+        each round one with the iterations run by all chains so far.
+
+        The chains are then pooled: the CSMF draws (and the draws of the
+        conditional probabilities) are stacked, the individual cause
+        probabilities are averaged (weighted by the number of draws), and the
+        other parts of the results that differ between chains (e.g., the
+        individual probability intervals) are set to NULL.
+        """
+
+        nsim = int(float(self.va_args.insilicova_nsim))
+        burnin = int(float(self.va_args.insilicova_burnin))
+        thin = max(int(float(self.va_args.insilicova_thin)), 1)
+        n_rounds = int(self.va_args.insilicova_chains_rounds)
+        per_chain = max(nsim - burnin, thin) / n_chains
+        chain_nsim = burnin + thin * math.ceil(per_chain / thin)
+
+        f.write("csmf_rhat <- function(draws) { \n")
+        f.write("  n <- min(sapply(draws, nrow)) \n")
+        f.write("  draws <- lapply(draws, function(x) x[seq_len(n), , drop = FALSE]) \n")
+        f.write("  w <- rowMeans(sapply(draws, function(x) apply(x, 2, var))) \n")
+        f.write("  b <- n * apply(sapply(draws, colMeans), 1, var) \n")
+        f.write("  keep <- w > 0 \n")
+        f.write("  if (!any(keep)) return(1) \n")
+        f.write("  max(sqrt(((n - 1) / n * w[keep] + b[keep] / n) / w[keep])) \n")
+        f.write("} \n")
+        f.write("pool_chains <- function(chains) { \n")
+        f.write("  results <- chains[[1]] \n")
+        f.write("  n_draws <- sapply(chains, function(x) nrow(x$csmf)) \n")
+        f.write("  results$csmf <- do.call(rbind, lapply(chains, function(x) x$csmf)) \n")
+        f.write("  probs <- lapply(chains, function(x) x$conditional.probs) \n")
+        f.write("  if (is.matrix(probs[[1]])) { \n")
+        f.write("    results$conditional.probs <- do.call(rbind, probs) \n")
+        f.write("  } else if (length(dim(probs[[1]])) == 3) { \n")
+        f.write("    dims <- dim(probs[[1]]) \n")
+        f.write("    stacked <- unlist(lapply(probs, aperm, c(2, 3, 1))) \n")
+        f.write("    results$conditional.probs <- aperm(array(stacked, c(dims[2:3], \n")
+        f.write("      length(stacked) / prod(dims[2:3]))), c(3, 1, 2)) \n")
+        f.write("    dimnames(results$conditional.probs)[2:3] <- dimnames(probs[[1]])[2:3] \n")
+        f.write("  } \n")
+        f.write("  for (field in c('indiv.prob', 'p.hat')) { \n")
+        f.write("    if (is.null(results[[field]])) next \n")
+        f.write("    results[[field]] <- Reduce('+', Map(function(x, n) x[[field]] * n, \n")
+        f.write("      chains, n_draws)) / sum(n_draws) \n")
+        f.write("  } \n")
+        f.write("  pooled <- c('csmf', 'conditional.probs', 'indiv.prob', 'p.hat') \n")
+        f.write("  for (field in setdiff(names(results), pooled)) { \n")
+        f.write("    same <- sapply(chains, function(x) identical(x[[field]], results[[field]])) \n")
+        f.write("    if (!all(same)) results[field] <- list(NULL) \n")
+        f.write("  } \n")
+        f.write("  results \n")
+        f.write("} \n")
+        f.write("cl <- parallel::makePSOCKcluster(" + str(n_chains) + ") \n")
+        f.write("parallel::clusterExport(cl, c('progress', 'progress_file', 'progress_start', 'iterations')) \n")
+        f.write("chains <- list() \n")
+        f.write("for (chain_round in seq_len(" + str(n_rounds) + ")) { \n")
+        f.write("  chain_ids <- (chain_round - 1) * " + str(n_chains) +
+                " + seq_len(" + str(n_chains) + ") \n")
+        f.write("  chains <- c(chains, parallel::parLapply(cl, chain_ids, run_chain, \n")
+        f.write("    nsim = " + str(chain_nsim) + ", records_sorted = records_sorted)) \n")
+        f.write("  progress('insilico', nrow(records_sorted), sum(sapply(chains, iterations))) \n")
+        f.write("  rhat <- csmf_rhat(lapply(chains, function(x) x$csmf)) \n")
+        f.write("  cat('chain round', chain_round, 'max CSMF R-hat', rhat, '\\n') \n")
+        f.write("  if (rhat <= " + self.va_args.insilicova_chains_rhat + ") break \n")
+        f.write("} \n")
+        f.write("parallel::stopCluster(cl) \n")
+        f.write("results <- pool_chains(chains) \n")
+
+    def _r_script_interva(self, shard: int = None):
+
+        file_name, data_dir, results_dir = self._r_paths(shard)
 
         algorithm_metadata = \
             self.pipeline_args.algorithm_metadata_code.split("|")
         who_instrument_version = algorithm_metadata[5]
-        raw_data_file = os.path.join(self.dir_openva, "pycrossva_input.csv")
+        raw_data_file = self._input_file("pycrossva_input", data_dir)
 
         if who_instrument_version not in ["v1_4_1", "v1_5_1", "v1_5_3"]:
             raise OpenVAError("pyCrossVA not able to process WHO " +
@@ -352,10 +852,11 @@ class OpenVA:
             with open(file_name, "w", newline="") as f:
                 f.write("date() \n")
                 f.write("library(openVA) \n")
+                self._r_progress(f, shard)
                 # TODO: add lubridate to handle different date formats across
                 # the rows
                 f.write("getwd() \n")
-                f.write("raw_data <- read.csv('" + raw_data_file + "') \n")
+                self._r_read(f, "raw_data", raw_data_file)
                 odk_id_for_r = self.odk_id.replace("-", ".")
                 odk_id_for_r = odk_id_for_r.replace(":", ".")
                 f.write("raw_data_sorted <- raw_data[order(raw_data$" + odk_id_for_r + "),] \n")
@@ -363,8 +864,10 @@ class OpenVA:
                 f.write("new_names <- lapply(strsplit(col_names, '\\\\.'), tail, n = 1) \n")
                 f.write("names(raw_data_sorted) <- tolower(unlist(new_names)) \n")
                 f.write("raw_data_sorted$ID <- sort(raw_data$" + odk_id_for_r + ") \n")
-                f.write("data_from_pycrossva <- read.csv('" + self.dir_openva + "/openva_input.csv') \n")
+                self._r_read(f, "data_from_pycrossva",
+                             self._input_file("openva_input", data_dir))
                 f.write("records_sorted <- data_from_pycrossva[order(data_from_pycrossva$ID),] \n")
+                f.write("progress('read_input', nrow(records_sorted)) \n")
                 if self.va_args.interva_version == "4":
                     f.write("results <- InterVA5(Input = records_sorted, \n")
                 else:
@@ -378,8 +881,9 @@ class OpenVA:
                     f.write("\t replicate.bug2 = " + self.va_args.interva_replicate_bug2 + ", \n")
                 f.write("\t groupcode = " + self.va_args.interva_groupcode + ", \n")
                 f.write("\t write = TRUE, \n")
-                f.write("\t directory = '" + os.path.join(self.dir_openva, self.run_date) + "', \n")
+                f.write("\t directory = '" + results_dir + "', \n")
                 f.write("\t filename = 'interva5_results_" + self.run_date + "') \n")
+                f.write("progress('interva', nrow(records_sorted)) \n")
                 if self.va_args.interva_version == "4":
                     f.write("sex <- ifelse(tolower(records_sorted$MALE)=='y', 'Male', 'Female') \n")
                 if self.va_args.interva_version == "5":
@@ -415,18 +919,13 @@ class OpenVA:
                 f.write("  age[valid_age2] <- raw_data_sorted[valid_age2, index_ageinyears2]\n")
                 f.write("  age[is.na(age) & raw_data_sorted[, index_isneonatal] == 1] <- 0 \n")
                 f.write("} else {age <- rep('', nrow(raw_data_sorted))}\n")
-                f.write("## create matrices for DHIS2 blob (data2) and transfer database (data3) \n")
+                f.write("## create matrix for transfer database (records3) \n")
                 f.write("## first column must be ID \n")
                 f.write("metadataCode <- '" + self.pipeline_args.algorithm_metadata_code + "'\n")
                 #f.write("records2 <- merge(cod, records_sorted, by = 'ID', all = TRUE, sort = TRUE) \n")
                 f.write("records2 <- merge(cod, raw_data_sorted, by = 'ID', all = TRUE, sort = TRUE) \n")
                 f.write("records2[is.na(records2[, 'CAUSE1']), 'CAUSE1'] <- 'MISSING' \n")
                 f.write("cod2 <- records2[, 'CAUSE1'] \n")
-                f.write("names(records2)[which(names(records2) == 'CAUSE1')] <- 'Cause of Death' \n")
-                f.write("records2$Metadata <- metadataCode \n")
-                f.write("evaBlob <- cbind(rep(as.character(records2[,'ID']), each=ncol(records2)), rep(names(records2)), c(apply(records2, 1, c))) \n")
-                f.write("colnames(evaBlob) <- c('ID', 'Attribute', 'Value') \n")
-                f.write("write.csv(evaBlob, file='" + self.dir_openva + "/entity_attribute_value.csv', row.names=FALSE, na='') \n\n")
                 if self.dhis_org_unit is not None:
                     f.write("### check for DHIS org unit \n")
                     ou_list = []
@@ -455,24 +954,25 @@ class OpenVA:
                     f.write("records3 <- cbind(as.character(records_sorted[,'ID']), sex, dob, dod, age, cod2, metadataCode, raw_data_sorted$instanceid, raw_data_sorted) \n")
                     #f.write("names(records3) <- c('id', 'sex', 'dob', 'dod', 'age', 'cod', 'metadataCode', 'odkMetaInstanceID', names(records_sorted[,-1])) \n")
                     f.write("names(records3) <- c('id', 'sex', 'dob', 'dod', 'age', 'cod', 'metadataCode', 'odkMetaInstanceID', names(raw_data_sorted)) \n")
-                f.write("write.csv(records3, file='" + self.dir_openva + "/record_storage.csv', row.names=FALSE, na='') \n")
+                f.write("progress('merge', nrow(records3)) \n")
+                self._r_write(f, "records3", data_dir)
+                f.write("progress('write_output', nrow(records3)) \n")
                 f.write("date() \n")
         except (PermissionError, OSError) as exc:
             raise OpenVAError("Problem writing R script for InterVA.") from exc
 
     def smartva_to_csv(self):
         """
-        Write two CSV files: 
-        (1) Entity Value Attribute blob pushed to DHIS2
-        (entity_attribute_value.csv)
-        (2) table for transfer database (record_storage.csv)
-
-        Both CSV files are stored in the OpenVA folder.
+        Write the table for the transfer database (record_storage.csv, or
+        record_storage.feather if Pipeline_Conf.interchangeFormat is
+        feather) to the OpenVA folder.  The Entity Value Attribute blob pushed to DHIS2
+        is created from this table (see :func:`record_storage_to_eva()
+        <openva_pipeline.va_data.record_storage_to_eva>`).
         """
 
         in_file = os.path.join(self.dir_openva, "openva_input.csv")
         out_dir = os.path.join(self.dir_openva, self.run_date)
-        df_data = read_csv(in_file)
+        df_data = read_va_csv(in_file)
         if self.dhis_org_unit is not None:
             col_has_org_unit = [self.dhis_org_unit in col for col in
                                 df_data.columns]
@@ -481,7 +981,7 @@ class OpenVA:
                 df_data["dhis_org_unit"] = df_data.iloc[:, col_org_unit_index]
             else:
                 df_data["dhis_org_unit"] = self.dhis_org_unit
-        df_results = read_csv(out_dir +
+        df_results = read_va_csv(out_dir +
                               "/1-individual-cause-of-death/" +
                               "individual-cause-of-death.csv")
         code_df = DataFrame(
@@ -503,49 +1003,79 @@ class OpenVA:
         df_record_storage.drop(columns="sid", inplace=True)
         df_record_storage.insert(loc=0, column="ID",
                                  value=df_record_storage["odkMetaInstanceID"])
-        df_record_storage.to_csv(self.dir_openva + "/record_storage.csv",
-                                 index=False)
-
-        cols_keep = ["sid", "cause34", "metadataCode"]
-        df_temp = merge(left=df_results[cols_keep],
-                        left_on="sid",
-                        right=df_data,
-                        right_on="Generalmodule-sid",
-                        how="right")
-        # df_temp.dropna(subset=["cause34"])
-        df_temp["cause34"] = df_temp["cause34"].fillna("MISSING")
-        df_temp.drop(columns="sid", inplace=True)
-        df_temp.rename(columns={"meta-instanceID": "odkMetaInstanceID"},
-                       inplace=True)
-        df_temp["ID"] = df_temp["odkMetaInstanceID"]
-        df_eva = df_temp.melt(id_vars=["ID"],
-                              var_name="Attribute",
-                              value_name="Value")
-        df_eva.sort_values(by=["ID"], inplace=True)
-        df_eva.to_csv(self.dir_openva + "/entity_attribute_value.csv",
-                      index=False)
-
-    def get_cod(self):
+        write_va_file(df_record_storage, os.path.join(
+            self.dir_openva, "record_storage" + self.file_ext))
+
+    def get_cod(self, r_worker=None, progress=None):
         """Create and execute R script to assign a COD with openVA; or call
-           the SmartVA CLI to assign COD."""
+           the SmartVA CLI to assign COD.
+
+        If :meth:`r_script` split the records into shards, the R scripts of
+        the shards are run at the same time (at most
+        Pipeline_Conf.openvaWorkers of them) and their results are combined
+        into record_storage.
+
+        While an R script runs, the progress lines it writes at the end of
+        each phase (see :func:`parse_progress`) are read every
+        PROGRESS_INTERVAL seconds, added to the progress_events attribute,
+        and passed to progress (see :meth:`phase_times` for the time spent in
+        each phase); a heartbeat is passed on if there are no new lines for
+        HEARTBEAT_INTERVAL seconds.
+
+        :parameter r_worker: R process (with openVA already loaded) that runs
+         the R script instead of a new R CMD BATCH process (the shards are
+         still run by separate R processes).
+        :type r_worker: :class:`RWorker <openva_pipeline.r_worker.RWorker>`
+        :parameter progress: Function called with each progress event (e.g.,
+         to add it to the EventLog table).
+        :type progress: function
+        :raises: OpenVAError, SmartVAError (OpenVATimeoutError or
+         SmartVATimeoutError if the run takes longer than
+         Pipeline_Conf.openvaTimeout, and OpenVAMemoryError or
+         SmartVAMemoryError if it uses more than Pipeline_Conf.openvaMemoryLimit
+         or is killed by the kernel while a memory limit is set; see
+         :func:`run_supervised() <openva_pipeline.supervisor.run_supervised>`)
+        """
 
+        self.progress = progress
+        self.progress_events = []
+        if self.shards is not None:
+            return self._get_cod_shards()
         if self.pipeline_args.algorithm in ["InSilicoVA", "InterVA"]:
             r_script_in = os.path.join(self.dir_openva, self.run_date,
                                        "r_script_" + self.run_date + ".R")
             r_script_out = os.path.join(self.dir_openva, self.run_date,
                                         "r_script_" + self.run_date + ".Rout")
+            if r_worker is not None:
+                try:
+                    completed = self._run_with_progress(
+                        lambda: r_worker.run_script(
+                            r_script_in, r_script_out,
+                            timeout=self._limits()["timeout"]))
+                except subprocess.TimeoutExpired as exc:
+                    self.successful_run = False
+                    raise self._limit_error(exc, "R script",
+                                            OpenVATimeoutError,
+                                            OpenVAMemoryError) from exc
+                self.successful_run = completed.returncode == 0
+                if not self.successful_run:
+                    raise OpenVAError("Error running R script:" +
+                                      str(completed.stderr))
+                return completed
             #r_args = ["R", "CMD", "BATCH", "--vanilla",
             r_args = ["R", "CMD", "BATCH", "--no-save", "--no-restore",
                       r_script_in, r_script_out]
             try:
                 # capture_output=True not available in Python 3.6
-                completed = subprocess.run(args=r_args,
-                                           stdin=subprocess.PIPE,
-                                           stdout=subprocess.PIPE,
-                                           stderr=subprocess.PIPE,
-                                           check=True)
+                completed = self._run_with_progress(
+                    lambda: run_supervised(r_args, check=True,
+                                           **self._limits()))
                 self.successful_run = True
                 return completed
+            except (subprocess.TimeoutExpired, MemoryLimitExceeded) as exc:
+                self.successful_run = False
+                raise self._limit_error(exc, "R script", OpenVATimeoutError,
+                                        OpenVAMemoryError) from exc
             except subprocess.CalledProcessError as exc:
                 if exc.returncode == 1:
                     self.successful_run = False
@@ -573,15 +1103,15 @@ class OpenVA:
                     in_file,
                     out_dir]
         try:
-            # capture_output=True not available in Python 3.6
-            completed = subprocess.run(args=sva_args,
-                                       stdin=subprocess.PIPE,
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE,
-                                       check=True)
+            completed = run_supervised(sva_args, check=True,
+                                       **self._limits())
             self.smartva_to_csv()
             self.successful_run = True
             return completed
+        except (subprocess.TimeoutExpired, MemoryLimitExceeded) as exc:
+            self.successful_run = False
+            raise self._limit_error(exc, "SmartVA", SmartVATimeoutError,
+                                    SmartVAMemoryError) from exc
         except subprocess.CalledProcessError as exc:
             if exc.returncode == 2:
                 self.successful_run = False
@@ -592,6 +1122,175 @@ class OpenVA:
                 raise SmartVAError("Problem with SmartVA " +
                                    "country code") from exc
 
+    def _get_cod_shards(self) -> subprocess.CompletedProcess:
+        """Run the R scripts of the shards and combine their results."""
+
+        n_workers = getattr(self.pipeline_args, "openva_workers", 1)
+        try:
+            with ThreadPoolExecutor(
+                    max_workers=min(n_workers, self.shards)) as executor:
+                completed = list(executor.map(self._run_r_shard,
+                                              range(self.shards)))
+        except (subprocess.TimeoutExpired, MemoryLimitExceeded) as exc:
+            self.successful_run = False
+            raise self._limit_error(exc, "R script", OpenVATimeoutError,
+                                    OpenVAMemoryError) from exc
+        for shard, shard_completed in enumerate(completed):
+            if shard_completed.returncode != 0:
+                self.successful_run = False
+                raise OpenVAError("Error running R script (shard " +
+                                  str(shard) + "):" +
+                                  str(shard_completed.stderr))
+        shard_files = [os.path.join(self._r_paths(shard)[1],
+                                    "record_storage" + self.file_ext)
+                       for shard in range(self.shards)]
+        record_storage_file = os.path.join(self.dir_openva,
+                                           "record_storage" + self.file_ext)
+        if self.file_ext == ".csv":
+            _concat_csv(shard_files, record_storage_file)
+        else:
+            write_va_file(concat([read_va_file(i, compact=False)
+                                  for i in shard_files], ignore_index=True),
+                          record_storage_file)
+        self.successful_run = True
+        return subprocess.CompletedProcess(
+            args=[i.args for i in completed],
+            returncode=0,
+            stdout=b"".join(i.stdout for i in completed),
+            stderr=b"".join(i.stderr for i in completed))
+
+    def _run_r_shard(self, shard: int) -> subprocess.CompletedProcess:
+        """Run the R script of a shard (in a worker thread)."""
+
+        r_script_in, _, _ = self._r_paths(shard)
+        r_script_out = r_script_in + "out"
+        r_args = ["R", "CMD", "BATCH", "--no-save", "--no-restore",
+                  r_script_in, r_script_out]
+        try:
+            return self._run_with_progress(
+                lambda: run_supervised(r_args, **self._limits()), shard)
+        except OSError as exc:
+            return subprocess.CompletedProcess(args=r_args, returncode=1,
+                                               stdout=b"",
+                                               stderr=str(exc).encode())
+
+    def _limits(self) -> dict:
+        """Limits of the R and SmartVA processes set in Pipeline_Conf (as
+        arguments of :func:`run_supervised()
+        <openva_pipeline.supervisor.run_supervised>`)."""
+
+        return {
+            "timeout": getattr(self.pipeline_args, "openva_timeout",
+                               0) or None,
+            "memory_limit": getattr(self.pipeline_args,
+                                    "openva_memory_limit", 0) or None,
+            "address_space_limit": getattr(
+                self.pipeline_args, "openva_address_space_limit", 0) or None,
+            "nice": getattr(self.pipeline_args, "openva_nice", 0),
+            "cpus": getattr(self.pipeline_args, "openva_cpus", ()) or None}
+
+    @staticmethod
+    def _limit_error(exc, program: str, timeout_error, memory_error):
+        """Exception for a process stopped by the supervisor."""
+
+        if isinstance(exc, subprocess.TimeoutExpired):
+            return timeout_error(program + " stopped after " +
+                                 str(exc.timeout) + " seconds (see "
+                                 "Pipeline_Conf.openvaTimeout)")
+        return memory_error(program + " stopped: " + str(exc))
+
+    def _run_with_progress(self, run, shard: int = None):
+        """Run an R script (run) in a thread and read its progress file
+        until it finishes.
+
+        If no progress line is added for HEARTBEAT_INTERVAL seconds (e.g.,
+        while insilico() or InterVA5() runs), a heartbeat event with the
+        phase running and the number of seconds since the script started
+        is passed on instead.
+
+        :parameter run: Function that runs the R script and returns its
+         subprocess.CompletedProcess.
+        :type run: function
+        :parameter shard: Number of the shard of the R script.
+        :type shard: int
+        :returns: The return value of run (exceptions are raised again).
+        """
+
+        progress_file = self._progress_file(shard)
+        if os.path.isfile(progress_file):
+            os.remove(progress_file)
+        position = 0
+        start = last_event = time.monotonic()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(run)
+            while wait([future], timeout=PROGRESS_INTERVAL).not_done:
+                new_position = self._read_progress(progress_file, position,
+                                                   shard)
+                now = time.monotonic()
+                if new_position > position:
+                    position, last_event = new_position, now
+                elif now - last_event >= HEARTBEAT_INTERVAL:
+                    self._add_progress({"phase": "running", "records": None,
+                                        "iteration": None,
+                                        "elapsed": round(now - start, 2),
+                                        "shard": shard})
+                    last_event = now
+        self._read_progress(progress_file, position, shard)
+        return future.result()
+
+    def _read_progress(self, progress_file: str, position: int,
+                       shard: int = None) -> int:
+        """Handle the new progress lines (those after byte position) and
+        return the position after the last complete line."""
+
+        try:
+            with open(progress_file, "rb") as f:
+                f.seek(position)
+                data = f.read()
+        except OSError:
+            return position
+        data = data[:data.rfind(b"\n") + 1]
+        for line in data.decode("utf-8", errors="replace").splitlines():
+            event = parse_progress(line)
+            if event is None:
+                continue
+            event["shard"] = shard
+            self._add_progress(event)
+        return position + len(data)
+
+    def _add_progress(self, event: dict) -> None:
+        """Keep a progress event and pass it to the progress function."""
+
+        with self._progress_lock:
+            self.progress_events.append(event)
+            if self.progress is not None:
+                self.progress(event)
+
+    def phase_times(self) -> dict:
+        """Number of seconds spent in each phase of the R script(s).
+
+        The time of a phase is the time between its progress event and the
+        one before it (in the same R script), summed over the shards (and
+        InSilicoVA rounds).  The events added while a phase runs (see
+        RUNNING_PHASES) are skipped.
+
+        :returns: Seconds for each phase, in the order the phases ended.
+        :rtype: dict
+        """
+
+        times = {}
+        last = {}
+        for event in self.progress_events:
+            if event["phase"] in RUNNING_PHASES:
+                continue
+            previous = last.get(event["shard"], 0.0)
+            last[event["shard"]] = event["elapsed"]
+            if event["phase"] == "start":
+                continue
+            times[event["phase"]] = (times.get(event["phase"], 0.0) +
+                                     event["elapsed"] - previous)
+        return {phase: round(seconds, 2) for phase, seconds in times.items()}
+
     def get_summary(self) -> dict:
         """
         Get summary of openVA step.
@@ -601,8 +1300,8 @@ class OpenVA:
         :rtype: dict
         """
 
-        data_path = os.path.join(self.dir_openva, "record_storage.csv")
-        record_storage = read_csv(data_path)
+        data_path = find_va_file(self.dir_openva, "record_storage")
+        record_storage = read_va_file(data_path)
         n_records = record_storage.shape[0]
         if self.pipeline_args.algorithm in ["InSilicoVA", "InterVA"]:
             n_missing = sum(record_storage["cod"] == "MISSING")
@@ -613,3 +1312,123 @@ class OpenVA:
         summary = {"n_processed": n_records,
                    "n_cod_missing": n_missing}
         return summary
+
+
+def parse_progress(line: str):
+    """Parse a progress line written by the openVA R script.
+
+    The lines have tab-separated fields: PROGRESS, the phase (start,
+    read_input, insilico or interva, merge, or write_output; or chain when an
+    InSilicoVA chain finishes), the number of records, the number of MCMC
+    iterations completed (InSilicoVA, by the chain or by all chains so far),
+    and the number of seconds since the script started; missing values are
+    NA.
+
+    :parameter line: Line of the progress file.
+    :type line: str
+    :returns: Dictionary with the keys phase, records, iteration, and
+     elapsed (None if the line is not a progress line).
+    :rtype: dict
+    """
+
+    fields = line.rstrip("\r\n").split("\t")
+    if len(fields) != 5 or fields[0] != PROGRESS_PREFIX:
+        return None
+    try:
+        records, iteration = [None if value == "NA" else int(float(value))
+                              for value in fields[2:4]]
+        elapsed = float(fields[4])
+    except ValueError:
+        return None
+    return {"phase": fields[1], "records": records, "iteration": iteration,
+            "elapsed": elapsed}
+
+
+def progress_message(event: dict) -> str:
+    """Describe a progress event (from :func:`parse_progress`).
+
+    :parameter event: Progress event.
+    :type event: dict
+    :rtype: str
+    """
+
+    message = "openVA progress: " + event["phase"]
+    details = []
+    if event.get("records") is not None:
+        details.append(str(event["records"]) + " records")
+    if event.get("iteration") is not None:
+        details.append("iteration " + str(event["iteration"]))
+    if event.get("shard") is not None:
+        details.append("shard " + str(event["shard"]))
+    if details:
+        message += " (" + ", ".join(details) + ")"
+    return message + " after " + str(event["elapsed"]) + " s"
+
+
+def _read_rows(file_name: str) -> tuple:
+    """Header and rows (as text, the way they are written to CSV) of a CSV
+    or Feather file."""
+
+    if file_name.endswith(".csv"):
+        with open(file_name, "r", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            return header, list(reader)
+    text = read_va_file(file_name, compact=False).to_csv(index=False)
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader)
+    return header, list(reader)
+
+
+def _write_rows(file_name: str, header: list, rows: list) -> None:
+    """Write a header and rows of text to a CSV or Feather file (the
+    column types of a Feather file are inferred as they are for a CSV
+    file)."""
+
+    with io.StringIO(newline="") as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(header)
+        writer.writerows(rows)
+        text = f.getvalue()
+    if file_name.endswith(".csv"):
+        with open(file_name, "w", newline="") as f:
+            f.write(text)
+    else:
+        write_va_file(read_csv(io.StringIO(text)), file_name)
+
+
+def _concat_csv(file_names: list, out_file: str) -> None:
+    """Combine CSV files (with the same columns) into one file.
+
+    The rows of a file whose header differs from the header of the first
+    file are matched to its columns by name.
+    """
+
+    header = None
+    with open(out_file, "w", newline="") as f_out:
+        writer = csv.writer(f_out, lineterminator=os.linesep)
+        for file_name in file_names:
+            with open(file_name, "r", newline="") as f_in:
+                reader = csv.reader(f_in)
+                file_header = next(reader, None)
+                if file_header is None:
+                    continue
+                if header is None:
+                    header = file_header
+                    writer.writerow(header)
+                if file_header == header:
+                    writer.writerows(reader)
+                else:
+                    for row in reader:
+                        values = dict(zip(file_header, row))
+                        writer.writerow([values.get(column, "")
+                                         for column in header])
+
+
+def _transform_shard(mapping, raw_data, raw_data_id):
+    """Convert a shard of VA records with pycrossva (in a worker process)."""
+
+    return transform(mapping=mapping,
+                     raw_data=raw_data,
+                     raw_data_id=raw_data_id,
+                     verbose=0)
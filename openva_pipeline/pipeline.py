@@ -8,16 +8,38 @@ This module defines the primary API for the openVA Pipeline.
 import os
 import csv
 import datetime
+import hashlib
 import sys
-from pandas import read_csv
+from functools import partial
 from typing import Union, Dict
 
 from .transfer_db import TransferDB
 from .transfer_db import DatabaseConnectionError
 from .odk import ODK
 from .openva import OpenVA
+from .openva import progress_message
 from .dhis import DHIS
 from .exceptions import PipelineError
+from .va_data import find_va_file, read_va_file
+
+#: Stages of a pipeline run (in order) with the files each one reads and
+#: writes (relative to the working directory), as recorded in the
+#: Run_Manifest table of the Transfer database.
+STAGES = {
+    "odk": ([],
+            ["ODKFiles/odk_export_new.csv"]),
+    "openva": (["ODKFiles/odk_export_new.csv", "ODKFiles/odk_export_prev.csv"],
+               ["OpenVAFiles/record_storage.csv",
+                "OpenVAFiles/record_storage.feather"]),
+    "dhis": (["OpenVAFiles/record_storage.csv",
+              "OpenVAFiles/record_storage.feather"],
+             ["OpenVAFiles/new_storage.csv"]),
+    "store": (["OpenVAFiles/record_storage.csv",
+               "OpenVAFiles/record_storage.feather",
+               "OpenVAFiles/new_storage.csv"],
+              []),
+    "close": ([], []),
+}
 
 
 class Pipeline:
@@ -41,13 +63,18 @@ class Pipeline:
     :parameter use_dhis: Indicator for telling pipeline to post records/tracked
      entity instances to DHIS
     :type use_dhis: bool
+    :parameter in_memory: Indicator for passing the VA records from
+     :meth:`run_odk` to :meth:`run_openva` as a DataFrame (held in the
+     va_data attribute), instead of reading the ODK export again.
+    :type in_memory: bool
     """
 
     def __init__(self,
                  db_file_name: str,
                  db_directory: str,
                  db_key: str,
-                 use_dhis: bool = True):
+                 use_dhis: bool = True,
+                 in_memory: bool = False):
 
         self.db_file_name = db_file_name
         self.db_directory = db_directory
@@ -66,6 +93,10 @@ class Pipeline:
         self._config()
         self.dhis = None
         self.no_org_units = None
+        self.odk_sources_succeeded = []
+        self.in_memory = in_memory
+        self.va_data = None
+        self.run_id = self.pipeline_run_date
 
     def log_event(self, event_desc, event_type):
         """Commit event or error message into EventLog table of transfer
@@ -102,6 +133,11 @@ class Pipeline:
                 print("Can't write to db_error_log.csv")
                 print(error_msg.append(str(exc)))
 
+    def _log_progress(self, event: dict) -> None:
+        """Add a progress event of the openVA R script to the EventLog."""
+
+        self.log_event(progress_message(event), "Progress")
+
     def _config(self) -> None:
         """Fetch configuration settings from Transfer DB.
 
@@ -115,9 +151,11 @@ class Pipeline:
         settings_pipeline = self.xfer_db.config_pipeline()
         settings_odk = self.xfer_db.config_odk()
         settings_openva = self.xfer_db.config_openva(settings_pipeline.algorithm)
+        settings_odk_sources = self.xfer_db.config_odk_sources()
         settings = {
             "pipeline": settings_pipeline,
             "odk": settings_odk,
+            "odk_sources": settings_odk_sources,
             "openva": settings_openva,
         }
         self.settings = settings
@@ -130,7 +168,7 @@ class Pipeline:
         pipeline."""
 
         table_names = self._get_tables()
-        conn = self.xfer_db.connect_db()
+        conn = self.xfer_db._connect_db()
         c = conn.cursor()
         if "VA_Org_Unit_Not_Found" not in table_names:
             sql_make_table = (
@@ -159,10 +197,71 @@ class Pipeline:
             sql_make_field = "ALTER TABLE ODK_Conf ADD odkUseCentral char(5);"
             c.execute(sql_make_field)
             sql_fill_field = "UPDATE ODK_Conf SET odkUseCentral = 'False';"
-            c.execute(sql_make_field)
+            c.execute(sql_fill_field)
         if "odkProjectNumber" not in odk_fields:
             sql_make_field = "ALTER TABLE ODK_Conf ADD odkProjectNumber char(6);"
             c.execute(sql_make_field)
+        pipeline_table = self._get_fields("Pipeline_Conf")
+        pipeline_fields = [entry[0] for entry in pipeline_table]
+        if "pycrossvaShardSize" not in pipeline_fields:
+            sql_make_field = ("ALTER TABLE Pipeline_Conf ADD "
+                              "pycrossvaShardSize integer DEFAULT 1000;")
+            c.execute(sql_make_field)
+        if "pycrossvaWorkers" not in pipeline_fields:
+            sql_make_field = ("ALTER TABLE Pipeline_Conf ADD "
+                              "pycrossvaWorkers integer DEFAULT 1;")
+            c.execute(sql_make_field)
+        if "openvaShards" not in pipeline_fields:
+            sql_make_field = ("ALTER TABLE Pipeline_Conf ADD "
+                              "openvaShards integer DEFAULT 1;")
+            c.execute(sql_make_field)
+        if "openvaWorkers" not in pipeline_fields:
+            sql_make_field = ("ALTER TABLE Pipeline_Conf ADD "
+                              "openvaWorkers integer DEFAULT 1;")
+            c.execute(sql_make_field)
+        if "interchangeFormat" not in pipeline_fields:
+            sql_make_field = ("ALTER TABLE Pipeline_Conf ADD "
+                              "interchangeFormat char(7) DEFAULT 'csv';")
+            c.execute(sql_make_field)
+        for field in ["openvaTimeout", "openvaMemoryLimit",
+                      "openvaAddressSpaceLimit", "openvaNice"]:
+            if field not in pipeline_fields:
+                sql_make_field = ("ALTER TABLE Pipeline_Conf ADD " + field +
+                                  " integer DEFAULT 0;")
+                c.execute(sql_make_field)
+        if "openvaCpus" not in pipeline_fields:
+            sql_make_field = ("ALTER TABLE Pipeline_Conf ADD "
+                              "openvaCpus char(100) DEFAULT '';")
+            c.execute(sql_make_field)
+        insilicova_table = self._get_fields("InSilicoVA_Conf")
+        insilicova_fields = [entry[0] for entry in insilicova_table]
+        if "chains" not in insilicova_fields:
+            sql_make_field = ("ALTER TABLE InSilicoVA_Conf ADD "
+                              "chains char(9) DEFAULT '1';")
+            c.execute(sql_make_field)
+        if "chains_rhat" not in insilicova_fields:
+            sql_make_field = ("ALTER TABLE InSilicoVA_Conf ADD "
+                              "chains_rhat char(10) DEFAULT '1.05';")
+            c.execute(sql_make_field)
+        if "chains_rounds" not in insilicova_fields:
+            sql_make_field = ("ALTER TABLE InSilicoVA_Conf ADD "
+                              "chains_rounds char(9) DEFAULT '2';")
+            c.execute(sql_make_field)
+        if "ODK_Sources" not in table_names:
+            sql_make_table = (
+                "CREATE TABLE ODK_Sources "
+                "(odkFormID char(50) NOT NULL, "
+                "odkProjectNumber char(6) NOT NULL, "
+                "odkLastRun date, "
+                "odkURL char(50), "
+                "odkUser char(50), "
+                "odkPassword char(50));"
+            )
+            c.execute(sql_make_table)
+        self.xfer_db._update_id_filter(c)
+        self.xfer_db._create_cod_cache(c)
+        self.xfer_db._create_run_manifest(c)
+        conn.commit()
         conn.close()
 
     def _update_odk(self, field, value):
@@ -219,7 +318,83 @@ class Pipeline:
                                                   recent=last)
         return log_messages
 
-    def run_odk(self):
+    def checkpoint(self, stage: str, status: str) -> None:
+        """Record the status of a stage of this run in the run manifest.
+
+        The manifest (the Transfer database table Run_Manifest) holds the
+        status of each stage along with the SHA-256 hashes of the files the
+        stage reads (recorded when it starts) and writes (recorded when it is
+        completed); see STAGES for the files of each stage.
+
+        :parameter stage: Name of the stage (odk, openva, dhis, store, or
+         close).
+        :type stage: str
+        :parameter status: Status of the stage (started, completed, or
+         failed).
+        :type status: str
+        """
+
+        inputs, outputs = STAGES[stage]
+        input_hashes = None
+        output_hashes = None
+        if status == "started":
+            input_hashes = {f: self._hash_file(f) for f in inputs}
+        elif status == "completed":
+            output_hashes = {f: self._hash_file(f) for f in outputs}
+        self.xfer_db.update_run_manifest(self.run_id, stage, status,
+                                         input_hashes, output_hashes)
+
+    def resume_stage(self) -> str:
+        """Find the stage where the last run stopped.
+
+        If a stage of the most recent run failed (or was started but never
+        finished, e.g., because the process was killed), the run is resumed
+        at the first stage that was not completed.  A completed stage only
+        counts if the files it wrote are unchanged (i.e., their hashes match
+        the run manifest); otherwise the run is resumed at that stage.  When
+        the run is resumed after the ODK stage, this Pipeline takes over its
+        run ID (run_id attribute).
+
+        :returns: Name of the first stage to run (odk if there is nothing to
+         resume).
+        :rtype: str
+        """
+
+        run_id, stages = self.xfer_db.get_run_manifest()
+        statuses = [entry["status"] for entry in stages.values()]
+        if run_id is None or not ("failed" in statuses or
+                                  "started" in statuses):
+            return "odk"
+        for stage in STAGES:
+            entry = stages.get(stage)
+            if stage == "dhis" and entry is None and not self.use_dhis:
+                continue
+            if entry is None or entry["status"] != "completed":
+                break
+            if any(self._hash_file(f) != h
+                   for f, h in entry["output_hashes"].items()):
+                break
+        if stage != "odk":
+            self.run_id = run_id
+        return stage
+
+    def _hash_file(self, file_name: str) -> Union[str, None]:
+        """SHA-256 hash of a file in the working directory (None if it does
+        not exist)."""
+
+        path = os.path.join(self.settings["pipeline"].working_directory,
+                            file_name)
+        if not os.path.isfile(path):
+            return None
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(2 ** 20), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def run_odk(self, stream: bool = False, odata: bool = False,
+                select_columns: bool = False, skip_stored: bool = False,
+                compressed: bool = False, retries: int = 0):
         """Run check duplicates, copy file, and briefcase.
 
         This method downloads data from either (1) an ODK Central server,
@@ -234,25 +409,108 @@ class Pipeline:
         If there is a previous ODK export file, this method merges the files by
         keeping only the unique VA records.
 
+        :parameter stream: Indicator for streaming the ODK Central export
+         straight to disk (see :meth:`ODK.central()
+         <openva_pipeline.odk.ODK.central>`).
+        :type stream: bool
+        :parameter odata: Indicator for downloading the records from ODK
+         Central in concurrent pages through the OData API (see
+         :meth:`ODK.central_odata() <openva_pipeline.odk.ODK.central_odata>`).
+        :type odata: bool
+        :parameter select_columns: Indicator for only downloading the columns
+         needed by the configured algorithm from ODK Central (see
+         :meth:`ODK.select_columns()
+         <openva_pipeline.odk.ODK.select_columns>`).
+        :type select_columns: bool
+        :parameter skip_stored: Indicator for only downloading the ODK Central
+         records that are not already in the Transfer database (see
+         :meth:`ODK.central_missing()
+         <openva_pipeline.odk.ODK.central_missing>`).
+        :type skip_stored: bool
+        :parameter compressed: Indicator for downloading the zipped ODK
+         Central export (see :meth:`ODK.central()
+         <openva_pipeline.odk.ODK.central>`).
+        :type compressed: bool
+        :parameter retries: Number of times an interrupted ODK Central
+         download is resumed (see :meth:`ODK.central()
+         <openva_pipeline.odk.ODK.central>`).
+        :type retries: int
+
+        If the ODK_Sources table lists additional ODK Central forms, all of
+        them are downloaded at the same time and combined into one export
+        (see :meth:`ODK.central_sources()
+        <openva_pipeline.odk.ODK.central_sources>`); the download options
+        apply to each form.  The records are downloaded through the OData
+        API with odata, skip_stored, or select_columns, which cannot be
+        combined with stream, compressed, or retries (see
+        :meth:`ODK.check_central_options()
+        <openva_pipeline.odk.ODK.check_central_options>`).
+        Errors for individual forms are logged in the EventLog table.
+
+        If the Pipeline was created with in_memory=True, the export (without
+        duplicate records) is kept in the va_data attribute for
+        :meth:`run_openva`.
+
         :return: Summary of results from ODK step
         :rtype: tuple
+        :raises: ODKError
         """
 
         args_odk = self.settings["odk"]
+        if args_odk.odk_use_central == "True":
+            ODK.check_central_options(odata or skip_stored or select_columns,
+                                      stream, compressed, retries)
         pipeline_odk = ODK(self.settings)
         pipeline_odk.merge_to_prev_export()
-        if args_odk.odk_use_central == "True":
-            odk_central = pipeline_odk.central()
+        sources = self.settings.get("odk_sources", [])
+        if args_odk.odk_use_central == "True" and len(sources) > 0:
+            stored_ids = None
+            if skip_stored:
+                stored_ids = partial(self.xfer_db.find_stored_va_ids,
+                                     use_dhis=self.use_dhis)
+            odk_central = pipeline_odk.central_sources(
+                sources, stored_ids=stored_ids, odata=odata, stream=stream,
+                select_columns=select_columns, compressed=compressed,
+                retries=retries)
+            self.odk_sources_succeeded = pipeline_odk.sources_succeeded
+            for _, error_msg in pipeline_odk.sources_failed:
+                self.log_event(error_msg, "Error")
+        elif args_odk.odk_use_central == "True" and skip_stored:
+            odk_central = pipeline_odk.central_missing(
+                partial(self.xfer_db.find_stored_va_ids,
+                        use_dhis=self.use_dhis),
+                select_columns=select_columns)
+        elif args_odk.odk_use_central == "True" and odata:
+            odk_central = pipeline_odk.central_odata(
+                select_columns=select_columns)
+        elif args_odk.odk_use_central == "True":
+            odk_central = pipeline_odk.central(stream=stream,
+                                               select_columns=select_columns,
+                                               compressed=compressed,
+                                               retries=retries)
         else:
             odk_bc = pipeline_odk.briefcase()
+            timings = pipeline_odk.timings
+            if timings.get("export") is None:
+                timings_msg = ("ODK Briefcase pull took {0:.1f}s (no new "
+                               "submissions, export skipped)"
+                               .format(timings["pull"]))
+            else:
+                timings_msg = ("ODK Briefcase pull took {0:.1f}s and export "
+                               "took {1:.1f}s".format(timings["pull"],
+                                                       timings["export"]))
+            self.log_event(timings_msg, "Event")
         self.xfer_db.config_pipeline()
-        odk_summary = self.xfer_db.check_duplicates(self.use_dhis)
+        odk_summary = self.xfer_db.check_duplicates(
+            self.use_dhis, return_data=self.in_memory)
+        if self.in_memory:
+            self.va_data = odk_summary.pop("va_data")
         if args_odk.odk_use_central == "True":
             return odk_central, odk_summary
         else:
             return odk_bc, odk_summary
 
-    def run_openva(self):
+    def run_openva(self, cod_cache: bool = False, r_worker=None):
         """Create & run script or run smartva.
 
         This method runs the through the suite of methods in the
@@ -265,10 +523,31 @@ class Pipeline:
         to create an R script; and (3) call the method
         :meth:`OpenVA.get_cod() <openva_pipeline.openVA.OpenVA.get_cod>` to
         run the R script that estimates the causes of death and stores the
-        results in "OpenVAFiles/recordStorage.csv" and
-        "OpenVAFiles/entityAttributeValue.csv" (the former serving as the
-        blob posted to DHIS2).
-
+        results in "OpenVAFiles/record_storage.csv" (from which the blob
+        posted to DHIS2 is created).  If the Pipeline was created with
+        in_memory=True, the VA records kept by :meth:`run_odk` are passed to
+        prep_va_data (and then released); if there are none (e.g., the
+        pipeline resumes after the ODK step), the duplicate records are
+        removed from the ODK export again.  The progress lines of the R
+        script are added to the EventLog table (with eventType Progress)
+        while it runs, and the time spent in each of its phases is returned
+        as phase_times.
+
+        :parameter cod_cache: Indicator for reusing the results of VA records
+         that were already assigned a cause with the same algorithm settings
+         (e.g., records kept in the ODK export after a failed post to DHIS2).
+         These records are not sent to the algorithm again; their results are
+         taken from the Transfer database table COD_Cache (see
+         :meth:`OpenVA.use_cod_cache()
+         <openva_pipeline.openva.OpenVA.use_cod_cache>`).  Only the results
+         of InterVA are reused: the cause InSilicoVA assigns to a record
+         depends on the other records in the same run, so all records are
+         sent to InSilicoVA (and SmartVA) even if cod_cache is True.
+        :type cod_cache: bool
+        :parameter r_worker: R process with openVA already loaded that runs
+         the R script (see :meth:`OpenVA.get_cod()
+         <openva_pipeline.openva.OpenVA.get_cod>`).
+        :type r_worker: :class:`RWorker <openva_pipeline.r_worker.RWorker>`
         :return: an indicator of zero VA records in the ODK export
         :rtype: dictionary
         """
@@ -277,12 +556,30 @@ class Pipeline:
             settings=self.settings,
             pipeline_run_date=self.pipeline_run_date,
         )
-        r_out = pipeline_openva.prep_va_data()
+        if self.in_memory and self.va_data is None:
+            # e.g., resumed after run_odk: the ODK export on disk still holds
+            # the duplicate records
+            self.xfer_db.config_pipeline()
+            self.va_data = self.xfer_db.check_duplicates(
+                self.use_dhis, return_data=True)["va_data"]
+        r_out = pipeline_openva.prep_va_data(va_data=self.va_data)
+        self.va_data = None
         if r_out["n_to_openva"] > 0:
-            pipeline_openva.r_script()
-            completed = pipeline_openva.get_cod()
-            # r_out["completed"] = completed
-            r_out["return_code"] = completed.returncode
+            n_cached = 0
+            if cod_cache:
+                n_cached = pipeline_openva.use_cod_cache(
+                    self.xfer_db.get_cod_cache)
+                r_out["n_cached"] = n_cached
+            if r_out["n_to_openva"] > n_cached:
+                pipeline_openva.r_script()
+                completed = pipeline_openva.get_cod(
+                    r_worker=r_worker, progress=self._log_progress)
+                # r_out["completed"] = completed
+                r_out["return_code"] = completed.returncode
+                r_out["phase_times"] = pipeline_openva.phase_times()
+            if cod_cache:
+                entries = pipeline_openva.merge_cod_cache()
+                self.xfer_db.store_cod_cache(entries)
             summary = pipeline_openva.get_summary()
             r_out.update(summary)
         else:
@@ -422,8 +719,7 @@ class Pipeline:
             print(f"{va_id} is not in Transfer database table "
                   "VA_Org_Unit_Not_Found")
             return "fail"
-        va_storage_ids = self.xfer_db._get_va_storage_ids()
-        if va_id in va_storage_ids:
+        if self.xfer_db.find_stored_va_ids([va_id], use_dhis=False):
             print(f"{va_id} is already stored in VA_Storage table!")
             return "fail"
         valid_org_units = self.get_dhis_org_units()
@@ -455,13 +751,13 @@ class Pipeline:
         if not self.use_dhis:
             args_pipeline = self.settings["pipeline"]
             working_directory = args_pipeline.working_directory
-            record_storage_path = os.path.join(
-                working_directory,
-                "OpenVAFiles/record_storage.csv")
+            record_storage_path = find_va_file(
+                os.path.join(working_directory, "OpenVAFiles"),
+                "record_storage")
             new_storage_path = os.path.join(
                 working_directory,
                 "OpenVAFiles/new_storage.csv")
-            record_storage = read_csv(record_storage_path)
+            record_storage = read_va_file(record_storage_path)
             record_storage["pipelineOutcome"] = "Assigned a cause of death"
             missing_cod = record_storage["cod"] == "MISSING"
             record_storage.loc[missing_cod,
@@ -483,9 +779,8 @@ class Pipeline:
         :meth:`TransferDB.clean_openva()
         <openva_pipeline.transferDB.TransferDB.clean_openva>`
         to remove the input data file ("OpenVAFiles/openva_input.csv") and the
-        output files ("OpenVAFiles/record_storage.csv",
-        "OpenVAFiles/new_storage.csv", and
-        "OpenVAFiles/entity_attribute_value.csv") -- note that all of these
+        output files ("OpenVAFiles/record_storage.csv" and
+        "OpenVAFiles/new_storage.csv") -- note that all of these
         results are stored in either/both of the Transfer DB and the DHIS2
         server's VA program; and, third, the method
         :meth:`TransferDB.clean_dhis()
@@ -494,7 +789,8 @@ class Pipeline:
         the folder "DHIS/blobs".  Finally, this method updates the Transfer
         DB's value in the ODK_Conf table's variable odk_last_run so the next ODK
         Export file does not include VA records already processed through the
-        pipeline.
+        pipeline (along with odkLastRun in the ODK_Sources table for the forms
+        that were downloaded successfully).
         """
 
         self.xfer_db.config_pipeline()
@@ -503,3 +799,6 @@ class Pipeline:
         if self.use_dhis:
             self.xfer_db.clean_dhis()
         self.xfer_db.update_odk_last_run()
+        if len(self.odk_sources_succeeded) > 0:
+            self.xfer_db.update_odk_sources_last_run(
+                self.odk_sources_succeeded)
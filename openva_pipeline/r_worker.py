@@ -0,0 +1,339 @@
+"""
+openva_pipeline.r_worker
+------------------------
+
+This module keeps a long-lived R process (with openVA already loaded) that
+runs the R scripts created by :class:`OpenVA <openva_pipeline.openva.OpenVA>`.
+"""
+
+import hashlib
+import json
+import os
+import secrets
+import shutil
+import signal
+import socket
+import subprocess
+import time
+from typing import Sequence
+
+from .exceptions import OpenVAError
+from .supervisor import limited_command
+
+#: R code of the worker.  It loads openVA once and then waits for requests
+#: (one line per connection) on a local port.  Every request starts with the
+#: token of the worker, followed by a command (PING, STOP, or RUN with the
+#: paths of the R script, the file for its output, and the working
+#: directory) -- all separated by tabs.  PING is answered with STALE if one
+#: of the loaded packages (including the base packages of R) was installed
+#: again after the worker started.
+R_WORKER_SCRIPT = r"""
+args <- commandArgs(trailingOnly = TRUE)
+port <- as.integer(args[1])
+token <- args[2]
+idle_timeout <- as.numeric(args[3])
+suppressPackageStartupMessages({
+  library(openVA)
+  library(lubridate)
+})
+package_files <- vapply(loadedNamespaces(), function(package) {
+  system.file("DESCRIPTION", package = package)
+}, "")
+package_times <- file.mtime(package_files)
+server <- serverSocket(port)
+run_script <- function(script_in, script_out, cwd) {
+  out <- file(script_out, open = "wt")
+  sink(out)
+  sink(out, type = "message")
+  old_wd <- setwd(cwd)
+  status <- tryCatch({
+    source(script_in, local = new.env(), echo = TRUE,
+           max.deparse.length = Inf)
+    "OK"
+  }, error = function(e) {
+    print(e)
+    paste("ERROR", gsub("[\r\n\t]", " ", conditionMessage(e)))
+  })
+  setwd(old_wd)
+  sink(type = "message")
+  sink()
+  close(out)
+  gc()
+  status
+}
+repeat {
+  con <- tryCatch(socketAccept(server, blocking = TRUE, open = "r+",
+                               timeout = idle_timeout),
+                  error = function(e) NULL)
+  if (is.null(con)) break
+  request <- strsplit(readLines(con, n = 1, warn = FALSE), "\t")[[1]]
+  if (length(request) < 2 || request[1] != token) {
+    close(con)
+    next
+  }
+  command <- request[2]
+  if (command == "STOP") {
+    writeLines("BYE", con)
+    close(con)
+    break
+  } else if (command == "PING") {
+    reply <- if (identical(file.mtime(package_files), package_times)) {
+      "PONG"
+    } else {
+      "STALE"
+    }
+  } else if (command == "RUN" && length(request) == 5) {
+    reply <- run_script(request[3], request[4], request[5])
+  } else {
+    reply <- paste("ERROR unknown request", command)
+  }
+  writeLines(reply, con)
+  close(con)
+}
+close(server)
+quit(save = "no")
+"""
+
+
+class RWorker:
+    """Long-lived R process that runs openVA scripts.
+
+    Starting R and loading openVA (with its Java-backed dependencies) takes
+    longer than the analysis of a small batch of VA records.  The worker is
+    started once (in its own session, so it outlives the pipeline run) and
+    listens on a local port; later runs find it through the state file
+    r_worker.json in the working directory and reuse it.  The worker is
+    checked (PING) before each script is sent and restarted if it does not
+    answer; it quits after idle_timeout seconds without requests.
+
+    A worker is only reused if it was started with the same settings (the
+    R command and the version of its binary, idle_timeout, and the limits)
+    -- the state file keeps a fingerprint of them -- and if none of its R
+    packages (e.g., openVA) was updated since it started.  Otherwise it is
+    stopped and a new worker is started.  The limits (set before R starts;
+    see :func:`limited_command()
+    <openva_pipeline.supervisor.limited_command>`) apply to the worker and
+    to the R processes it starts.
+
+    :parameter working_directory: Working directory of the pipeline (where
+     the worker script, state file, and log are kept).
+    :type working_directory: str
+    :parameter r_command: Command used to start R.
+    :type r_command: str
+    :parameter startup_timeout: Number of seconds to wait for a new worker
+     to load openVA.
+    :type startup_timeout: int
+    :parameter idle_timeout: Number of seconds without requests before the
+     worker quits.
+    :type idle_timeout: int
+    :parameter address_space_limit: Largest virtual memory (in MB) of each
+     R process (None for no limit).
+    :type address_space_limit: int
+    :parameter nice: Increment of the nice level of the worker.
+    :type nice: int
+    :parameter cpus: CPUs the worker may run on (None for all).
+    :type cpus: list of int
+    """
+
+    def __init__(self, working_directory: str, r_command: str = "Rscript",
+                 startup_timeout: int = 300, idle_timeout: int = 86400,
+                 address_space_limit: int = None, nice: int = 0,
+                 cpus: Sequence[int] = None):
+
+        self.working_directory = working_directory
+        self.r_command = r_command
+        self.startup_timeout = startup_timeout
+        self.idle_timeout = idle_timeout
+        self.limits = {"address_space_limit": address_space_limit,
+                       "nice": nice,
+                       "cpus": sorted(cpus) if cpus else None}
+        self.fingerprint = self._fingerprint()
+        self.script_file = os.path.join(working_directory, "r_worker.R")
+        self.state_file = os.path.join(working_directory, "r_worker.json")
+        self.log_file = os.path.join(working_directory, "r_worker.log")
+        self.state = self._read_state()
+
+    def _read_state(self) -> dict:
+        """Read the pid, port, and token of a running worker."""
+
+        try:
+            with open(self.state_file, "r") as f:
+                state = json.load(f)
+            if {"pid", "port", "token"} <= set(state):
+                return state
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _fingerprint(self) -> str:
+        """Hash of the settings of the worker and of the R binary (its path
+        and modification time, which changes when R is upgraded)."""
+
+        r_binary = shutil.which(self.r_command)
+        r_version = None
+        if r_binary is not None:
+            r_binary = os.path.realpath(r_binary)
+            try:
+                r_version = os.stat(r_binary).st_mtime
+            except OSError:
+                pass
+        content = json.dumps([R_WORKER_SCRIPT, self.r_command, r_binary,
+                              r_version, self.idle_timeout, self.limits],
+                             sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _write_state(self) -> None:
+        with open(self.state_file, "w") as f:
+            json.dump(self.state, f)
+        os.chmod(self.state_file, 0o600)
+
+    def _request(self, command: str, timeout: float = None) -> str:
+        """Send a request to the worker and return its reply.
+
+        :raises: OSError if the worker cannot be reached or closes the
+         connection without answering.
+        """
+
+        if not self.state:
+            raise ConnectionRefusedError("R worker is not running")
+        message = "\t".join([self.state["token"], command]) + "\n"
+        with socket.create_connection(("127.0.0.1", self.state["port"]),
+                                      timeout=5) as conn:
+            conn.settimeout(timeout)
+            conn.sendall(message.encode("utf-8"))
+            reply = b""
+            while not reply.endswith(b"\n"):
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                reply += chunk
+        if not reply.endswith(b"\n"):
+            raise ConnectionResetError("R worker closed the connection")
+        return reply.decode("utf-8").strip()
+
+    def ping(self) -> bool:
+        """Check that the worker is running and answering requests (and
+        that none of its R packages was updated).
+
+        :rtype: bool
+        """
+
+        try:
+            return self._request("PING", timeout=10) == "PONG"
+        except OSError:
+            return False
+
+    def ensure_running(self) -> None:
+        """Start a new worker unless the current one has the same
+        fingerprint and answers a PING.
+
+        :raises: OpenVAError if the worker does not start (e.g., R or the
+         openVA package is not installed); see r_worker.log for details.
+        """
+
+        if self.state.get("fingerprint") == self.fingerprint and \
+                self.ping():
+            return
+        self.stop()
+        with open(self.script_file, "w", newline="") as f:
+            f.write(R_WORKER_SCRIPT)
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        token = secrets.token_hex(16)
+        try:
+            with open(self.log_file, "w") as log:
+                process = subprocess.Popen(
+                    limited_command(
+                        [self.r_command, "--vanilla", self.script_file,
+                         str(port), token, str(self.idle_timeout)],
+                        **self.limits),
+                    stdin=subprocess.DEVNULL,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=(os.name == "posix"))
+        except OSError as exc:
+            raise OpenVAError("Unable to start R worker: " +
+                              str(exc)) from exc
+        self.state = {"pid": process.pid, "port": port, "token": token,
+                      "fingerprint": self.fingerprint}
+        self._write_state()
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.ping():
+                return
+            if process.poll() is not None:
+                break
+            time.sleep(0.5)
+        self.stop()
+        raise OpenVAError("R worker did not start (see " +
+                          self.log_file + ")")
+
+    def run_script(self, r_script_in: str, r_script_out: str,
+                   timeout: float = None) -> subprocess.CompletedProcess:
+        """Run an R script in the worker (restarting it if needed).
+
+        The output of the script is written to r_script_out (as with
+        R CMD BATCH).  A worker that is still running the script after
+        timeout seconds, or that closes the connection before it answers
+        (e.g., because it crashed), is stopped.
+
+        :parameter r_script_in: Path of the R script.
+        :type r_script_in: str
+        :parameter r_script_out: Path of the file for the output of the
+         script.
+        :type r_script_out: str
+        :parameter timeout: Number of seconds the script may run (None for no
+         limit).
+        :type timeout: float
+        :returns: The reply of the worker as stdout, with a return code of 0
+         if the script ran without errors (1 otherwise).
+        :rtype: subprocess.CompletedProcess
+        :raises: OpenVAError if the worker cannot be started;
+         subprocess.TimeoutExpired if the script runs longer than timeout.
+        """
+
+        self.ensure_running()
+        command = "\t".join(["RUN", os.path.abspath(r_script_in),
+                             os.path.abspath(r_script_out), os.getcwd()])
+        try:
+            reply = self._request(command, timeout=timeout)
+        except socket.timeout as exc:
+            self.stop()
+            raise subprocess.TimeoutExpired([self.r_command, r_script_in],
+                                            timeout) from exc
+        except OSError as exc:
+            self.stop()
+            reply = "ERROR lost connection to R worker: " + str(exc)
+        return_code = 0 if reply == "OK" else 1
+        return subprocess.CompletedProcess(
+            args=[self.r_command, r_script_in], returncode=return_code,
+            stdout=reply.encode("utf-8"),
+            stderr=b"" if return_code == 0 else reply.encode("utf-8"))
+
+    def stop(self) -> None:
+        """Stop the worker and remove its state file."""
+
+        if self.state:
+            try:
+                self._request("STOP", timeout=10)
+            except OSError:
+                if self._is_worker(self.state["pid"]):
+                    try:
+                        os.kill(self.state["pid"], signal.SIGTERM)
+                    except OSError:
+                        pass
+        self.state = {}
+        if os.path.isfile(self.state_file):
+            os.remove(self.state_file)
+
+    def _is_worker(self, pid: int) -> bool:
+        """Check that the process pid is running the worker script (so that
+        a pid reused by another process is not signalled)."""
+
+        try:
+            with open(os.path.join("/proc", str(pid), "cmdline"), "rb") as f:
+                cmdline = f.read().split(b"\0")
+        except OSError:
+            return False
+        return self.script_file.encode() in cmdline
@@ -17,12 +17,15 @@
 
 import sys
 import os
+import json
 import shutil
 import subprocess
 import requests
 from sqlcipher3 import dbapi2 as sqlcipher
 
 from openva_pipeline.pipeline import Pipeline
+from openva_pipeline.pipeline import STAGES
+from openva_pipeline.r_worker import RWorker
 from openva_pipeline.exceptions import PipelineError
 from openva_pipeline.exceptions import DatabaseConnectionError
 from openva_pipeline.exceptions import PipelineConfigurationError
@@ -66,7 +69,8 @@ def create_transfer_db(database_file_name, database_directory, database_key):
 
 def run_pipeline(
         database_file_name, database_directory, database_key,
-        export_to_dhis=True):
+        export_to_dhis=True, in_memory=False, cod_cache=False,
+        resume=False, r_worker=False):
     """Runs through all steps of the OpenVA Pipeline
 
     This function is a wrapper for the Pipeline class, which
@@ -82,6 +86,31 @@ def run_pipeline(
     :parameter database_key: Encryption key for the Transfer Database
     :parameter export_to_dhis: Indicator for posting VA records to a DHIS2 server.
     :type export_to_dhis: (Boolean)
+    :parameter in_memory: Indicator for passing the VA records from the ODK
+     step to openVA as a DataFrame (see :class:`Pipeline
+     <openva_pipeline.pipeline.Pipeline>`).
+    :type in_memory: (Boolean)
+    :parameter cod_cache: Indicator for reusing the causes already assigned
+     to VA records kept from a previous run (see :meth:`Pipeline.run_openva()
+     <openva_pipeline.pipeline.Pipeline.run_openva>`).  This only applies
+     to InterVA, which assigns the cause of each record on its own.  The
+     causes InSilicoVA assigns depend on all of the records in a run, so a
+     cached cause could differ from the one assigned with the new records;
+     these runs always send every record to the algorithm.
+    :type cod_cache: (Boolean)
+    :parameter resume: Indicator for resuming the last run at the stage
+     where it stopped (e.g., posting to DHIS2 after a DHISError), instead of
+     downloading the records and assigning causes again.  The status of each
+     stage and the hashes of its files are kept in the Transfer Database table
+     Run_Manifest (see :meth:`Pipeline.resume_stage()
+     <openva_pipeline.pipeline.Pipeline.resume_stage>`).
+    :type resume: (Boolean)
+    :parameter r_worker: Indicator for running the openVA R script in a
+     long-lived R process that keeps openVA loaded between runs (see
+     :class:`RWorker <openva_pipeline.r_worker.RWorker>`), instead of
+     starting R for each run.  The worker is started again when the limits
+     in Pipeline_Conf, R, or the R packages change.
+    :type r_worker: (Boolean)
     """
 
     pl = Pipeline(
@@ -89,19 +118,44 @@ def run_pipeline(
         db_directory=database_directory,
         db_key=database_key,
         use_dhis=export_to_dhis,
+        in_memory=in_memory,
     )
-    check_r = shutil.which("R")
-    if not check_r:
-        print("R is not installed (needed for running openVA)")
-        pl.log_event("R is not installed (unable to assign causes of death)",
-                     "Error")
-        sys.exit(1)
-    openva_is_installed = check_openva_install(database_directory)
-    if not openva_is_installed:
-        print("R package openVA is not installed.")
-        pl.log_event("R package openVA is not installed.",
-                     "Error")
-        sys.exit(1)
+    stages = list(STAGES)
+    first_stage = pl.resume_stage() if resume else "odk"
+    to_run = stages[stages.index(first_stage):]
+    if first_stage != "odk":
+        pl.log_event(f"Resuming run {pl.run_id} at the {first_stage} stage.",
+                     "Event")
+
+    if "openva" in to_run:
+        check_r = shutil.which("R")
+        if not check_r:
+            print("R is not installed (needed for running openVA)")
+            pl.log_event("R is not installed (unable to assign causes of "
+                         "death)", "Error")
+            sys.exit(1)
+        if r_worker:
+            pipeline_args = pl.settings["pipeline"]
+            worker = RWorker(
+                pipeline_args.working_directory,
+                address_space_limit=(
+                    pipeline_args.openva_address_space_limit or None),
+                nice=pipeline_args.openva_nice,
+                cpus=pipeline_args.openva_cpus or None)
+            try:
+                worker.ensure_running()
+                openva_is_installed = True
+            except OpenVAError as e:
+                pl.log_event(str(e), "Error")
+                openva_is_installed = False
+        else:
+            worker = None
+            openva_is_installed = check_openva_install(database_directory)
+        if not openva_is_installed:
+            print("R package openVA is not installed.")
+            pl.log_event("R package openVA is not installed.",
+                         "Error")
+            sys.exit(1)
 
     # try:
     #     pl.config()
@@ -109,44 +163,64 @@ def run_pipeline(
     #     pl.log_event(str(e), "Error")
     #     sys.exit(1)
 
-    try:
-        odk_out, stats = pl.run_odk()
-        pl.log_event("ODK export completed successfully.", "Event")
-        if stats["n_records"] == 0:
-            pl.log_event("No new records from ODK server.", "Event")
-            sys.exit(0)
-        odk_summary_msg = (
-            f"Downloaded {stats['n_records']} VA records from ODK server, "
-            f"found {stats['n_duplicates']} duplicate VA records, "
-            f"and sending {stats['n_unique']} VA records to openVA."
-        )
-        pl.log_event(odk_summary_msg, "Summary")
-    except ODKError as e:
-        pl.log_event(str(e), "Error")
-        sys.exit(1)
+    if "odk" in to_run:
+        try:
+            pl.checkpoint("odk", "started")
+            odk_out, stats = pl.run_odk()
+            pl.checkpoint("odk", "completed")
+            pl.log_event("ODK export completed successfully.", "Event")
+            if stats["n_records"] == 0:
+                pl.log_event("No new records from ODK server.", "Event")
+                sys.exit(0)
+            odk_summary_msg = (
+                f"Downloaded {stats['n_records']} VA records from ODK server, "
+                f"found {stats['n_duplicates']} duplicate VA records, "
+                f"and sending {stats['n_unique']} VA records to openVA."
+            )
+            pl.log_event(odk_summary_msg, "Summary")
+        except ODKError as e:
+            pl.checkpoint("odk", "failed")
+            pl.log_event(str(e), "Error")
+            sys.exit(1)
 
-    try:
-        r_out = pl.run_openva()
-        if r_out["n_to_openva"] == 0:
-            pl.log_event("No new VA records from ODK (now exiting)", "Event")
-            sys.exit(0)
-        pl.log_event("OpenVA analysis completed successfully.", "Event")
-        openva_summary_msg = (
-            f"Received {r_out['n_export_new']} VA records, "
-            f"found {r_out['n_export_prev']} VA records from previous run "
-            "that need causes form openVA (checking for duplicates), and "
-            f"sent {r_out['n_to_openva']} unique VA records through openVA.  "
-            f"openVA processed {r_out['n_processed']} VA records, including "
-            f"{r_out['n_cod_missing']} with NO assigned cause of death."
-        )
-        pl.log_event(openva_summary_msg, "Summary")
-    except (OpenVAError, SmartVAError) as e:
-        pl.log_event(str(e), "Error")
-        sys.exit(1)
+    if "openva" in to_run:
+        try:
+            pl.checkpoint("openva", "started")
+            r_out = pl.run_openva(cod_cache=cod_cache, r_worker=worker)
+            pl.checkpoint("openva", "completed")
+            if r_out["n_to_openva"] == 0:
+                pl.log_event("No new VA records from ODK (now exiting)",
+                             "Event")
+                sys.exit(0)
+            pl.log_event("OpenVA analysis completed successfully.", "Event")
+            openva_summary_msg = (
+                f"Received {r_out['n_export_new']} VA records, "
+                f"found {r_out['n_export_prev']} VA records from previous "
+                "run that need causes form openVA (checking for duplicates), "
+                f"and sent {r_out['n_to_openva']} unique VA records through "
+                f"openVA.  openVA processed {r_out['n_processed']} VA "
+                f"records, including {r_out['n_cod_missing']} with NO "
+                "assigned cause of death."
+            )
+            if r_out.get("n_cached", 0) > 0:
+                openva_summary_msg += (
+                    f"  The causes of {r_out['n_cached']} VA records were "
+                    "taken from the COD cache.")
+            if r_out.get("phase_times"):
+                openva_summary_msg += "  Time spent in R: " + ", ".join(
+                    f"{phase} {seconds} s"
+                    for phase, seconds in r_out["phase_times"].items()) + "."
+            pl.log_event(openva_summary_msg, "Summary")
+        except (OpenVAError, SmartVAError) as e:
+            pl.checkpoint("openva", "failed")
+            pl.log_event(str(e), "Error")
+            sys.exit(1)
 
-    if export_to_dhis:
+    if export_to_dhis and "dhis" in to_run:
         try:
+            pl.checkpoint("dhis", "started")
             dhis_out = pl.run_dhis()
+            pl.checkpoint("dhis", "completed")
             n = dhis_out["n_posted_events"]
             n_no_ou = dhis_out["n_no_valid_org_unit"]
             msg = (f"Posted {n} events to DHIS2 successfully.  "
@@ -154,22 +228,31 @@ def run_pipeline(
                    "organisation unit for DHIS2.")
             pl.log_event(msg, "Event")
         except DHISError as e:
+            pl.checkpoint("dhis", "failed")
             pl.log_event(str(e), "Error")
             sys.exit(1)
 
-    try:
-        pl.store_results_db()
-        pl.log_event("Stored records to Xfer database successfully", "Event")
-    except (PipelineError, DatabaseConnectionError,
-            PipelineConfigurationError) as e:
-        pl.log_event(str(e), "Error")
-        sys.exit(1)
+    if "store" in to_run:
+        try:
+            pl.checkpoint("store", "started")
+            pl.store_results_db()
+            pl.checkpoint("store", "completed")
+            pl.log_event("Stored records to Xfer database successfully",
+                         "Event")
+        except (PipelineError, DatabaseConnectionError,
+                PipelineConfigurationError) as e:
+            pl.checkpoint("store", "failed")
+            pl.log_event(str(e), "Error")
+            sys.exit(1)
 
     try:
+        pl.checkpoint("close", "started")
         pl.close_pipeline()
+        pl.checkpoint("close", "completed")
         pl.log_event("Successfully completed run of pipeline", "Event")
         sys.exit(0)
     except (DatabaseConnectionError, DatabaseConnectionError) as e:
+        pl.checkpoint("close", "failed")
         pl.log_event(str(e), "Error")
         sys.exit(1)
 
@@ -204,16 +287,56 @@ def download_smartva():
         raise SmartVAError("Error downloading smartva: {}".format(str(e)))
 
 
-def check_openva_install(working_directory: str) -> bool:
-    """Check that openVA R package and dependencies are installed."""
+def check_openva_install(working_directory: str,
+                         use_cache: bool = True,
+                         r_command: str = "R") -> bool:
+    """Check that openVA R package and dependencies are installed.
+
+    A successful check is saved in openva_install.json (in the working
+    directory) along with a fingerprint of the R installation: the path of
+    the R binary, the R version, and the modification times of the
+    installed openVA and lubridate packages.  Later checks only start R
+    when the fingerprint has changed (e.g., after R or one of the packages
+    was updated or removed).
+
+    :parameter working_directory: Directory for the R script and the cache
+     file.
+    :type working_directory: str
+    :parameter use_cache: Indicator for using the cached result of an
+     earlier (successful) check.
+    :type use_cache: bool
+    :parameter r_command: Command for running R.
+    :type r_command: str
+    :returns: Indicator that openVA and lubridate can be loaded.
+    :rtype: bool
+    """
+
+    cache_file = os.path.join(working_directory, "openva_install.json")
+    r_path = shutil.which(r_command)
+    if r_path is None:
+        return False
+    r_path = os.path.realpath(r_path)
+    if use_cache:
+        try:
+            with open(cache_file, "r") as f:
+                cached = json.load(f)
+            if cached == _r_fingerprint(r_path, cached["r_home"],
+                                        cached["packages"]):
+                return True
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
 
     r_script = os.path.join(working_directory,
                             "test_openva_install.R")
+    r_paths = os.path.join(working_directory, "test_openva_install.txt")
+    r_paths_arg = r_paths.replace("\\", "/")
 
     with open(r_script, "w", newline="") as f:
-        f.write("library(openVA); library(lubridate)")
+        f.write("library(openVA); library(lubridate)\n")
+        f.write("writeLines(c(R.home(), find.package('openVA'), "
+                f"find.package('lubridate')), '{r_paths_arg}')\n")
 
-    r_args = ["R", "CMD", "BATCH", "--no-save", "--no-restore",
+    r_args = [r_command, "CMD", "BATCH", "--no-save", "--no-restore",
               r_script, r_script + "out"]
     try:
         # capture_output=True not available in Python 3.6
@@ -223,6 +346,7 @@ def check_openva_install(working_directory: str) -> bool:
                                    stderr=subprocess.PIPE,
                                    check=True)
         if completed.returncode == 0:
+            _save_r_fingerprint(cache_file, r_path, r_paths)
             os.remove(r_script)
             os.remove(r_script + "out")
             return True
@@ -231,6 +355,57 @@ def check_openva_install(working_directory: str) -> bool:
     except subprocess.CalledProcessError as exc:
         if exc.returncode == 1:
             return False
+    finally:
+        if os.path.isfile(r_paths):
+            os.remove(r_paths)
+
+
+def _r_fingerprint(r_path: str, r_home: str, packages: dict) -> dict:
+    """Fingerprint of an R installation (without starting R).
+
+    :parameter r_path: Path of the R binary.
+    :type r_path: str
+    :parameter r_home: R home directory (R.home()).
+    :type r_home: str
+    :parameter packages: Package names and installation directories (the
+     modification times are ignored).
+    :type packages: dict
+    :returns: R binary, R home, R version, and the installation directories
+     and modification times of the packages.
+    :rtype: dict
+    :raises: OSError if a package directory does not exist
+    """
+
+    r_version = None
+    description = os.path.join(r_home, "library", "base", "DESCRIPTION")
+    with open(description, "r") as f:
+        for line in f:
+            if line.startswith("Version:"):
+                r_version = line.split(":", 1)[1].strip()
+                break
+    return {"r_path": r_path,
+            "r_home": r_home,
+            "r_version": r_version,
+            "packages": {name: [package[0], os.stat(package[0]).st_mtime]
+                         for name, package in packages.items()}}
+
+
+def _save_r_fingerprint(cache_file: str, r_path: str, r_paths: str):
+    """Save the fingerprint of a successful install check (the R home and
+    package directories are written to r_paths by the R script)."""
+
+    try:
+        with open(r_paths, "r") as f:
+            r_home, openva_dir, lubridate_dir = f.read().splitlines()[:3]
+        fingerprint = _r_fingerprint(
+            r_path, r_home, {"openVA": [openva_dir],
+                             "lubridate": [lubridate_dir]})
+        with open(cache_file, "w") as f:
+            json.dump(fingerprint, f)
+    except (OSError, ValueError):
+        # without a fingerprint the next run checks the installation again
+        if os.path.isfile(cache_file):
+            os.remove(cache_file)
 
 
 # if __name__ == "__main__":
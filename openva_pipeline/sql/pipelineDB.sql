@@ -3,7 +3,17 @@ CREATE TABLE Pipeline_Conf
   algorithmMetadataCode char(100),
   codSource             char ( 6) NOT NULL CHECK (codSource IN ('ICD10', 'WHO', 'Tariff')),
   algorithm             char(  8) NOT NULL CHECK (algorithm IN ('InterVA', 'InSilicoVA', 'SmartVA')),
-  workingDirectory      char(100)
+  workingDirectory      char(100),
+  pycrossvaShardSize    integer DEFAULT 1000,
+  pycrossvaWorkers      integer DEFAULT 1,
+  openvaShards          integer DEFAULT 1,
+  openvaWorkers         integer DEFAULT 1,
+  interchangeFormat     char(7) DEFAULT 'csv' CHECK (interchangeFormat IN ('csv', 'feather')),
+  openvaTimeout           integer DEFAULT 0,
+  openvaMemoryLimit       integer DEFAULT 0,
+  openvaAddressSpaceLimit integer DEFAULT 0,
+  openvaNice              integer DEFAULT 0,
+  openvaCpus              char(100) DEFAULT ''
 );
 
 INSERT INTO Pipeline_Conf
@@ -32,6 +42,50 @@ CREATE TABLE VA_Org_Unit_Not_Found
   fixed       char(5)
 );
 
+CREATE INDEX VA_Storage_id ON VA_Storage (id);
+CREATE INDEX VA_Org_Unit_Not_Found_id ON VA_Org_Unit_Not_Found (id);
+
+CREATE TABLE VA_ID_Filter
+(
+  capacity integer,
+  nItems   integer,
+  bits     blob
+);
+
+CREATE TABLE VA_ID_Filter_New
+(
+  id text
+);
+
+CREATE TRIGGER VA_Storage_id_filter AFTER INSERT ON VA_Storage
+BEGIN
+  INSERT INTO VA_ID_Filter_New (id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER VA_Org_Unit_Not_Found_id_filter AFTER INSERT ON VA_Org_Unit_Not_Found
+BEGIN
+  INSERT INTO VA_ID_Filter_New (id) VALUES (NEW.id);
+END;
+
+CREATE TABLE COD_Cache
+(
+  key         char(64) PRIMARY KEY,
+  id          char(100) NOT NULL,
+  record      text,
+  dateEntered date
+);
+
+CREATE TABLE Run_Manifest
+(
+  runID        char(20) NOT NULL,
+  stage        char(10) NOT NULL,
+  status       char(10) NOT NULL,
+  inputHashes  text,
+  outputHashes text,
+  dateEntered  date,
+  PRIMARY KEY (runID, stage)
+);
+
 CREATE TABLE EventLog
 (
   eventDesc char(255),
@@ -55,6 +109,16 @@ INSERT INTO ODK_Conf
   (odkURL, odkUser, odkPassword, odkFormID, odkLastRun, odkUseCentral, odkProjectNumber)
   VALUES('https://odk-central.swisstph.ch', 'who.va.view@swisstph.ch', 'WHOVAVi3w153!', 'va_who_v1_5_3', '1900-01-01_00:00:01', 'True', '40');
 
+CREATE TABLE ODK_Sources
+(
+  odkFormID        char(50) NOT NULL,
+  odkProjectNumber char(6)  NOT NULL,
+  odkLastRun       date,
+  odkURL           char(50),
+  odkUser          char(50),
+  odkPassword      char(50)
+);
+
 CREATE TABLE InterVA_Conf
 (
   version char(1) NOT NULL CHECK (version IN ('4', '5')),
@@ -81,7 +145,10 @@ INSERT INTO Advanced_InterVA_Conf
 CREATE TABLE InSilicoVA_Conf
 (
   data_type char(7) NOT NULL CHECK (data_type IN ('WHO2012', 'WHO2016')),
-  Nsim char(9)
+  Nsim char(9),
+  chains char(9) DEFAULT '1',
+  chains_rhat char(10) DEFAULT '1.05',
+  chains_rounds char(9) DEFAULT '2'
 );
 
 INSERT INTO InSilicoVA_Conf (data_type, Nsim) VALUES('WHO2016', '4000');
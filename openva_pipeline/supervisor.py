@@ -0,0 +1,236 @@
+"""
+openva_pipeline.supervisor
+--------------------------
+
+This module runs the R and SmartVA processes with limits on their run time,
+memory, and CPU use.
+"""
+
+import errno
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from typing import Sequence
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# sets the limits of the Python process that runs it and replaces it with
+# the command (so they apply before the command starts)
+_LIMIT_SCRIPT = """
+import os, resource, sys
+size, nice, cpus = sys.argv[1:4]
+if size:
+    resource.setrlimit(resource.RLIMIT_AS, (int(size), int(size)))
+if nice:
+    os.nice(int(nice))
+if cpus:
+    os.sched_setaffinity(0, [int(cpu) for cpu in cpus.split(",")])
+os.execv(sys.argv[4], sys.argv[5:])
+"""
+
+
+class MemoryLimitExceeded(subprocess.SubprocessError):
+    """A supervised process group used more memory than it was allowed.
+
+    :parameter cmd: Command of the process.
+    :parameter memory: Memory (in MB) used by the process group when it was
+     stopped.
+    :parameter limit: Memory limit (in MB).
+    """
+
+    def __init__(self, cmd, memory, limit, output=None, stderr=None):
+
+        self.cmd = cmd
+        self.memory = memory
+        self.limit = limit
+        self.output = output
+        self.stderr = stderr
+
+    def __str__(self):
+
+        return (f"Command '{self.cmd}' used {self.memory} MB of memory "
+                f"(limit: {self.limit} MB)")
+
+
+def run_supervised(args: Sequence[str],
+                   timeout: float = None,
+                   memory_limit: int = None,
+                   address_space_limit: int = None,
+                   nice: int = 0,
+                   cpus: Sequence[int] = None,
+                   check: bool = False,
+                   poll_interval: float = 1.0) -> subprocess.CompletedProcess:
+    """Run a command with limits (like subprocess.run).
+
+    The command runs in its own process group (on POSIX systems), so that
+    the processes it starts (e.g., the R processes of parallel InSilicoVA
+    chains) are covered by the limits and are stopped with it: the group is
+    sent SIGTERM, and SIGKILL if it is still running 10 seconds later.  The
+    address space limit (RLIMIT_AS), nice level, and CPU affinity are set
+    before the command starts (see :func:`limited_command`), and are
+    inherited by the processes it starts.
+
+    MemoryLimitExceeded is only raised if the process group was seen using
+    more than memory_limit; a command killed by the kernel (e.g., by the OOM
+    killer) is handled like any other non-zero exit status.
+
+    :parameter args: Command and its arguments.
+    :type args: list
+    :parameter timeout: Number of seconds the command may run (None for no
+     limit).
+    :type timeout: float
+    :parameter memory_limit: Largest resident memory (RSS, in MB) of the
+     process group, checked every poll_interval seconds (None for no limit;
+     needs /proc, i.e., Linux).
+    :type memory_limit: int
+    :parameter address_space_limit: Largest virtual memory (in MB) of each
+     process (None for no limit).  Note that the JVM used by InSilicoVA
+     reserves more address space than it uses.
+    :type address_space_limit: int
+    :parameter nice: Increment of the nice level of the command.
+    :type nice: int
+    :parameter cpus: CPUs the command may run on (None for all).
+    :type cpus: list of int
+    :parameter check: Indicator for raising CalledProcessError if the
+     command returns a non-zero exit status.
+    :type check: bool
+    :parameter poll_interval: Number of seconds between checks of the limits.
+    :type poll_interval: float
+    :returns: The exit status and output (stdout and stderr) of the command.
+    :rtype: subprocess.CompletedProcess
+    :raises: subprocess.TimeoutExpired, MemoryLimitExceeded,
+     subprocess.CalledProcessError, OSError
+    """
+
+    posix = os.name == "posix"
+    start = time.monotonic()
+    with subprocess.Popen(limited_command(args, address_space_limit, nice,
+                                          cpus),
+                          stdin=subprocess.PIPE,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE,
+                          start_new_session=posix) as process:
+        while True:
+            try:
+                # communicate() keeps the pipes from filling up (the output
+                # is returned by a later call after a timeout)
+                stdout, stderr = process.communicate(timeout=poll_interval)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            elapsed = time.monotonic() - start
+            if timeout is not None and elapsed > timeout:
+                stdout, stderr = _stop(process, posix)
+                raise subprocess.TimeoutExpired(args, timeout, stdout, stderr)
+            if memory_limit:
+                memory = group_memory(process.pid)
+                if memory is not None and memory > memory_limit:
+                    stdout, stderr = _stop(process, posix)
+                    raise MemoryLimitExceeded(args, memory, memory_limit,
+                                              stdout, stderr)
+        return_code = process.poll()
+    if check and return_code != 0:
+        raise subprocess.CalledProcessError(return_code, args, stdout, stderr)
+    return subprocess.CompletedProcess(args, return_code, stdout, stderr)
+
+
+def limited_command(args: Sequence[str],
+                    address_space_limit: int = None,
+                    nice: int = 0,
+                    cpus: Sequence[int] = None) -> list:
+    """Command that runs args with limits.
+
+    If limits are set, the command is run through a small Python script that
+    sets them on itself and then replaces itself with args (exec), so the
+    limits are in place before the command starts (unlike limits set from
+    the parent once it is running) and are inherited by every process it
+    starts.  Unlike a preexec_fn, this is safe when the parent has threads.
+    The limits are ignored on systems without the resource module.
+
+    :parameter args: Command and its arguments.
+    :type args: list
+    :parameter address_space_limit: Largest virtual memory (in MB) of each
+     process (None for no limit).
+    :type address_space_limit: int
+    :parameter nice: Increment of the nice level of the command.
+    :type nice: int
+    :parameter cpus: CPUs the command may run on (None for all; ignored
+     without os.sched_setaffinity).
+    :type cpus: list of int
+    :returns: Command and its arguments.
+    :rtype: list
+    :raises: FileNotFoundError
+    """
+
+    if resource is None:
+        return list(args)
+    size = str(address_space_limit * 1024 * 1024) \
+        if address_space_limit else ""
+    if not hasattr(os, "sched_setaffinity"):
+        cpus = None
+    cpu_list = ",".join(str(cpu) for cpu in cpus) if cpus else ""
+    if not size and not nice and not cpu_list:
+        return list(args)
+    # (a missing command raises the same error as with subprocess.Popen)
+    executable = shutil.which(args[0])
+    if executable is None:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                args[0])
+    return [sys.executable, "-c", _LIMIT_SCRIPT, size,
+            str(nice) if nice else "", cpu_list, executable] + list(args)
+
+
+def _stop(process: subprocess.Popen, posix: bool,
+          grace_period: float = 10) -> tuple:
+    """Stop the process group of a process (SIGTERM, then SIGKILL) and
+    return its remaining output."""
+
+    def send(sig):
+        try:
+            if posix:
+                os.killpg(process.pid, sig)
+            else:
+                process.kill()
+        except OSError:
+            pass
+
+    send(signal.SIGTERM)
+    try:
+        return process.communicate(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        send(signal.SIGKILL)
+        return process.communicate()
+
+
+def group_memory(pgid: int):
+    """Resident memory (RSS, in MB) of the processes in a process group.
+
+    :parameter pgid: Process group ID.
+    :type pgid: int
+    :returns: Memory in MB (None if /proc is not available).
+    :rtype: int
+    """
+
+    if not os.path.isdir("/proc"):
+        return None
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join("/proc", pid, "stat"), "rb") as f:
+                # the fields after the command name (in parentheses)
+                fields = f.read().rsplit(b")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[2]) == pgid:
+            total += int(fields[21]) * page_size
+    return total // (1024 * 1024)
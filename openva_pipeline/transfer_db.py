@@ -11,10 +11,12 @@ from shutil import rmtree
 from collections import namedtuple
 from datetime import datetime, timedelta
 import sqlite3
+import hashlib
+import math
 from pickle import dumps
 import json
 
-from pandas import read_csv, DataFrame
+from pandas import DataFrame
 from sqlcipher3 import dbapi2 as sqlcipher
 
 from .exceptions import PipelineConfigurationError
@@ -23,6 +25,7 @@ from .exceptions import DatabaseConnectionError
 from .exceptions import PipelineError
 from .exceptions import OpenVAConfigurationError
 from .exceptions import DHISConfigurationError
+from .va_data import read_va_csv, INTERCHANGE_FORMATS
 
 
 class TransferDB:
@@ -92,13 +95,32 @@ class TransferDB:
 
         This method queries the Pipeline_Conf table in Transfer database and
         returns a tuple with attributes (1) algorithmMetadataCode; (2)
-        codSource; (3) algorithm; and (4) working_directory.
+        codSource; (3) algorithm; (4) working_directory; (5)
+        pycrossva_shard_size; (6) pycrossva_workers; (7) openva_shards; (8)
+        openva_workers; (9) interchange_format; and (10)-(14) the limits of
+        the R and SmartVA processes.
 
         :returns: Arguments needed to configure the OpenVA Pipeline
           algorithmMetadataCode - attribute describing VA data
           codSource - attribute detailing the source of the Cause of Death list
           algorithm - attribute indicating which VA algorithm to use
           working_directory - attribute indicating the working directory
+          pycrossva_shard_size - number of records in each pycrossva shard
+          pycrossva_workers - number of processes running pycrossva
+          openva_shards - number of shards the records are split into for R
+          openva_workers - number of R processes running at the same time
+          interchange_format - format of the files passed between the
+          pipeline and R (csv or feather)
+          openva_timeout - seconds the R script or SmartVA may run (0 for no
+          limit)
+          openva_memory_limit - largest resident memory (MB) of the R or
+          SmartVA processes (0 for no limit)
+          openva_address_space_limit - largest virtual memory (MB) of each R
+          or SmartVA process (0 for no limit)
+          openva_nice - increment of the nice level of the R or SmartVA
+          processes
+          openva_cpus - CPUs the R or SmartVA processes may run on (empty
+          for all)
         :rtype: (named) tuple
         :raises: PipelineConfigurationError
         """
@@ -111,12 +133,28 @@ class TransferDB:
                 "workingDirectory FROM Pipeline_Conf;"
             )
             query_pipeline = c.execute(sql_pipeline).fetchall()
-            conn.close()
         except sqlcipher.OperationalError as e:
             conn.close()
             raise PipelineConfigurationError(
                 "Problem in database table Pipeline_Conf..." + str(e)
             )
+        parallel_fields = ["pycrossvaShardSize", "pycrossvaWorkers",
+                           "openvaShards", "openvaWorkers"]
+        limit_fields = ["openvaTimeout", "openvaMemoryLimit",
+                        "openvaAddressSpaceLimit", "openvaNice", "openvaCpus"]
+        optional_settings = self._optional_fields(
+            c, "Pipeline_Conf",
+            {"pycrossvaShardSize": 1000,
+             "pycrossvaWorkers": 1,
+             "openvaShards": 1,
+             "openvaWorkers": 1,
+             "interchangeFormat": "csv",
+             "openvaTimeout": 0,
+             "openvaMemoryLimit": 0,
+             "openvaAddressSpaceLimit": 0,
+             "openvaNice": 0,
+             "openvaCpus": ""})
+        conn.close()
         algorithm_metadata_code = query_pipeline[0][0]
         # if algorithm_metadata_code not in
         # [j for i in metadataQuery for j in i]:
@@ -138,17 +176,83 @@ class TransferDB:
                 "Problem in database: Pipeline_Conf.workingDirectory"
             )
 
+        parallel_settings = []
+        for field in parallel_fields:
+            try:
+                value = int(optional_settings[field])
+            except (TypeError, ValueError):
+                value = 0
+            if value < 1:
+                raise PipelineConfigurationError(
+                    "Problem in database: Pipeline_Conf." + field)
+            parallel_settings.append(value)
+        interchange_format = optional_settings["interchangeFormat"]
+        if interchange_format not in INTERCHANGE_FORMATS:
+            raise PipelineConfigurationError(
+                "Problem in database: Pipeline_Conf.interchangeFormat")
+        limit_settings = []
+        for field in limit_fields:
+            value = optional_settings[field]
+            try:
+                if field == "openvaCpus":
+                    value = tuple(int(cpu) for cpu in
+                                  str(value).replace(",", " ").split())
+                    valid = all(cpu >= 0 for cpu in value)
+                else:
+                    value = int(value)
+                    valid = value >= 0 and not (field == "openvaNice" and
+                                                value > 19)
+            except (TypeError, ValueError):
+                valid = False
+            if not valid:
+                raise PipelineConfigurationError(
+                    "Problem in database: Pipeline_Conf." + field)
+            limit_settings.append(value)
+
         nt_pipeline = namedtuple(
             "nt_pipeline",
             ["algorithm_metadata_code", "cod_source", "algorithm",
-             "working_directory"],
+             "working_directory", "pycrossva_shard_size",
+             "pycrossva_workers", "openva_shards", "openva_workers",
+             "interchange_format", "openva_timeout", "openva_memory_limit",
+             "openva_address_space_limit", "openva_nice", "openva_cpus"],
         )
         settings_pipeline = nt_pipeline(
-            algorithm_metadata_code, cod_source, algorithm, working_directory
+            algorithm_metadata_code, cod_source, algorithm, working_directory,
+            *parallel_settings, interchange_format, *limit_settings
         )
         self.working_directory = working_directory
         return settings_pipeline
 
+    @staticmethod
+    def _optional_fields(c: sqlcipher.Cursor, table: str,
+                         defaults: Dict) -> Dict:
+        """Read the columns of a configuration table that databases created
+        by older versions of the pipeline may not have.
+
+        :parameter c: Cursor of the Transfer database connection.
+        :type c: sqlcipher cursor
+        :parameter table: Name of the table (with one row).
+        :type table: str
+        :parameter defaults: Column names and the values used if a column
+         does not exist or is empty.
+        :type defaults: dict
+        :returns: Column names and values.
+        :rtype: dict
+        """
+
+        c.execute(f"PRAGMA table_info({table})")
+        columns = {i[1] for i in c.fetchall()}
+        fields = [field for field in defaults if field in columns]
+        row = None
+        if len(fields) > 0:
+            c.execute(f"SELECT {', '.join(fields)} FROM {table};")
+            row = c.fetchone()
+        values = dict(zip(fields, row)) if row is not None else {}
+        return {field: default if values.get(field) in (None, "")
+                else values[field]
+                for field, default in defaults.items()}
+
     def config_odk(self) -> NamedTuple:
         """Query ODK configuration settings from database.
 
@@ -239,6 +343,66 @@ class TransferDB:
 
         return settings_odk
 
+    def config_odk_sources(self) -> List:
+        """Query the ODK Central forms/projects listed in ODK_Sources.
+
+        Each row of the ODK_Sources table is an ODK Central form (odkFormID
+        in project odkProjectNumber) with its own odkLastRun.  The server and
+        credentials are taken from ODK_Conf, unless odkURL, odkUser, or
+        odkPassword are filled in for the source.  If ODK_Sources has rows,
+        the pipeline downloads these forms (instead of the form in ODK_Conf);
+        an empty (or missing) ODK_Sources table means the pipeline only uses
+        the form in ODK_Conf.
+
+        :returns: One set of ODK settings (the same named tuple as
+         :meth:`TransferDB.config_odk() <config_odk>`) for each source.
+        :rtype: list of (named) tuples
+        :raises: ODKConfigurationError
+        """
+
+        settings_odk = self.config_odk()
+        conn = self._connect_db()
+        c = conn.cursor()
+        sql_sources = (
+            "SELECT odkFormID, odkProjectNumber, odkLastRun, odkURL, "
+            "odkUser, odkPassword FROM ODK_Sources;"
+        )
+        try:
+            query_sources = c.execute(sql_sources).fetchall()
+            conn.close()
+        except sqlcipher.OperationalError:
+            conn.close()
+            return []
+        sources = []
+        for row in query_sources:
+            odk_last_run = row[2] or settings_odk.odk_last_run
+            try:
+                odk_last_run_date = datetime.strptime(
+                    odk_last_run, "%Y-%m-%d_%H:%M:%S"
+                ).strftime("%Y/%m/%d")
+            except ValueError:
+                raise ODKConfigurationError(
+                    "Problem in database: ODK_Sources.odkLastRun")
+            odk_last_run_date_prev = (
+                datetime.strptime(odk_last_run_date, "%Y/%m/%d")
+                - timedelta(days=1)
+            ).strftime("%Y/%m/%d")
+            odk_url = row[3] or settings_odk.odk_url
+            if not odk_url.startswith(("http://", "https://")):
+                raise ODKConfigurationError(
+                    "Problem in database: ODK_Sources.odkURL")
+            sources.append(settings_odk._replace(
+                odk_url=odk_url,
+                odk_user=row[4] or settings_odk.odk_user,
+                odk_password=row[5] or settings_odk.odk_password,
+                odk_form_id=row[0],
+                odk_last_run=odk_last_run,
+                odk_last_run_date=odk_last_run_date,
+                odk_last_run_date_prev=odk_last_run_date_prev,
+                odk_project_number=str(row[1]),
+            ))
+        return sources
+
     def update_odk_last_run(self) -> None:
         """Update Transfer Database table ODK_Conf.odk_last_run
 
@@ -252,6 +416,25 @@ class TransferDB:
         conn.commit()
         conn.close()
 
+    def update_odk_sources_last_run(self, sources: List) -> None:
+        """Update ODK_Sources.odkLastRun for the sources downloaded in this
+        run.
+
+        :parameter sources: ODK settings of the sources (as returned by
+         :meth:`TransferDB.config_odk_sources() <config_odk_sources>`)
+        :type sources: list of (named) tuples
+        """
+
+        conn = self._connect_db()
+        c = conn.cursor()
+        sql = ("UPDATE ODK_Sources SET odkLastRun = ? "
+               "WHERE odkFormID = ? AND odkProjectNumber = ?")
+        par = [(self.pl_run_date, i.odk_form_id, i.odk_project_number)
+               for i in sources]
+        c.executemany(sql, par)
+        conn.commit()
+        conn.close()
+
     def insert_event_log(self,
                          values: Tuple[str, str, str]) -> None:
         """Insert new row in Transfer Database table EventLog
@@ -398,17 +581,27 @@ class TransferDB:
         conn.close()
         return logs
 
-    def check_duplicates(self, use_dhis: bool) -> dict:
+    def check_duplicates(self, use_dhis: bool,
+                         return_data: bool = False) -> dict:
         """Search for duplicate VA records.
 
         This method searches for duplicate VA records in ODK export
         file and the Transfer DB.  If duplicates are found, a warning message
         is logged to the EventLog table in the Transfer database and the
-        duplicate records are removed from the ODK export file.
+        duplicate records are removed from the ODK export file.  If there is
+        no ODK export file, no records are counted.
 
         :parameter use_dhis: Indicator for posting records to DHIS2.  If True, then
          check VA_Org_Unit_Not_Found table for additional duplicate VA records.
         :type use_dhis: bool
+        :parameter return_data: Indicator for also returning the ODK export
+         (without the duplicate records) as a DataFrame, under the key
+         "va_data" (None if there is no ODK export file), so it does not need
+         to be read again by :meth:`OpenVA.prep_va_data()
+         <openva_pipeline.openva.OpenVA.prep_va_data>`.  The duplicate
+         records are then only removed from the DataFrame (the ODK export
+         file is not rewritten).
+        :type return_data: bool
         :raises: DatabaseConnectionError, PipelineError
         :return: Number of duplicates found and number of VA records sending to
          openVA.
@@ -423,18 +616,23 @@ class TransferDB:
         odk_export_path = os.path.join(
             self.working_directory, "ODKFiles", "odk_export_new.csv"
         )
-        df_odk = read_csv(odk_export_path)
+        if not os.path.isfile(odk_export_path):
+            # e.g., ODK.briefcase() skipped the export (no new records)
+            results.update({"n_records": 0, "n_unique": 0, "n_duplicates": 0})
+            if return_data:
+                results["va_data"] = None
+            return results
+        df_odk = read_va_csv(odk_export_path)
         df_odk_id = df_odk["meta-instanceID"]
         results["n_records"] = df_odk.shape[0]
         results["n_unique"] = df_odk.shape[0]
 
-        va_ids_list = self._get_va_storage_ids()
-        if use_dhis:
-            va_ids_no_org_unit = self._get_va_org_unit_not_found_ids()
-            va_ids_list.extend(va_ids_no_org_unit)
-        va_duplicates = set(df_odk_id).intersection(set(va_ids_list))
+        va_duplicates = self.find_stored_va_ids(df_odk_id.dropna().tolist(),
+                                                use_dhis)
         time_fmt = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
         results["n_duplicates"] = len(va_duplicates)
+        if return_data:
+            results["va_data"] = df_odk
 
         conn = self._connect_db()
         c = conn.cursor()
@@ -458,6 +656,10 @@ class TransferDB:
             df_no_duplicates = df_odk[
                 ~df_odk["meta-instanceID"].isin(list(va_duplicates))]
             results["n_unique"] = df_no_duplicates.shape[0]
+            if return_data:
+                results["va_data"] = df_no_duplicates
+                conn.close()
+                return results
             try:
                 df_no_duplicates.to_csv(odk_export_path, index=False)
                 conn.close()
@@ -469,6 +671,189 @@ class TransferDB:
                 ) from exc
         return results
 
+    def find_stored_va_ids(self, va_ids: List, use_dhis: bool) -> set:
+        """Find which of the given VA IDs are already in the Transfer database.
+
+        The IDs are first screened with the Bloom filter of stored IDs (see
+        :meth:`update_id_filter`), which rules out most new IDs without
+        reading the VA tables (the Transfer database is only read).  The
+        possible matches are loaded into a
+        temporary table and joined against the (indexed) id column of
+        VA_Storage -- and VA_Org_Unit_Not_Found, if use_dhis is True -- so
+        only the matching IDs are read from the database and the cost of the
+        lookup depends on the number of given IDs, not on the number of
+        stored records.
+
+        :parameter va_ids: VA IDs (e.g., the meta-instanceID column of the
+         ODK export).
+        :type va_ids: list
+        :parameter use_dhis: Indicator for posting records to DHIS2.  If True,
+         then the IDs in the VA_Org_Unit_Not_Found table are also checked.
+        :type use_dhis: bool
+        :returns: The VA IDs that are already stored.
+        :rtype: set
+        :raises: DatabaseConnectionError, PipelineError
+        """
+
+        if self.working_directory is None:
+            raise PipelineError("Need to run config_pipeline.")
+        tables = ["VA_Storage"]
+        if use_dhis:
+            tables.append("VA_Org_Unit_Not_Found")
+        conn = self._connect_db()
+        try:
+            c = conn.cursor()
+            id_filter = self._read_id_filter(c)
+            candidates = [str(i) for i in va_ids
+                          if id_filter is None or str(i) in id_filter]
+            if len(candidates) == 0:
+                return set()
+            c.execute("CREATE TEMP TABLE IF NOT EXISTS export_ids "
+                      "(id TEXT PRIMARY KEY)")
+            c.execute("DELETE FROM temp.export_ids")
+            c.executemany("INSERT OR IGNORE INTO temp.export_ids (id) "
+                          "VALUES (?)", ((i,) for i in candidates))
+            sql_exists = " OR ".join(
+                [f"EXISTS (SELECT 1 FROM {table} WHERE {table}.id = e.id)"
+                 for table in tables])
+            c.execute("SELECT e.id FROM temp.export_ids AS e WHERE " +
+                      sql_exists)
+            stored_ids = {i[0] for i in c.fetchall()}
+            c.execute("DROP TABLE temp.export_ids")
+        except (sqlcipher.DatabaseError, sqlcipher.OperationalError) as e:
+            raise DatabaseConnectionError(
+                "Problem checking for stored VA IDs..." + str(e))
+        finally:
+            conn.close()
+        return stored_ids
+
+    def _read_id_filter(self, c: sqlcipher.Cursor) -> "_IDFilter":
+        """Load the Bloom filter of stored VA IDs (without changing it).
+
+        The IDs stored since the filter was saved (kept in VA_ID_Filter_New
+        by the insert triggers of VA_Storage and VA_Org_Unit_Not_Found) are
+        added to the filter in memory.
+
+        :parameter c: Cursor of the Transfer database connection.
+        :type c: sqlcipher cursor
+        :returns: The filter, or None if there is no (usable) filter, in
+         which case every ID has to be looked up.
+        :rtype: _IDFilter
+        """
+
+        c.execute("SELECT type, name FROM SQLITE_MASTER "
+                  "WHERE type IN ('table', 'trigger')")
+        names = set(c.fetchall())
+        if not {("table", "VA_ID_Filter"), ("table", "VA_ID_Filter_New"),
+                ("trigger", "VA_Storage_id_filter"),
+                ("trigger", "VA_Org_Unit_Not_Found_id_filter")} <= names:
+            return None
+        c.execute("SELECT capacity, nItems, bits FROM VA_ID_Filter")
+        row = c.fetchone()
+        if row is None or None in row:
+            return None
+        try:
+            id_filter = _IDFilter(*row)
+        except ValueError:
+            return None
+        c.execute("SELECT id FROM VA_ID_Filter_New")
+        for (va_id,) in c:
+            id_filter.add(str(va_id))
+        return id_filter
+
+    def update_id_filter(self) -> None:
+        """Save the VA IDs stored since the last update in the Bloom filter
+        of stored VA IDs (see :meth:`_update_id_filter`).
+
+        :raises: DatabaseConnectionError
+        """
+
+        conn = self._connect_db()
+        try:
+            self._update_id_filter(conn.cursor())
+            conn.commit()
+        except (sqlcipher.DatabaseError, sqlcipher.OperationalError) as e:
+            raise DatabaseConnectionError(
+                "Problem updating the filter of stored VA IDs..." + str(e))
+        finally:
+            conn.close()
+
+    def _update_id_filter(self, c: sqlcipher.Cursor) -> None:
+        """Bring the Bloom filter of stored VA IDs up to date.
+
+        The filter is kept in the Transfer database table VA_ID_Filter.  The
+        insert triggers of VA_Storage and VA_Org_Unit_Not_Found add each new
+        ID to VA_ID_Filter_New, and this method moves them into the filter,
+        so the filter (which can be large) is written once per batch of
+        records rather than once per record.  It is called by
+        :meth:`store_va` (once per run) and by Pipeline.update_db().  The
+        filter is rebuilt from all the stored IDs if it is missing, if a
+        trigger is missing (e.g., the table was recreated), or if it holds
+        more IDs than it was sized for.  Records removed from the tables
+        stay in the filter, which only leads to extra (exact) lookups.  The
+        caller commits the changes.
+
+        :parameter c: Cursor of the Transfer database connection.
+        :type c: sqlcipher cursor
+        """
+
+        tables = ["VA_Storage", "VA_Org_Unit_Not_Found"]
+        self._index_va_ids(c, tables)
+        c.execute("CREATE TABLE IF NOT EXISTS VA_ID_Filter "
+                  "(capacity integer, nItems integer, bits blob)")
+        c.execute("CREATE TABLE IF NOT EXISTS VA_ID_Filter_New (id text)")
+        id_filter = self._read_id_filter(c)
+        c.execute("SELECT COUNT(*) FROM VA_ID_Filter_New")
+        if id_filter is not None and c.fetchone()[0] == 0:
+            return
+        if id_filter is not None and \
+                id_filter.n_items > id_filter.capacity:
+            id_filter = None
+        if id_filter is None:
+            for table in tables:
+                c.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_id_filter "
+                          f"AFTER INSERT ON {table} BEGIN "
+                          "INSERT INTO VA_ID_Filter_New (id) VALUES (NEW.id); "
+                          "END")
+            n_stored = 0
+            for table in tables:
+                c.execute(f"SELECT COUNT(*) FROM {table}")
+                n_stored += c.fetchone()[0]
+            id_filter = _IDFilter(max(2 * n_stored, _IDFilter.min_capacity))
+            for table in tables:
+                c.execute(f"SELECT id FROM {table}")
+                for (va_id,) in c:
+                    id_filter.add(str(va_id))
+        c.execute("DELETE FROM VA_ID_Filter_New")
+        c.execute("DELETE FROM VA_ID_Filter")
+        c.execute("INSERT INTO VA_ID_Filter (capacity, nItems, bits) "
+                  "VALUES (?, ?, ?)",
+                  (id_filter.capacity, id_filter.n_items,
+                   sqlite3.Binary(bytes(id_filter.bits))))
+
+    @staticmethod
+    def _index_va_ids(c: sqlcipher.Cursor, tables: List) -> None:
+        """Create the indexes on the id column of the VA tables (if needed).
+
+        The indexes only speed up the lookups of VA IDs: they are not unique,
+        so storing a record again behaves as it did without them.  (A unique
+        index created by an earlier version is replaced.)
+
+        :parameter c: Cursor of the Transfer database connection.
+        :type c: sqlcipher cursor
+        :parameter tables: Names of the tables with VA records.
+        :type tables: list
+        """
+
+        for table in tables:
+            c.execute("SELECT sql FROM SQLITE_MASTER WHERE type = 'index' "
+                      "AND name = ?", (f"{table}_id",))
+            index = c.fetchone()
+            if index is not None and "UNIQUE" in (index[0] or "").upper():
+                c.execute(f"DROP INDEX {table}_id")
+            c.execute(f"CREATE INDEX IF NOT EXISTS {table}_id "
+                      f"ON {table} (id)")
+
     def _get_va_storage_ids(self) -> List:
         """Get VA IDs from Transfer database table VA_Storage.
 
@@ -714,6 +1099,29 @@ class TransferDB:
             raise OpenVAConfigurationError(
                 "Problem in database: InSilicoVA_Conf.Nsim")
 
+        query_chains = self._optional_fields(
+            c, "InSilicoVA_Conf",
+            {"chains": "1", "chains_rhat": "1.05", "chains_rounds": "2"})
+        insilicova_chains, insilicova_chains_rhat, insilicova_chains_rounds = \
+            [str(i) for i in query_chains.values()]
+        for field, value in [("chains", insilicova_chains),
+                             ("chains_rounds", insilicova_chains_rounds)]:
+            if not value.isdigit() or int(value) < 1:
+                conn.close()
+                raise OpenVAConfigurationError(
+                    "Problem in database: InSilicoVA_Conf." + field +
+                    " (must be a positive integer).")
+        try:
+            float_chains_rhat = float(insilicova_chains_rhat)
+        except ValueError:
+            float_chains_rhat = 0
+        if float_chains_rhat <= 1:
+            conn.close()
+            raise OpenVAConfigurationError(
+                "Problem in database: InSilicoVA_Conf.chains_rhat "
+                "(must be greater than '1')."
+            )
+
         # Database Table: Advanced_InSilicoVA_Conf
         try:
             sql_advanced_insilicova = (
@@ -1043,6 +1451,9 @@ class TransferDB:
                 "insilicova_no_is_missing",
                 "insilicova_indiv_ci",
                 "insilicova_groupcode",
+                "insilicova_chains",
+                "insilicova_chains_rhat",
+                "insilicova_chains_rounds",
             ],
         )
         settings_insilicova = nt_insilicova(
@@ -1077,6 +1488,9 @@ class TransferDB:
             insilicova_no_is_missing,
             insilicova_indiv_ci,
             insilicova_groupcode,
+            insilicova_chains,
+            insilicova_chains_rhat,
+            insilicova_chains_rounds,
         )
         return settings_insilicova
 
@@ -1279,7 +1693,7 @@ class TransferDB:
         new_storage_path = os.path.join(
             self.working_directory, "OpenVAFiles", "new_storage.csv"
         )
-        df_new_storage = read_csv(new_storage_path)
+        df_new_storage = read_va_csv(new_storage_path)
         time_fmt = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
         try:
             for row_dict in df_new_storage.to_dict(orient="records"):
@@ -1315,6 +1729,7 @@ class TransferDB:
                 if dhis_tracker:
                     par.append(row_dict["tei_id"])
                 c.execute(sql_xfer_db, par)
+            self._update_id_filter(c)
             conn.commit()
             conn.close()
         except (sqlcipher.OperationalError, sqlcipher.IntegrityError) as e:
@@ -1489,6 +1904,200 @@ class TransferDB:
         conn.commit()
         conn.close()
 
+    def get_cod_cache(self, keys: List) -> Dict:
+        """Get the cached results for VA records that were already assigned
+        a cause of death.
+
+        The keys are created by :meth:`OpenVA.use_cod_cache()
+        <openva_pipeline.openva.OpenVA.use_cod_cache>` from the contents of
+        each record and the algorithm settings.  The keys are loaded into a
+        temporary table and joined against the COD_Cache table, so only the
+        matching results are read from the database.
+
+        :parameter keys: Keys of the VA records.
+        :type keys: list
+        :returns: The row of record_storage.csv (as JSON) for each cached
+         key.
+        :rtype: dict
+        :raises: DatabaseConnectionError
+        """
+
+        conn = self._connect_db()
+        try:
+            c = conn.cursor()
+            self._create_cod_cache(c)
+            c.execute("CREATE TEMP TABLE IF NOT EXISTS cod_keys "
+                      "(key TEXT PRIMARY KEY)")
+            c.execute("DELETE FROM temp.cod_keys")
+            c.executemany("INSERT OR IGNORE INTO temp.cod_keys (key) "
+                          "VALUES (?)", ((k,) for k in keys))
+            c.execute("SELECT COD_Cache.key, record FROM COD_Cache "
+                      "JOIN temp.cod_keys ON COD_Cache.key = cod_keys.key")
+            cached = dict(c.fetchall())
+            c.execute("DROP TABLE temp.cod_keys")
+            conn.commit()
+        except (sqlcipher.DatabaseError, sqlcipher.OperationalError) as e:
+            raise DatabaseConnectionError(
+                "Problem reading the COD_Cache table..." + str(e))
+        finally:
+            conn.close()
+        return cached
+
+    def store_cod_cache(self, entries: Dict) -> None:
+        """Store the results for VA records in the COD_Cache table.
+
+        Results for records that have since been stored in the VA_Storage
+        (or VA_Org_Unit_Not_Found) table are removed, since these records are
+        not sent to openVA again.
+
+        :parameter entries: The VA ID and the row of record_storage.csv (as
+         JSON) for each key (as returned by :meth:`OpenVA.merge_cod_cache()
+         <openva_pipeline.openva.OpenVA.merge_cod_cache>`).
+        :type entries: dict
+        :raises: DatabaseConnectionError
+        """
+
+        time_fmt = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        conn = self._connect_db()
+        try:
+            c = conn.cursor()
+            self._create_cod_cache(c)
+            c.executemany(
+                "INSERT OR REPLACE INTO COD_Cache "
+                "(key, id, record, dateEntered) "
+                "VALUES (?, ?, ?, ?)",
+                ((key, va_id, record, time_fmt)
+                 for key, (va_id, record) in entries.items()))
+            c.execute("SELECT name FROM SQLITE_MASTER WHERE type = 'table'")
+            table_names = [i[0] for i in c.fetchall()]
+            for table in ["VA_Storage", "VA_Org_Unit_Not_Found"]:
+                if table in table_names:
+                    c.execute("DELETE FROM COD_Cache WHERE EXISTS "
+                              f"(SELECT 1 FROM {table} "
+                              f"WHERE {table}.id = COD_Cache.id)")
+            conn.commit()
+        except (sqlcipher.DatabaseError, sqlcipher.OperationalError) as e:
+            raise DatabaseConnectionError(
+                "Problem storing results in the COD_Cache table..." + str(e))
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_cod_cache(c: sqlcipher.Cursor) -> None:
+        """Create the COD_Cache table (if needed).
+
+        :parameter c: Cursor of the Transfer database connection.
+        :type c: sqlcipher cursor
+        """
+
+        c.execute("CREATE TABLE IF NOT EXISTS COD_Cache "
+                  "(key char(64) PRIMARY KEY, id char(100) NOT NULL, "
+                  "record text, dateEntered date)")
+
+    def update_run_manifest(self,
+                            run_id: str,
+                            stage: str,
+                            status: str,
+                            input_hashes: Dict = None,
+                            output_hashes: Dict = None) -> None:
+        """Record the status of a pipeline stage in the Run_Manifest table.
+
+        :parameter run_id: ID of the pipeline run (the date and time when the
+         run started).
+        :type run_id: str
+        :parameter stage: Name of the stage (odk, openva, dhis, store, or
+         close).
+        :type stage: str
+        :parameter status: Status of the stage (started, completed, or
+         failed).
+        :type status: str
+        :parameter input_hashes: SHA-256 hash of each file read by the stage
+         (None for files that do not exist).
+        :type input_hashes: dict
+        :parameter output_hashes: SHA-256 hash of each file written by the
+         stage.
+        :type output_hashes: dict
+        :raises: DatabaseConnectionError
+        """
+
+        time_fmt = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        conn = self._connect_db()
+        try:
+            c = conn.cursor()
+            self._create_run_manifest(c)
+            c.execute("INSERT OR IGNORE INTO Run_Manifest "
+                      "(runID, stage, status) VALUES (?, ?, ?)",
+                      (run_id, stage, status))
+            c.execute("UPDATE Run_Manifest SET status = ?, dateEntered = ? "
+                      "WHERE runID = ? AND stage = ?",
+                      (status, time_fmt, run_id, stage))
+            for field, hashes in [("inputHashes", input_hashes),
+                                  ("outputHashes", output_hashes)]:
+                if hashes is not None:
+                    c.execute(f"UPDATE Run_Manifest SET {field} = ? "
+                              "WHERE runID = ? AND stage = ?",
+                              (json.dumps(hashes), run_id, stage))
+            conn.commit()
+        except (sqlcipher.DatabaseError, sqlcipher.OperationalError) as e:
+            raise DatabaseConnectionError(
+                "Problem updating the Run_Manifest table..." + str(e))
+        finally:
+            conn.close()
+
+    def get_run_manifest(self, run_id: str = None) -> Tuple:
+        """Get the status of the stages of a pipeline run.
+
+        :parameter run_id: ID of the pipeline run (the most recent run if
+         None).
+        :type run_id: str
+        :returns: The run ID (None if there are no runs in the manifest) and
+         a dictionary with the status, input hashes, output hashes, and date
+         of each recorded stage.
+        :rtype: tuple
+        :raises: DatabaseConnectionError
+        """
+
+        conn = self._connect_db()
+        try:
+            c = conn.cursor()
+            self._create_run_manifest(c)
+            if run_id is None:
+                c.execute("SELECT runID FROM Run_Manifest "
+                          "ORDER BY rowid DESC LIMIT 1")
+                row = c.fetchone()
+                run_id = None if row is None else row[0]
+            c.execute("SELECT stage, status, inputHashes, outputHashes, "
+                      "dateEntered FROM Run_Manifest WHERE runID = ?",
+                      (run_id,))
+            stages = {}
+            for stage, status, inputs, outputs, date in c.fetchall():
+                stages[stage] = {
+                    "status": status,
+                    "input_hashes": json.loads(inputs) if inputs else {},
+                    "output_hashes": json.loads(outputs) if outputs else {},
+                    "date": date}
+            conn.commit()
+        except (sqlcipher.DatabaseError, sqlcipher.OperationalError) as e:
+            raise DatabaseConnectionError(
+                "Problem reading the Run_Manifest table..." + str(e))
+        finally:
+            conn.close()
+        return run_id, stages
+
+    @staticmethod
+    def _create_run_manifest(c: sqlcipher.Cursor) -> None:
+        """Create the Run_Manifest table (if needed).
+
+        :parameter c: Cursor of the Transfer database connection.
+        :type c: sqlcipher cursor
+        """
+
+        c.execute("CREATE TABLE IF NOT EXISTS Run_Manifest "
+                  "(runID char(20) NOT NULL, stage char(10) NOT NULL, "
+                  "status char(10) NOT NULL, inputHashes text, "
+                  "outputHashes text, dateEntered date, "
+                  "PRIMARY KEY (runID, stage))")
+
     def make_pipeline_dirs(self) -> None:
         """Create directories for storing files (if they don't exist).
 
@@ -1547,27 +2156,21 @@ class TransferDB:
 
         if self.working_directory is None:
             raise PipelineError("Need to run config_pipeline.")
-        pcva_input_path = os.path.join(
-            self.working_directory, "OpenVAFiles", "pycrossva_input.csv"
-        )
-        openva_input_path = os.path.join(
-            self.working_directory, "OpenVAFiles", "openva_input.csv"
-        )
-        record_storage_path = os.path.join(
-            self.working_directory, "OpenVAFiles", "record_storage.csv"
-        )
+        dir_openva = os.path.join(self.working_directory, "OpenVAFiles")
+        # the files passed to R may be CSV or Feather files
+        # (Pipeline_Conf.interchangeFormat)
+        for name in ["pycrossva_input", "openva_input", "record_storage"]:
+            for extension in INTERCHANGE_FORMATS.values():
+                path = os.path.join(dir_openva, name + extension)
+                if os.path.isfile(path):
+                    os.remove(path)
         new_storage_path = os.path.join(
             self.working_directory, "OpenVAFiles", "new_storage.csv"
         )
+        # written by older versions of the pipeline
         eva_path = os.path.join(
             self.working_directory, "OpenVAFiles", "entity_attribute_value.csv"
         )
-        if os.path.isfile(pcva_input_path):
-            os.remove(pcva_input_path)
-        if os.path.isfile(openva_input_path):
-            os.remove(openva_input_path)
-        if os.path.isfile(record_storage_path):
-            os.remove(record_storage_path)
         if os.path.isfile(new_storage_path):
             os.remove(new_storage_path)
         if os.path.isfile(eva_path):
@@ -1579,3 +2182,49 @@ class TransferDB:
         if self.working_directory is None:
             raise PipelineError("Need to run config_pipeline.")
         rmtree(os.path.join(self.working_directory, "DHIS", "blobs"))
+
+
+class _IDFilter:
+    """Bloom filter of VA IDs (see :meth:`TransferDB._update_id_filter`).
+
+    :parameter capacity: Number of IDs the filter is sized for (with a false
+     positive rate of about error_rate).
+    :type capacity: int
+    :parameter n_items: Number of IDs already added to bits.
+    :type n_items: int
+    :parameter bits: Bit array of an existing filter.
+    :type bits: bytes
+    """
+
+    error_rate = 0.001
+    min_capacity = 10000
+
+    def __init__(self, capacity: int, n_items: int = 0, bits: bytes = None):
+
+        self.capacity = capacity
+        self.n_items = n_items
+        self.n_bits = math.ceil(-capacity * math.log(self.error_rate) /
+                                math.log(2) ** 2)
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        n_bytes = (self.n_bits + 7) // 8
+        if bits is None:
+            bits = bytes(n_bytes)
+        elif len(bits) != n_bytes:
+            raise ValueError("Bloom filter does not match its capacity.")
+        self.bits = bytearray(bits)
+
+    def _positions(self, va_id: str):
+
+        digest = hashlib.blake2b(va_id.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.n_bits for i in range(self.n_hashes))
+
+    def add(self, va_id: str) -> None:
+        for j in self._positions(va_id):
+            self.bits[j >> 3] |= 1 << (j & 7)
+        self.n_items += 1
+
+    def __contains__(self, va_id: str) -> bool:
+        return all(self.bits[j >> 3] & (1 << (j & 7))
+                   for j in self._positions(va_id))
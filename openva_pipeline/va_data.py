@@ -0,0 +1,341 @@
+"""
+openva_pipeline.va_data
+-----------------------
+
+This module loads the CSV (or Feather) files with VA records (ODK exports,
+openVA input, and the results files) with compact column types, and converts
+the results to the Entity-Attribute-Value format posted to DHIS2.
+"""
+
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+from pandas import read_csv, to_numeric, isna, DataFrame
+from pandas.api.types import (is_integer_dtype, is_bool_dtype,
+                              is_float_dtype, is_object_dtype,
+                              is_string_dtype)
+
+try:
+    import pyarrow
+    from pyarrow import csv as pa_csv
+    from pyarrow import feather
+except ImportError:
+    pyarrow = None
+    pa_csv = None
+    feather = None
+
+#: Formats of the files passed between the pipeline and R (set in
+#: Pipeline_Conf.interchangeFormat) and their file extensions.
+INTERCHANGE_FORMATS = {"csv": ".csv", "feather": ".feather"}
+
+#: Answers to the VA questions (WHO instrument and InterVA5 input format)
+#: that are stored as categories.
+VA_RESPONSES = {"yes", "no", "dk", "ref", "y", "n", "."}
+
+# columns of record_storage.csv (SmartVA) that are not part of the EVA blob
+_SMARTVA_STORAGE_ONLY = ["ID", "sex", "birth_date", "death_date", "age"]
+
+# values read as missing by pandas.read_csv (the pyarrow defaults differ)
+_NA_VALUES = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN",
+              "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN",
+              "None", "n/a", "nan", "null"]
+
+
+def read_va_csv(file_name: str, compact: bool = True) -> DataFrame:
+    """Read a CSV file with VA records.
+
+    The file is parsed with pyarrow when it is installed (falling back to
+    pandas' parser for files pyarrow cannot read consistently), keeping date
+    and time columns as text so they are written back unchanged.  With
+    compact=True the columns are then converted by :func:`compact_va_data`.
+
+    :parameter file_name: Path of the CSV file.
+    :type file_name: str
+    :parameter compact: Indicator for using compact column types.
+    :type compact: bool
+    :returns: VA records.
+    :rtype: pandas.DataFrame
+    """
+
+    df = None
+    if pa_csv is not None and os.path.isfile(file_name):
+        try:
+            df = _read_with_pyarrow(file_name)
+        except (pyarrow.ArrowException, OSError, UnicodeDecodeError,
+                ValueError):
+            df = None
+    if df is None:
+        df = read_csv(file_name)
+    if compact:
+        df = compact_va_data(df)
+    return df
+
+
+def interchange_extension(file_format: str) -> str:
+    """File extension of the openVA files in a format.
+
+    Feather (Arrow IPC) files need pyarrow, so CSV is used instead when it
+    is not installed.
+
+    :parameter file_format: Pipeline_Conf.interchangeFormat (csv or
+     feather).
+    :type file_format: str
+    :returns: .csv or .feather
+    :rtype: str
+    """
+
+    if file_format == "feather" and feather is None:
+        return ".csv"
+    return INTERCHANGE_FORMATS.get(file_format, ".csv")
+
+
+def find_va_file(directory: str, name: str) -> str:
+    """Path of an openVA file in either format.
+
+    :parameter directory: Folder with the file (e.g., OpenVAFiles).
+    :type directory: str
+    :parameter name: File name without the extension (e.g., record_storage).
+    :type name: str
+    :returns: Path of name.csv or name.feather (the newer one if both
+     exist, and name.csv if neither does).
+    :rtype: str
+    """
+
+    paths = [os.path.join(directory, name + extension)
+             for extension in INTERCHANGE_FORMATS.values()]
+    existing = [path for path in paths if os.path.isfile(path)]
+    if len(existing) == 0:
+        return paths[0]
+    return max(existing, key=os.path.getmtime)
+
+
+def read_va_file(file_name: str, compact: bool = True) -> DataFrame:
+    """Read a CSV or Feather file with VA records.
+
+    Files with the extension .feather are read with pyarrow, other files
+    with :func:`read_va_csv`.
+
+    :parameter file_name: Path of the file.
+    :type file_name: str
+    :parameter compact: Indicator for using compact column types.
+    :type compact: bool
+    :returns: VA records.
+    :rtype: pandas.DataFrame
+    :raises: ImportError if pyarrow is needed and not installed.
+    """
+
+    if not file_name.endswith(INTERCHANGE_FORMATS["feather"]):
+        return read_va_csv(file_name, compact=compact)
+    if feather is None:
+        raise ImportError("pyarrow is needed to read " + file_name)
+    df = feather.read_table(file_name).to_pandas()
+    if compact:
+        df = compact_va_data(df)
+    return df
+
+
+def write_va_file(df: DataFrame, file_name: str) -> None:
+    """Write VA records to a CSV or Feather file (by its extension).
+
+    The index is not written.  Text columns that also hold numbers (which
+    Arrow cannot store in one column) are written to Feather as text.
+
+    :parameter df: VA records.
+    :type df: pandas.DataFrame
+    :parameter file_name: Path of the file.
+    :type file_name: str
+    :raises: ImportError if pyarrow is needed and not installed.
+    """
+
+    if not file_name.endswith(INTERCHANGE_FORMATS["feather"]):
+        df.to_csv(file_name, index=False)
+        return
+    if feather is None:
+        raise ImportError("pyarrow is needed to write " + file_name)
+    df = df.reset_index(drop=True)
+    try:
+        feather.write_feather(df, file_name)
+    except (pyarrow.ArrowTypeError, pyarrow.ArrowInvalid):
+        text = {column: df[column].where(df[column].isna(),
+                                         df[column].astype(str))
+                for column in df.columns if is_object_dtype(df[column].dtype)}
+        feather.write_feather(df.assign(**text), file_name)
+
+
+def _read_with_pyarrow(file_name: str) -> DataFrame:
+    """Parse a CSV file with pyarrow (None for a file without records)."""
+
+    # types are inferred from the first block, so the date and time columns
+    # found there are read as strings (instead of timestamps), as are the
+    # decimal columns, which are then converted by pandas (pyarrow's
+    # conversion can differ in the last digit)
+    with pa_csv.open_csv(file_name) as reader:
+        text_columns = {field.name: pyarrow.string()
+                        for field in reader.schema
+                        if pyarrow.types.is_temporal(field.type) or
+                        pyarrow.types.is_floating(field.type)}
+        float_columns = [field.name for field in reader.schema
+                         if pyarrow.types.is_floating(field.type)]
+    convert_options = pa_csv.ConvertOptions(strings_can_be_null=True,
+                                            null_values=_NA_VALUES,
+                                            column_types=text_columns)
+    table = pa_csv.read_csv(file_name, convert_options=convert_options)
+    if table.num_rows == 0:
+        return None
+    # empty columns are float (NaN) columns for pandas' parser
+    for i, field in enumerate(table.schema):
+        if pyarrow.types.is_null(field.type):
+            table = table.set_column(
+                i, field.name, pyarrow.nulls(table.num_rows, pyarrow.float64()))
+    df = table.to_pandas()
+    for column in float_columns:
+        df[column] = to_numeric(df[column]).astype("float64")
+    return df
+
+
+def compact_va_data(df: DataFrame) -> DataFrame:
+    """Use compact column types for VA records.
+
+    Text columns that only contain answers such as yes, no, dk, and ref
+    (see VA_RESPONSES) become categorical, and integer columns use the
+    smallest integer type that holds their values.  The values (and the CSV
+    files written from them) are unchanged.
+
+    :parameter df: VA records.
+    :type df: pandas.DataFrame
+    :returns: VA records with compact column types.
+    :rtype: pandas.DataFrame
+    """
+
+    if df.columns.has_duplicates:
+        return df
+    new_types = {}
+    categorical = {}
+    for column in df.columns:
+        series = df[column]
+        if is_bool_dtype(series.dtype):
+            continue
+        if is_integer_dtype(series.dtype):
+            new_type = to_numeric(series, downcast="integer").dtype
+            if new_type != series.dtype:
+                new_types[column] = new_type
+        elif is_object_dtype(series.dtype) or is_string_dtype(series.dtype):
+            # the first values rule out most free-text columns cheaply
+            if not _is_response(series.dropna().head(50)):
+                continue
+            series = series.astype("category")
+            if len(series.cat.categories) > 0 and \
+                    _is_response(series.cat.categories):
+                categorical[column] = series
+    if new_types:
+        df = df.astype(new_types)
+    if categorical:
+        df = DataFrame({column: categorical.get(column, df[column])
+                        for column in df.columns}, index=df.index)
+    return df
+
+
+def _is_response(values) -> bool:
+
+    return all(isinstance(v, str) and v.strip().lower() in VA_RESPONSES
+               for v in values)
+
+
+def expand_va_data(df: DataFrame) -> DataFrame:
+    """Undo :func:`compact_va_data`.
+
+    The categorical columns are converted back to the type of their values
+    and the small integer columns to int64.  This is used before the records
+    are passed to code that may add new values to the columns or do
+    arithmetic with them (e.g., pycrossva).
+
+    :parameter df: VA records (e.g., from :func:`read_va_csv`).
+    :type df: pandas.DataFrame
+    :rtype: pandas.DataFrame
+    """
+
+    new_types = {column: df[column].cat.categories.dtype
+                 for column in _categorical_columns(df)}
+    new_types.update({column: "int64" for column in df.columns
+                      if is_integer_dtype(df[column].dtype) and
+                      df[column].dtype.name != "category" and
+                      df[column].dtype.itemsize < 8})
+    if new_types:
+        df = df.astype(new_types)
+    return df
+
+
+def _categorical_columns(df: DataFrame) -> List:
+
+    return [column for column in df.columns
+            if df[column].dtype.name == "category"]
+
+
+def eva_columns(columns: List[str]) -> List[Tuple[str, str]]:
+    """Match the attributes of the EVA blob to columns of record_storage.csv.
+
+    For openVA the attributes are the VA ID, the cause of death, the columns
+    of the ODK record (those after odkMetaInstanceID), and the algorithm
+    metadata code.  For SmartVA (record_storage.csv with a cause34 column),
+    they are all columns except the demographic ones, followed by the ID.
+
+    :parameter columns: Column names of record_storage.csv.
+    :type columns: list
+    :returns: (attribute, column) pairs in the order of the EVA blob.
+    :rtype: list
+    """
+
+    columns = list(columns)
+    if "cause34" in columns:
+        pairs = [(column, column) for column in columns
+                 if column not in _SMARTVA_STORAGE_ONLY]
+        return pairs + [("ID", "ID")]
+    raw_columns = []
+    if "odkMetaInstanceID" in columns:
+        raw_columns = columns[columns.index("odkMetaInstanceID") + 1:]
+    pairs = [("ID", "id"), ("Cause of Death", "cod")]
+    pairs.extend((column, column) for column in raw_columns if column != "ID")
+    pairs.append(("Metadata", "metadataCode"))
+    return pairs
+
+
+def record_storage_to_eva(record_storage: DataFrame) -> DataFrame:
+    """Convert VA records to Entity-Attribute-Value (EVA) format.
+
+    This creates the blob posted to DHIS2 for each record from the rows of
+    record_storage.csv (see :func:`eva_columns`), so only the records that
+    are posted are converted.  Missing values are empty strings (and a
+    missing SmartVA cause is MISSING); whole-number float columns are
+    written as integers.
+
+    :parameter record_storage: Rows of record_storage.csv (e.g., from
+     :func:`read_va_csv`).
+    :type record_storage: pandas.DataFrame
+    :returns: Columns ID, Attribute, and Value, with the attributes of each
+     record in consecutive rows.
+    :rtype: pandas.DataFrame
+    """
+
+    pairs = eva_columns(record_storage.columns)
+    n_records = record_storage.shape[0]
+    values = []
+    for attribute, column in pairs:
+        series = record_storage[column]
+        if is_float_dtype(series.dtype) and (series.dropna() % 1 == 0).all():
+            series = series.astype("Int64")
+        series = series.to_numpy(dtype=object)
+        missing = isna(series)
+        if missing.any():
+            series = series.copy()
+            series[missing] = "MISSING" if column == "cause34" else ""
+        values.append(series)
+    values = np.column_stack(values).ravel()
+    id_column = "ID" if "cause34" in record_storage.columns else "id"
+    va_ids = record_storage[id_column].astype(str).to_numpy(dtype=object)
+    return DataFrame({
+        "ID": np.repeat(va_ids, len(pairs)),
+        "Attribute": np.tile(np.array([a for a, _ in pairs], dtype=object),
+                             n_records),
+        "Value": values})
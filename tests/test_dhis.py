@@ -26,8 +26,6 @@ class CheckDHIS(unittest.TestCase):
     def setUpClass(cls):
 
         shutil.rmtree("DHIS/blobs/", ignore_errors=True)
-        shutil.copy("OpenVAFiles/sample_eav.csv",
-                    "OpenVAFiles/entity_attribute_value.csv")
         shutil.copy("OpenVAFiles/sample_record_storage.csv",
                     "OpenVAFiles/record_storage.csv")
         db_file_name = "Pipeline.db"
@@ -117,7 +115,6 @@ class CheckDHIS(unittest.TestCase):
     def tearDownClass(cls):
 
         shutil.rmtree("DHIS/blobs/", ignore_errors=True)
-        os.remove("OpenVAFiles/entity_attribute_value.csv")
         os.remove("OpenVAFiles/new_storage.csv")
         os.remove("Pipeline.db")
 
@@ -129,8 +126,6 @@ class CheckDHISTracker(unittest.TestCase):
     def setUpClass(cls):
 
         shutil.rmtree("DHIS/blobs/", ignore_errors=True)
-        shutil.copy("OpenVAFiles/sample_eav.csv",
-                    "OpenVAFiles/entity_attribute_value.csv")
         shutil.copy("OpenVAFiles/sample_record_storage.csv",
                     "OpenVAFiles/record_storage.csv")
         db_file_name = "Pipeline.db"
@@ -180,7 +175,6 @@ class CheckDHISTracker(unittest.TestCase):
     def tearDownClass(cls):
 
         shutil.rmtree("DHIS/blobs/", ignore_errors=True)
-        os.remove("OpenVAFiles/entity_attribute_value.csv")
         os.remove("OpenVAFiles/new_storage.csv")
         os.remove("Pipeline.db")
 
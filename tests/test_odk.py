@@ -5,15 +5,57 @@ import shutil
 import os
 import unittest
 import collections
+import csv
+import gzip
+import http.server
+import json
+import threading
+from urllib.parse import unquote_plus
 
 from sys import path
 source_path = os.path.dirname(os.path.abspath(__file__))
 path.append(source_path)
+path.append(os.path.join(source_path, '..', 'benchmarks'))
 # import context
+from central_stub import CentralStub
 
 os.chdir(os.path.abspath(os.path.dirname(__file__)))
 
 
+def central_settings(odk_url, **pipeline):
+    """Settings for downloading all of the records of an ODK Central server
+    (e.g., a local CentralStub), with working_directory '.' and any other
+    pipeline settings given as keyword arguments."""
+
+    nt_odk = collections.namedtuple('nt_odk',
+                                    ['odk_id',
+                                     'odk_url',
+                                     'odk_user',
+                                     'odk_password',
+                                     'odk_form_id',
+                                     'odk_last_run',
+                                     'odk_last_run_result',
+                                     'odk_last_run_date',
+                                     'odk_last_run_date_prev',
+                                     'odk_use_central',
+                                     'odk_project_number'])
+    settings_odk = nt_odk(None,
+                          odk_url,
+                          'user',
+                          'password',
+                          'va_who_v1_5_1',
+                          '1901-01-01_00:00:01',
+                          'fail',
+                          '1901/01/01',
+                          '1900/12/31',
+                          'True',
+                          '1')
+    pipeline = dict(pipeline, working_directory='.')
+    nt_pipeline = collections.namedtuple('nt_pipeline', list(pipeline))
+    return {"odk": settings_odk,
+            "pipeline": nt_pipeline(**pipeline)}
+
+
 class CompleteFreshRun(unittest.TestCase):
     """Check successful completion from blank slate."""
 
@@ -99,6 +141,319 @@ class CompleteFreshRun(unittest.TestCase):
             os.remove('ODKFiles/odk_export_prev.csv')
 
 
+class CompleteFreshRunStream(unittest.TestCase):
+    """Check that streaming download matches the default download."""
+
+    @classmethod
+    def setUpClass(cls):
+        if os.path.isfile('ODKFiles/odk_export_new.csv'):
+            os.remove('ODKFiles/odk_export_new.csv')
+        if os.path.isfile('ODKFiles/odk_export_prev.csv'):
+            os.remove('ODKFiles/odk_export_prev.csv')
+
+        cls.server = CentralStub(25).start()
+        pipeline_odk = odk.ODK(central_settings(cls.server.url))
+        pipeline_odk.central()
+        cls.n_records = pipeline_odk.n_records
+        with open('ODKFiles/odk_export_new.csv', newline='') as f:
+            cls.rows = list(csv.reader(f))
+        cls.odk_central_return = pipeline_odk.central(stream=True)
+        cls.n_records_stream = pipeline_odk.n_records
+        with open('ODKFiles/odk_export_new.csv', newline='') as f:
+            cls.rows_stream = list(csv.reader(f))
+
+    def test_odk_central_stream_return(self):
+        """Check successful run with stream=True."""
+
+        self.assertTrue("Downloaded" in self.odk_central_return)
+
+    def test_odk_central_stream_n_records(self):
+        """Check streaming download counts the same number of records."""
+
+        self.assertEqual(self.n_records, self.n_records_stream)
+        self.assertEqual(self.n_records_stream, 25)
+
+    def test_odk_central_stream_file(self):
+        """Check streaming download writes the same records to disk."""
+
+        self.assertEqual(self.rows, self.rows_stream)
+        self.assertFalse(os.path.isfile('ODKFiles/odk_export_new.csv.part'))
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.stop()
+        if os.path.isfile('ODKFiles/odk_export_new.csv'):
+            os.remove('ODKFiles/odk_export_new.csv')
+
+
+class CompleteFreshRunCompressed(unittest.TestCase):
+    """Check that zipped download matches the default download."""
+
+    @classmethod
+    def setUpClass(cls):
+        if os.path.isfile('ODKFiles/odk_export_new.csv'):
+            os.remove('ODKFiles/odk_export_new.csv')
+        if os.path.isfile('ODKFiles/odk_export_prev.csv'):
+            os.remove('ODKFiles/odk_export_prev.csv')
+
+        cls.server = CentralStub(25).start()
+        pipeline_odk = odk.ODK(central_settings(cls.server.url))
+        pipeline_odk.central()
+        cls.n_records = pipeline_odk.n_records
+        with open('ODKFiles/odk_export_new.csv', newline='') as f:
+            cls.rows = list(csv.reader(f))
+        cls.odk_central_return = pipeline_odk.central(compressed=True)
+        cls.n_records_compressed = pipeline_odk.n_records
+        with open('ODKFiles/odk_export_new.csv', newline='') as f:
+            cls.rows_compressed = list(csv.reader(f))
+
+    def test_odk_central_compressed_return(self):
+        """Check successful run with compressed=True."""
+
+        self.assertTrue("Downloaded" in self.odk_central_return)
+
+    def test_odk_central_compressed_n_records(self):
+        """Check zipped download counts the same number of records."""
+
+        self.assertEqual(self.n_records, self.n_records_compressed)
+        self.assertEqual(self.n_records_compressed, 25)
+
+    def test_odk_central_compressed_file(self):
+        """Check zipped download writes the same records to disk."""
+
+        self.assertEqual(self.rows, self.rows_compressed)
+        self.assertFalse(os.path.isfile('ODKFiles/odk_export_new.csv.part'))
+        self.assertFalse(os.path.isfile('ODKFiles/odk_export_new.csv.zip'))
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.stop()
+        if os.path.isfile('ODKFiles/odk_export_new.csv'):
+            os.remove('ODKFiles/odk_export_new.csv')
+
+
+class CompleteFreshRunOData(unittest.TestCase):
+    """Check that the OData download matches the default download."""
+
+    @classmethod
+    def setUpClass(cls):
+        if os.path.isfile('ODKFiles/odk_export_new.csv'):
+            os.remove('ODKFiles/odk_export_new.csv')
+        if os.path.isfile('ODKFiles/odk_export_prev.csv'):
+            os.remove('ODKFiles/odk_export_prev.csv')
+
+        cls.server = CentralStub(25).start()
+        pipeline_odk = odk.ODK(central_settings(cls.server.url))
+        pipeline_odk.central()
+        cls.n_records = pipeline_odk.n_records
+        with open('ODKFiles/odk_export_new.csv', newline='') as f:
+            cls.rows = list(csv.reader(f))
+        cls.odk_central_return = pipeline_odk.central_odata(page_size=5)
+        cls.n_records_odata = pipeline_odk.n_records
+        with open('ODKFiles/odk_export_new.csv', newline='') as f:
+            cls.rows_odata = list(csv.reader(f))
+
+    def test_odk_central_odata_return(self):
+        """Check successful run with central_odata()."""
+
+        self.assertTrue("Downloaded" in self.odk_central_return)
+
+    def test_odk_central_odata_n_records(self):
+        """Check OData download gets the same number of records."""
+
+        self.assertEqual(self.n_records, self.n_records_odata)
+        self.assertEqual(self.n_records_odata, 25)
+
+    def test_odk_central_odata_keys(self):
+        """Check OData download writes the same VA records (instance ID)."""
+
+        key = self.rows[0].index('meta-instanceID')
+        key_odata = self.rows_odata[0].index('meta-instanceID')
+        self.assertEqual(sorted(i[key] for i in self.rows[1:]),
+                         sorted(i[key_odata] for i in self.rows_odata[1:]))
+        self.assertTrue('KEY' in self.rows_odata[0])
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.stop()
+        if os.path.isfile('ODKFiles/odk_export_new.csv'):
+            os.remove('ODKFiles/odk_export_new.csv')
+
+
+class CompleteFreshRunMissing(unittest.TestCase):
+    """Check that only records missing from the Transfer DB are downloaded."""
+
+    @classmethod
+    def setUpClass(cls):
+        if os.path.isfile('ODKFiles/odk_export_new.csv'):
+            os.remove('ODKFiles/odk_export_new.csv')
+        if os.path.isfile('ODKFiles/odk_export_prev.csv'):
+            os.remove('ODKFiles/odk_export_prev.csv')
+
+        cls.server = CentralStub(25).start()
+        pipeline_odk = odk.ODK(central_settings(cls.server.url))
+        pipeline_odk.central()
+        cls.n_records = pipeline_odk.n_records
+        with open('ODKFiles/odk_export_new.csv', newline='') as f:
+            cls.rows = list(csv.reader(f))
+        key = cls.rows[0].index('meta-instanceID')
+        cls.stored_ids = [i[key] for i in cls.rows[1:4]]
+        cls.server.requests.clear()
+        cls.odk_central_return = pipeline_odk.central_missing(
+            cls.stored_ids, page_size=10, batch_size=5)
+        cls.requests = [unquote_plus(i) for i in cls.server.requests]
+        cls.n_records_missing = pipeline_odk.n_records
+        with open('ODKFiles/odk_export_new.csv', newline='') as f:
+            cls.rows_missing = list(csv.reader(f))
+
+    def test_odk_central_missing_return(self):
+        """Check successful run with central_missing()."""
+
+        self.assertTrue("Downloaded" in self.odk_central_return)
+
+    def test_odk_central_missing_n_records(self):
+        """Check stored records are not downloaded."""
+
+        self.assertEqual(self.n_records - len(self.stored_ids),
+                         self.n_records_missing)
+
+    def test_odk_central_missing_ids(self):
+        """Check export does not include the stored records."""
+
+        key = self.rows_missing[0].index('meta-instanceID')
+        ids = [i[key] for i in self.rows_missing[1:]]
+        self.assertFalse(set(ids).intersection(self.stored_ids))
+
+    def test_odk_central_missing_requests(self):
+        """Check only the IDs are listed and the missing records fetched."""
+
+        id_pages = [i for i in self.requests if '$select=__id&' in i or
+                    i.endswith('$select=__id')]
+        batches = [i for i in self.requests if '__id eq' in i]
+        self.assertEqual(len(id_pages), 3)
+        self.assertEqual(len(batches), 5)
+        self.assertEqual(len(self.requests), 8)
+        self.assertFalse(any(i in batch for i in self.stored_ids
+                             for batch in batches))
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.stop()
+        if os.path.isfile('ODKFiles/odk_export_new.csv'):
+            os.remove('ODKFiles/odk_export_new.csv')
+
+
+class SelectColumns(unittest.TestCase):
+    """Check that only the needed columns are downloaded from ODK Central."""
+
+    @classmethod
+    def setUpClass(cls):
+        if os.path.isfile('ODKFiles/odk_export_new.csv'):
+            os.remove('ODKFiles/odk_export_new.csv')
+
+        cls.server = CentralStub(25).start()
+        cls.settings = central_settings(
+            cls.server.url,
+            algorithm_metadata_code=("InterVA5|5|InterVA|5|"
+                                     "2016 WHO Verbal Autopsy Form|v1_5_1"),
+            cod_source="WHO",
+            algorithm="InterVA")
+        pipeline_odk = odk.ODK(cls.settings)
+        cls.columns = pipeline_odk.select_columns()
+        cls.odk_central_return = pipeline_odk.central(select_columns=True)
+        with open('ODKFiles/odk_export_new.csv', newline='') as f:
+            cls.header = next(csv.reader(f))
+
+    def test_select_columns_list(self):
+        """Check select_columns() returns field paths."""
+
+        self.assertTrue(isinstance(self.columns, list))
+        self.assertTrue('meta/instanceID' in self.columns)
+
+    def test_select_columns_export(self):
+        """Check export only has the selected columns."""
+
+        self.assertTrue("Downloaded" in self.odk_central_return)
+        self.assertTrue('meta-instanceID' in self.header)
+        self.assertTrue('KEY' in self.header)
+        self.assertEqual(len(self.header),
+                         len(set(self.header)))
+        self.assertTrue(len(self.header) < len(self.columns) + 20)
+
+    def test_select_columns_csv_options(self):
+        """Check select_columns cannot be combined with the CSV options."""
+
+        pipeline_odk = odk.ODK(self.settings)
+        for option in [{"stream": True}, {"compressed": True},
+                       {"retries": 2}]:
+            with self.assertRaises(odk.ODKError):
+                pipeline_odk.central(select_columns=True, **option)
+
+    def test_select_columns_smartva(self):
+        """Check all columns are kept for SmartVA."""
+
+        settings = dict(self.settings)
+        settings["pipeline"] = self.settings["pipeline"]._replace(
+            algorithm="SmartVA")
+        self.assertIsNone(odk.ODK(settings).select_columns())
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.stop()
+        if os.path.isfile('ODKFiles/odk_export_new.csv'):
+            os.remove('ODKFiles/odk_export_new.csv')
+
+
+class FlattenODataSubmission(unittest.TestCase):
+    """Check conversion of OData submissions to CSV export columns."""
+
+    def setUp(self):
+
+        self.row = odk.ODK._flatten_submission({
+            '__id': 'uuid:123',
+            'Id10007': 'name',
+            'age': {'ageInYears': 42, 'ageInDays': None},
+            'gps': {'type': 'Point',
+                    'coordinates': [8.5, 47.5, 400],
+                    'properties': {'accuracy': 5}},
+            'meta': {'instanceID': 'uuid:123'},
+            'rep@odata.navigationLink': "Submissions('uuid:123')/rep",
+            '__system': {'submissionDate': '2021-01-01T00:00:00.000Z',
+                         'reviewState': None,
+                         'updatedAt': None}
+        })
+
+    def test_flatten_groups(self):
+        """Check group names are joined to field names with '-'."""
+
+        self.assertEqual(self.row['age-ageInYears'], '42')
+        self.assertEqual(self.row['age-ageInDays'], '')
+        self.assertEqual(self.row['meta-instanceID'], 'uuid:123')
+
+    def test_flatten_system(self):
+        """Check system fields use the CSV export names."""
+
+        self.assertEqual(self.row['KEY'], 'uuid:123')
+        self.assertEqual(self.row['SubmissionDate'],
+                         '2021-01-01T00:00:00.000Z')
+        self.assertEqual(self.row['ReviewState'], '')
+        self.assertFalse('updatedAt' in self.row)
+        self.assertFalse(any('odata' in i for i in self.row))
+
+    def test_flatten_geopoint(self):
+        """Check geopoints are split into separate columns."""
+
+        self.assertEqual(self.row['gps-Latitude'], '47.5')
+        self.assertEqual(self.row['gps-Longitude'], '8.5')
+        self.assertEqual(self.row['gps-Altitude'], '400')
+        self.assertEqual(self.row['gps-Accuracy'], '5')
+
+
 class ProperMergeWithExistingExports(unittest.TestCase):
     """Check that unique VA records get preserved with new & exports."""
 
@@ -199,6 +554,310 @@ class ProperMergeWithExistingExports(unittest.TestCase):
             os.remove('ODKFiles/odk_export_prev.csv')
 
 
+class MergeExportsByInstanceID(unittest.TestCase):
+    """Check that merged exports are matched on the instance ID."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        settings = central_settings('http://127.0.0.1')
+
+        with open('ODKFiles/odk_export_prev.csv', 'w', newline='') as f:
+            f.write('Id10007,meta-instanceID\n')
+            f.write('"first\nline",uuid:1\n')
+            f.write('second,uuid:2\n')
+        with open('ODKFiles/odk_export_new.csv', 'w', newline='') as f:
+            f.write('meta-instanceID,Id10007,Id10010\n')
+            f.write('uuid:2,second,x\n')
+            f.write('uuid:3,third,y\n')
+        odk.ODK(settings).merge_to_prev_export()
+        with open('ODKFiles/odk_export_prev.csv', newline='') as f:
+            cls.rows = list(csv.reader(f))
+
+    def test_merge_union_header(self):
+        """Check the merged export has the columns from both exports."""
+
+        self.assertEqual(self.rows[0],
+                         ['Id10007', 'meta-instanceID', 'Id10010'])
+
+    def test_merge_unique_ids(self):
+        """Check each instance ID is kept once (multi-line field intact)."""
+
+        self.assertEqual([i[1] for i in self.rows[1:]],
+                         ['uuid:1', 'uuid:2', 'uuid:3'])
+        self.assertEqual(self.rows[1][0], 'first\nline')
+        self.assertEqual(self.rows[3], ['third', 'uuid:3', 'y'])
+
+    def test_merge_removes_new_export(self):
+        """Check odk_export_new.csv is removed after the merge."""
+
+        self.assertFalse(os.path.isfile('ODKFiles/odk_export_new.csv'))
+
+    @classmethod
+    def tearDownClass(cls):
+
+        if os.path.isfile('ODKFiles/odk_export_prev.csv'):
+            os.remove('ODKFiles/odk_export_prev.csv')
+
+
+class CombineExports(unittest.TestCase):
+    """Check that the exports of several forms are combined by column."""
+
+    def setUp(self):
+
+        self.pipeline_odk = odk.ODK(central_settings('http://127.0.0.1'))
+        self.files = ['ODKFiles/form_a.csv', 'ODKFiles/form_b.csv']
+        with open(self.files[0], 'w', newline='') as f:
+            f.write('meta-instanceID,group1-Id10007,group1-age\n')
+            f.write('uuid:1,first,30\n')
+            f.write('uuid:2,second,40\n')
+
+    def test_combine_full_names(self):
+        """Check columns are matched on their full names."""
+
+        with open(self.files[1], 'w', newline='') as f:
+            f.write('group1-age,meta-instanceID,Id10010\n')
+            f.write('50,uuid:2,x\n')
+            f.write('60,uuid:3,y\n')
+        n_records = self.pipeline_odk._combine_exports(
+            self.files, 'ODKFiles/odk_export_new.csv')
+        with open('ODKFiles/odk_export_new.csv', newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(n_records, 3)
+        self.assertEqual(rows[0], ['meta-instanceID', 'group1-Id10007',
+                                   'group1-age', 'Id10010'])
+        self.assertEqual(rows[3], ['uuid:3', '', '60', 'y'])
+
+    def test_combine_same_last_part(self):
+        """Check different columns ending in the same name are not merged."""
+
+        with open(self.files[1], 'w', newline='') as f:
+            f.write('meta-instanceID,group2-age\n')
+            f.write('uuid:3,50\n')
+        with self.assertRaises(odk.ODKError):
+            self.pipeline_odk._combine_exports(
+                self.files, 'ODKFiles/odk_export_new.csv')
+        self.assertFalse(os.path.isfile('ODKFiles/odk_export_new.csv'))
+
+    def tearDown(self):
+
+        for file_name in self.files + ['ODKFiles/odk_export_new.csv']:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+
+class CheckDownloadValidation(unittest.TestCase):
+    """Check partial downloads are validated before they are used."""
+
+    def setUp(self):
+
+        with open('ODKFiles/download.csv.part', 'wb') as f:
+            f.write(b'a,b\n1,2\n3,4')
+        with open('ODKFiles/download.zip.part', 'wb') as f:
+            f.write(b'a,b\n')
+
+    def test_check_download_size(self):
+        """Check the size must match the size announced by the server."""
+
+        self.assertTrue(
+            odk.ODK._check_download('ODKFiles/download.csv.part', '11'))
+        self.assertTrue(
+            odk.ODK._check_download('ODKFiles/download.csv.part', None))
+        self.assertIsInstance(
+            odk.ODK._check_download('ODKFiles/download.csv.part', '20'),
+            odk.ODKError)
+        self.assertTrue(os.path.isfile('ODKFiles/download.csv.part'))
+
+    def test_check_download_zip(self):
+        """Check an invalid zip file is rejected and removed."""
+
+        self.assertIsInstance(
+            odk.ODK._check_download('ODKFiles/download.zip.part', None),
+            odk.ODKError)
+        self.assertFalse(os.path.isfile('ODKFiles/download.zip.part'))
+
+    def tearDown(self):
+
+        for i in ['ODKFiles/download.csv.part', 'ODKFiles/download.zip.part']:
+            if os.path.isfile(i):
+                os.remove(i)
+
+
+class ResumeDownload(unittest.TestCase):
+    """Check an interrupted download is resumed without content encoding."""
+
+    body = b''.join(b'uuid:%d,%d\n' % (i, i) for i in range(2000)) + b'end'
+
+    @classmethod
+    def setUpClass(cls):
+
+        body = cls.body
+        cls.requests = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                ResumeDownload.requests.append(dict(self.headers))
+                data = body
+                encoding = None
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    data = gzip.compress(body)
+                    encoding = 'gzip'
+                start = 0
+                if self.headers.get('Range') and \
+                        self.headers.get('If-Range') == '"v1"':
+                    start = int(self.headers['Range'][6:-1])
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes {0}-{1}/{2}'
+                                     .format(start, len(data) - 1, len(data)))
+                else:
+                    self.send_response(200)
+                if encoding:
+                    self.send_header('Content-Encoding', encoding)
+                self.send_header('Content-Length', str(len(data) - start))
+                self.send_header('ETag', '"v1"')
+                self.end_headers()
+                self.wfile.write(data[start:])
+
+            def log_message(self, *args):
+                pass
+
+        cls.server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = 'http://127.0.0.1:{0}/submissions.csv'.format(
+            cls.server.server_port)
+        nt_odk = collections.namedtuple('nt_odk',
+                                        ['odk_id',
+                                         'odk_url',
+                                         'odk_user',
+                                         'odk_password',
+                                         'odk_form_id',
+                                         'odk_last_run',
+                                         'odk_last_run_result',
+                                         'odk_last_run_date',
+                                         'odk_last_run_date_prev',
+                                         'odk_use_central',
+                                         'odk_project_number'])
+        settings_odk = nt_odk(None, cls.url, 'user', 'password',
+                              'va_who_v1_5_3', '1901-01-01_00:00:01', 'fail',
+                              '1901/01/01', '1900/12/31', 'True', '40')
+        nt_pipeline = collections.namedtuple(
+            "nt_pipeline",
+            ["working_directory"]
+        )
+        cls.odk = odk.ODK({"odk": settings_odk,
+                           "pipeline": nt_pipeline(".")})
+        cls.file_name = 'ODKFiles/download.csv'
+
+    def setUp(self):
+
+        self.requests.clear()
+
+    def test_full_download(self):
+        """Check the number of lines of a (gzip encoded) download."""
+
+        n_lines = self.odk._download(self.url, self.file_name)
+        self.assertEqual(n_lines, 2001)
+        with open(self.file_name, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+
+    def test_resume(self):
+        """Check the rest of the unencoded file is appended."""
+
+        with open(self.file_name + '.part', 'wb') as f:
+            f.write(self.body[:5000])
+        with open(self.file_name + '.part.json', 'w') as f:
+            json.dump({'url': self.url, 'validator': '"v1"'}, f)
+        n_lines = self.odk._download(self.url, self.file_name)
+        self.assertEqual(self.requests[0]['Accept-Encoding'], 'identity')
+        self.assertEqual(n_lines, 2001)
+        with open(self.file_name, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+
+    def tearDown(self):
+
+        for i in [self.file_name, self.file_name + '.part',
+                  self.file_name + '.part.json']:
+            if os.path.isfile(i):
+                os.remove(i)
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class BriefcaseStorageManifest(unittest.TestCase):
+    """Check changes in the ODK Briefcase storage directory are detected."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        nt_odk = collections.namedtuple('nt_odk',
+                                        ['odk_id',
+                                         'odk_url',
+                                         'odk_user',
+                                         'odk_password',
+                                         'odk_form_id',
+                                         'odk_last_run',
+                                         'odk_last_run_result',
+                                         'odk_last_run_date',
+                                         'odk_last_run_date_prev',
+                                         'odk_use_central',
+                                         'odk_project_number'])
+        settings_odk = nt_odk(None,
+                              'https://odk.aggregate.server',
+                              'user',
+                              'password',
+                              'va_who_v1_5_3',
+                              '1901-01-01_00:00:01',
+                              'fail',
+                              '1901/01/01',
+                              '1900/12/31',
+                              'False',
+                              None)
+        nt_pipeline = collections.namedtuple(
+            "nt_pipeline",
+            ["working_directory"]
+        )
+        settings = {"odk": settings_odk,
+                    "pipeline": nt_pipeline(".")}
+        cls.pipeline_odk = odk.ODK(settings)
+        cls.instances = os.path.join('ODKFiles', 'ODK Briefcase Storage',
+                                     'forms', 'VA', 'instances')
+        for i in ['uuid1', 'uuid2']:
+            os.makedirs(os.path.join(cls.instances, i))
+            with open(os.path.join(cls.instances, i, 'submission.xml'),
+                      'w') as f:
+                f.write('<data id="' + i + '"></data>')
+
+    def test_manifest_unchanged(self):
+        """Check the manifest is the same if the storage is unchanged."""
+
+        manifest = self.pipeline_odk._storage_manifest()
+        self.assertEqual(manifest['n_instances'], 2)
+        self.assertEqual(manifest, self.pipeline_odk._storage_manifest())
+
+    def test_manifest_new_submission(self):
+        """Check the manifest changes when a submission is added."""
+
+        manifest = self.pipeline_odk._storage_manifest()
+        os.makedirs(os.path.join(self.instances, 'uuid3'))
+        with open(os.path.join(self.instances, 'uuid3', 'submission.xml'),
+                  'w') as f:
+            f.write('<data id="uuid3"></data>')
+        new_manifest = self.pipeline_odk._storage_manifest()
+        shutil.rmtree(os.path.join(self.instances, 'uuid3'))
+        self.assertNotEqual(manifest['digest'], new_manifest['digest'])
+        self.assertEqual(new_manifest['n_instances'], 3)
+
+    @classmethod
+    def tearDownClass(cls):
+
+        shutil.rmtree('ODKFiles/ODK Briefcase Storage', ignore_errors=True)
+
+
 class InvalidConnection(unittest.TestCase):
     """Check that proper exceptions are raised."""
 
@@ -1,17 +1,30 @@
 from openva_pipeline.transfer_db import TransferDB
 from openva_pipeline.pipeline import Pipeline
 from openva_pipeline.openva import OpenVA
+from openva_pipeline.openva import parse_progress
+from openva_pipeline.openva import progress_message
+from openva_pipeline import openva
 from openva_pipeline.run_pipeline import download_smartva
 from openva_pipeline.run_pipeline import create_transfer_db
 from openva_pipeline.exceptions import OpenVAError
 from openva_pipeline.exceptions import SmartVAError
+from openva_pipeline.exceptions import SmartVATimeoutError
+from openva_pipeline.exceptions import SmartVAMemoryError
+from openva_pipeline.va_data import read_va_csv
+from openva_pipeline.va_data import record_storage_to_eva
+from openva_pipeline.va_data import read_va_file
+from openva_pipeline.va_data import write_va_file
+from openva_pipeline.va_data import feather
 import unittest
 import os
 import shutil
 import collections
+import time
 from datetime import datetime
+import sys
 from sys import path, platform
 from pandas import read_csv
+from pandas import DataFrame
 
 source_path = os.path.dirname(os.path.abspath(__file__))
 path.append(source_path)
@@ -110,6 +123,717 @@ class CheckCopyVA(unittest.TestCase):
         )
 
 
+class CheckPrepVADataInMemory(unittest.TestCase):
+    """prep_va_data() gives the same results with the export as DataFrame."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        if os.path.isfile("ODKFiles/odk_export_prev.csv"):
+            os.remove("ODKFiles/odk_export_prev.csv")
+        shutil.copy("ODKFiles/another_export.csv",
+                    "ODKFiles/odk_export_new.csv")
+        if not os.path.isfile("Pipeline.db"):
+            create_transfer_db("Pipeline.db", ".", "enilepiP")
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        cls.static_run_date = datetime(
+            2018, 9, 1, 9, 0, 0).strftime("%Y_%m_%d_%H:%M:%S")
+        r_openva = OpenVA(pl.settings, cls.static_run_date)
+        cls.summary_file = r_openva.prep_va_data()
+        cls.openva_input_file = read_csv("OpenVAFiles/openva_input.csv")
+        os.remove("OpenVAFiles/openva_input.csv")
+        va_data = read_csv("ODKFiles/odk_export_new.csv")
+        cls.summary_memory = r_openva.prep_va_data(va_data=va_data)
+        cls.openva_input_memory = read_csv("OpenVAFiles/openva_input.csv")
+
+    def test_summary(self):
+        """Check that the summaries match."""
+
+        self.assertEqual(self.summary_file, self.summary_memory)
+
+    def test_openva_input(self):
+        """Check that the openVA input files match."""
+
+        self.assertTrue(self.openva_input_file.equals(
+            self.openva_input_memory))
+
+    def test_smartva(self):
+        """Check that only openva_input.csv is written for SmartVA."""
+
+        xfer_db = TransferDB(db_file_name="Pipeline.db",
+                             db_directory=".",
+                             db_key="enilepiP",
+                             pl_run_date=True)
+        xfer_db.update_table(
+            "Pipeline_Conf", ["algorithm", "algorithmMetadataCode"],
+            ["SmartVA", "SmartVA|2.0.0_a8|PHMRCShort|1|PHMRCShort|1"])
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        cli_smartva = OpenVA(pl.settings, self.static_run_date)
+        if os.path.isfile("OpenVAFiles/pycrossva_input.csv"):
+            os.remove("OpenVAFiles/pycrossva_input.csv")
+        va_data = read_csv("ODKFiles/odk_export_new.csv").iloc[1:]
+        summary = cli_smartva.prep_va_data(va_data=va_data)
+        openva_input = read_csv("OpenVAFiles/openva_input.csv")
+        self.assertEqual(summary["n_to_openva"], va_data.shape[0])
+        self.assertEqual(openva_input["meta-instanceID"].tolist(),
+                         va_data["meta-instanceID"].tolist())
+        self.assertFalse(os.path.isfile("OpenVAFiles/pycrossva_input.csv"))
+
+    @classmethod
+    def tearDownClass(cls):
+
+        os.remove("ODKFiles/odk_export_new.csv")
+        os.remove("OpenVAFiles/openva_input.csv")
+        os.remove("Pipeline.db")
+
+
+class CheckPrepVADataShards(unittest.TestCase):
+    """prep_va_data() gives the same results with pycrossva shards."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        if os.path.isfile("ODKFiles/odk_export_prev.csv"):
+            os.remove("ODKFiles/odk_export_prev.csv")
+        shutil.copy("ODKFiles/another_export.csv",
+                    "ODKFiles/odk_export_new.csv")
+        if not os.path.isfile("Pipeline.db"):
+            create_transfer_db("Pipeline.db", ".", "enilepiP")
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        cls.static_run_date = datetime(
+            2018, 9, 1, 9, 0, 0).strftime("%Y_%m_%d_%H:%M:%S")
+        r_openva = OpenVA(pl.settings, cls.static_run_date)
+        r_openva.prep_va_data()
+        cls.openva_input_serial = read_csv("OpenVAFiles/openva_input.csv")
+        os.remove("OpenVAFiles/openva_input.csv")
+
+        xfer_db = TransferDB(db_file_name="Pipeline.db",
+                             db_directory=".",
+                             db_key="enilepiP",
+                             pl_run_date=True)
+        xfer_db.update_table("Pipeline_Conf", "pycrossvaShardSize", "5")
+        xfer_db.update_table("Pipeline_Conf", "pycrossvaWorkers", "2")
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        r_openva = OpenVA(pl.settings, cls.static_run_date)
+        r_openva.prep_va_data()
+        cls.openva_input_shards = read_csv("OpenVAFiles/openva_input.csv")
+
+    def test_openva_input(self):
+        """Check that the openVA input files match."""
+
+        self.assertTrue(self.openva_input_serial.equals(
+            self.openva_input_shards))
+
+    @classmethod
+    def tearDownClass(cls):
+
+        os.remove("ODKFiles/odk_export_new.csv")
+        os.remove("OpenVAFiles/openva_input.csv")
+        os.remove("Pipeline.db")
+
+
+class CheckRScriptShards(unittest.TestCase):
+    """r_script() and get_cod() with the records split into shards."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        if os.path.isfile("ODKFiles/odk_export_prev.csv"):
+            os.remove("ODKFiles/odk_export_prev.csv")
+        shutil.copy("ODKFiles/another_export.csv",
+                    "ODKFiles/odk_export_new.csv")
+        if os.path.isfile("Pipeline.db"):
+            os.remove("Pipeline.db")
+        create_transfer_db("Pipeline.db", ".", "enilepiP")
+        xfer_db = TransferDB(db_file_name="Pipeline.db",
+                             db_directory=".",
+                             db_key="enilepiP",
+                             pl_run_date=True)
+        xfer_db.update_table("Pipeline_Conf", "openvaShards", "3")
+        xfer_db.update_table("Pipeline_Conf", "openvaWorkers", "2")
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        cls.static_run_date = datetime(
+            2018, 9, 1, 9, 0, 0).strftime("%Y_%m_%d_%H:%M:%S")
+        shutil.rmtree(os.path.join("OpenVAFiles", cls.static_run_date),
+                      ignore_errors=True)
+        cls.r_openva = OpenVA(pl.settings, cls.static_run_date)
+        cls.r_openva.prep_va_data()
+        cls.va_ids = sorted(read_csv("OpenVAFiles/openva_input.csv")["ID"])
+        cls.r_openva.r_script()
+        cls.shard_dirs = [os.path.join("OpenVAFiles", cls.static_run_date,
+                                       "shard_" + str(i)) for i in range(3)]
+
+    @staticmethod
+    def _run_r_shard(shard):
+        """Write the output files of a shard (as the R script would)."""
+
+        shard_dir = os.path.join("OpenVAFiles",
+                                 datetime(2018, 9, 1, 9, 0, 0).strftime(
+                                     "%Y_%m_%d_%H:%M:%S"),
+                                 "shard_" + str(shard))
+        va_ids = read_csv(os.path.join(shard_dir, "openva_input.csv"))["ID"]
+        with open(os.path.join(shard_dir, "record_storage.csv"), "w") as f:
+            f.write("id,cod\n")
+            f.writelines(f"{va_id},A\n" for va_id in va_ids)
+        return collections.namedtuple(
+            "completed", ["args", "returncode", "stdout", "stderr"])(
+            [], 0, b"", b"")
+
+    def test_r_scripts(self):
+        """Check that there is an R script for each shard."""
+
+        self.assertEqual(self.r_openva.shards, 3)
+        for shard_dir in self.shard_dirs:
+            r_script = os.path.join(
+                shard_dir, "r_script_" + self.static_run_date + ".R")
+            with open(r_script, "r") as f:
+                self.assertIn(shard_dir + "/openva_input.csv", f.read())
+
+    def test_shard_inputs(self):
+        """Check that each shard has matching openVA and ODK records."""
+
+        va_ids = []
+        for shard_dir in self.shard_dirs:
+            openva_input = read_csv(
+                os.path.join(shard_dir, "openva_input.csv"))
+            pycrossva_input = read_csv(
+                os.path.join(shard_dir, "pycrossva_input.csv"))
+            self.assertEqual(sorted(openva_input["ID"]),
+                             sorted(pycrossva_input["meta-instanceID"]))
+            va_ids.extend(openva_input["ID"])
+        self.assertEqual(va_ids, self.va_ids)
+
+    def test_get_cod(self):
+        """Check that get_cod() combines the results of the shards."""
+
+        self.r_openva._run_r_shard = self._run_r_shard
+        self.r_openva.get_cod()
+        record_storage = read_csv("OpenVAFiles/record_storage.csv")
+        self.assertEqual(list(record_storage["id"]), self.va_ids)
+        self.assertTrue(self.r_openva.successful_run)
+
+    @classmethod
+    def tearDownClass(cls):
+
+        os.remove("ODKFiles/odk_export_new.csv")
+        for file_name in ["openva_input.csv", "pycrossva_input.csv",
+                          "record_storage.csv",
+                          "entity_attribute_value.csv"]:
+            if os.path.isfile(os.path.join("OpenVAFiles", file_name)):
+                os.remove(os.path.join("OpenVAFiles", file_name))
+        shutil.rmtree(os.path.join("OpenVAFiles", cls.static_run_date),
+                      ignore_errors=True)
+        os.remove("Pipeline.db")
+
+
+class CheckInSilicoVAChains(unittest.TestCase):
+    """r_script() with InSilicoVA chains run in parallel."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        if os.path.isfile("ODKFiles/odk_export_prev.csv"):
+            os.remove("ODKFiles/odk_export_prev.csv")
+        shutil.copy("ODKFiles/another_export.csv",
+                    "ODKFiles/odk_export_new.csv")
+        if os.path.isfile("Pipeline.db"):
+            os.remove("Pipeline.db")
+        create_transfer_db("Pipeline.db", ".", "enilepiP")
+        xfer_db = TransferDB(db_file_name="Pipeline.db",
+                             db_directory=".",
+                             db_key="enilepiP",
+                             pl_run_date=True)
+        xfer_db.update_table(
+            "Pipeline_Conf",
+            ["algorithm", "algorithmMetadataCode"],
+            ["InSilicoVA", ("InSilicoVA-2016|1.0.0|InterVA|5|"
+                            "2016 WHO Verbal Autopsy Form|v1_4_1")])
+        xfer_db.update_table("InSilicoVA_Conf",
+                             ["chains", "chains_rounds"], ["4", "2"])
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        cls.static_run_date = datetime(
+            2018, 9, 1, 9, 0, 0).strftime("%Y_%m_%d_%H:%M:%S")
+        shutil.rmtree(os.path.join("OpenVAFiles", cls.static_run_date),
+                      ignore_errors=True)
+        r_openva = OpenVA(pl.settings, cls.static_run_date)
+        r_openva.prep_va_data()
+        r_openva.r_script()
+        cls.n_chains = r_openva.n_chains()
+        r_script = os.path.join("OpenVAFiles", cls.static_run_date,
+                                "r_script_" + cls.static_run_date + ".R")
+        with open(r_script, "r") as f:
+            cls.r_code = f.read()
+
+    def test_n_chains(self):
+        """Check that n_chains() returns InSilicoVA_Conf.chains."""
+
+        self.assertEqual(self.n_chains, 4)
+
+    def test_chain_function(self):
+        """Check that insilico() takes the seed and Nsim of the chain."""
+
+        self.assertIn("run_chain <- function(chain, nsim, records_sorted)",
+                      self.r_code)
+        self.assertIn("seed <- 1 + chain - 1", self.r_code)
+        self.assertIn("Nsim = nsim,", self.r_code)
+        self.assertIn("seed = seed,", self.r_code)
+        self.assertNotIn("results <- insilico(", self.r_code)
+
+    def test_chain_progress(self):
+        """Check that each chain and round reports the iterations run."""
+
+        self.assertIn("2000 + nrow(csmf) * 10", self.r_code)
+        self.assertIn("progress('chain', nrow(records_sorted), "
+                      "iterations(chain_fit))", self.r_code)
+        self.assertIn("progress('insilico', nrow(records_sorted), "
+                      "sum(sapply(chains, iterations)))", self.r_code)
+        self.assertIn("clusterExport(cl, c('progress', 'progress_file', "
+                      "'progress_start', 'iterations'))", self.r_code)
+
+    def test_chain_log_files(self):
+        """Check that each chain writes its warnings to its own files."""
+
+        self.assertIn("directory = chain_dir,", self.r_code)
+        self.assertIn("paste0('chain', chain)", self.r_code)
+        self.assertIn("paste0('_chain', chain, '\\\\1')", self.r_code)
+
+    def test_chain_length(self):
+        """Check that each chain runs its share of the iterations after
+        the burn-in (default Nsim = 4000, burnin = 2000, thin = 10)."""
+
+        self.assertIn("nsim = 2500, records_sorted = records_sorted",
+                      self.r_code)
+        self.assertIn("makePSOCKcluster(4)", self.r_code)
+        self.assertIn("seq_len(2)", self.r_code)
+        self.assertIn("if (rhat <= 1.05) break", self.r_code)
+
+    def test_pool_chains(self):
+        """Check that the results of the chains are pooled."""
+
+        self.assertIn("results <- pool_chains(chains)", self.r_code)
+        self.assertIn("results$conditional.probs <- do.call(rbind, probs)",
+                      self.r_code)
+        self.assertIn("for (field in c('indiv.prob', 'p.hat'))", self.r_code)
+        self.assertIn("results[field] <- list(NULL)", self.r_code)
+
+    @classmethod
+    def tearDownClass(cls):
+
+        os.remove("ODKFiles/odk_export_new.csv")
+        for file_name in ["openva_input.csv", "pycrossva_input.csv"]:
+            if os.path.isfile(os.path.join("OpenVAFiles", file_name)):
+                os.remove(os.path.join("OpenVAFiles", file_name))
+        shutil.rmtree(os.path.join("OpenVAFiles", cls.static_run_date),
+                      ignore_errors=True)
+        os.remove("Pipeline.db")
+
+
+class CheckCODCache(unittest.TestCase):
+    """Records with cached results are not sent to openVA again."""
+
+    @staticmethod
+    def _write_results(va_ids):
+        """Write the openVA output file (as the R script would)."""
+
+        with open("OpenVAFiles/record_storage.csv", "w", newline="") as f:
+            f.write("id,sex,cod,metadataCode\n")
+            for i, va_id in enumerate(va_ids):
+                cod = "MISSING" if i == 0 else "A"
+                f.write(f"{va_id},Female,{cod},InterVA5\n")
+
+    @staticmethod
+    def _read_rows(file_name):
+
+        with open(file_name, "r", newline="") as f:
+            return sorted(f.readlines())
+
+    @classmethod
+    def setUpClass(cls):
+
+        if os.path.isfile("ODKFiles/odk_export_prev.csv"):
+            os.remove("ODKFiles/odk_export_prev.csv")
+        shutil.copy("ODKFiles/another_export.csv",
+                    "ODKFiles/odk_export_new.csv")
+        if os.path.isfile("Pipeline.db"):
+            os.remove("Pipeline.db")
+        create_transfer_db("Pipeline.db", ".", "enilepiP")
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        cls.static_run_date = datetime(
+            2018, 9, 1, 9, 0, 0).strftime("%Y_%m_%d_%H:%M:%S")
+
+        # first run: nothing is cached
+        r_openva = OpenVA(pl.settings, cls.static_run_date)
+        r_openva.prep_va_data()
+        cls.n_cached_first = r_openva.use_cod_cache(pl.xfer_db.get_cod_cache)
+        cls.va_ids = sorted(r_openva.cache_keys)
+        cls._write_results(cls.va_ids)
+        cls.record_storage_first = cls._read_rows(
+            "OpenVAFiles/record_storage.csv")
+        cls.entries = r_openva.merge_cod_cache()
+        pl.xfer_db.store_cod_cache(cls.entries)
+        os.remove("OpenVAFiles/record_storage.csv")
+
+        # second run: only the record without a cause is sent to openVA
+        r_openva = OpenVA(pl.settings, cls.static_run_date)
+        r_openva.prep_va_data()
+        cls.n_cached_second = r_openva.use_cod_cache(
+            pl.xfer_db.get_cod_cache)
+        cls.openva_input = read_csv("OpenVAFiles/openva_input.csv")
+        cls.pycrossva_input = read_csv("OpenVAFiles/pycrossva_input.csv")
+        cls._write_results(list(cls.openva_input["ID"]))
+        r_openva.merge_cod_cache()
+        cls.record_storage_second = cls._read_rows(
+            "OpenVAFiles/record_storage.csv")
+
+    def test_first_run(self):
+        """Check that records without a cause are not cached."""
+
+        self.assertEqual(self.n_cached_first, 0)
+        self.assertEqual(len(self.entries), len(self.va_ids) - 1)
+
+    def test_second_run(self):
+        """Check that the cached records are removed from the input."""
+
+        self.assertEqual(self.n_cached_second, len(self.va_ids) - 1)
+        self.assertEqual(list(self.openva_input["ID"]), self.va_ids[:1])
+        self.assertEqual(self.pycrossva_input.shape[0], 1)
+
+    def test_results(self):
+        """Check that the cached results are added to the output file."""
+
+        self.assertEqual(self.record_storage_first,
+                         self.record_storage_second)
+
+    def test_insilicova(self):
+        """Check that the results of InSilicoVA are not taken from the cache."""
+
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        settings = dict(pl.settings)
+        settings["pipeline"] = settings["pipeline"]._replace(
+            algorithm="InSilicoVA")
+        r_openva = OpenVA(settings, self.static_run_date)
+        r_openva.prep_va_data()
+        n_cached = r_openva.use_cod_cache(pl.xfer_db.get_cod_cache)
+        openva_input = read_csv("OpenVAFiles/openva_input.csv")
+
+        self.assertEqual(n_cached, 0)
+        self.assertEqual(sorted(openva_input["ID"]), self.va_ids)
+        self.assertEqual(r_openva.cache_keys, {})
+
+    @classmethod
+    def tearDownClass(cls):
+
+        os.remove("ODKFiles/odk_export_new.csv")
+        for file_name in ["openva_input.csv", "pycrossva_input.csv",
+                          "record_storage.csv",
+                          "entity_attribute_value.csv"]:
+            if os.path.isfile(os.path.join("OpenVAFiles", file_name)):
+                os.remove(os.path.join("OpenVAFiles", file_name))
+        os.remove("Pipeline.db")
+
+
+@unittest.skipIf(feather is None, "pyarrow is not installed")
+class CheckInterchangeFormat(unittest.TestCase):
+    """Files passed to R are Feather files with interchangeFormat = feather."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        if os.path.isfile("ODKFiles/odk_export_prev.csv"):
+            os.remove("ODKFiles/odk_export_prev.csv")
+        shutil.copy("ODKFiles/another_export.csv",
+                    "ODKFiles/odk_export_new.csv")
+        if os.path.isfile("Pipeline.db"):
+            os.remove("Pipeline.db")
+        create_transfer_db("Pipeline.db", ".", "enilepiP")
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        cls.static_run_date = datetime(
+            2018, 9, 1, 9, 0, 0).strftime("%Y_%m_%d_%H:%M:%S")
+        shutil.rmtree(os.path.join("OpenVAFiles", cls.static_run_date),
+                      ignore_errors=True)
+        r_openva = OpenVA(pl.settings, cls.static_run_date)
+        r_openva.prep_va_data()
+        cls.openva_input_csv = read_csv("OpenVAFiles/openva_input.csv")
+        os.remove("OpenVAFiles/openva_input.csv")
+        os.remove("OpenVAFiles/pycrossva_input.csv")
+
+        pl.xfer_db.update_table("Pipeline_Conf", "interchangeFormat",
+                                "feather")
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        cls.r_openva = OpenVA(pl.settings, cls.static_run_date)
+        cls.r_openva.prep_va_data()
+        cls.r_openva.use_cod_cache(pl.xfer_db.get_cod_cache)
+        cls.r_openva.r_script()
+        r_script = os.path.join("OpenVAFiles", cls.static_run_date,
+                                "r_script_" + cls.static_run_date + ".R")
+        with open(r_script, "r") as f:
+            cls.r_code = f.read()
+
+    def test_inputs(self):
+        """Check that the input files are Feather files with the records."""
+
+        self.assertFalse(os.path.isfile("OpenVAFiles/openva_input.csv"))
+        openva_input = read_va_file("OpenVAFiles/openva_input.feather")
+        self.assertEqual(list(openva_input["ID"]),
+                         list(self.openva_input_csv["ID"]))
+        self.assertEqual(list(openva_input), list(self.openva_input_csv))
+        pycrossva_input = read_va_file("OpenVAFiles/pycrossva_input.feather")
+        self.assertEqual(pycrossva_input.shape[0], openva_input.shape[0])
+
+    def test_r_script(self):
+        """Check that the R script reads and writes Feather files."""
+
+        self.assertIn("OpenVAFiles/pycrossva_input.feather'))", self.r_code)
+        self.assertIn("OpenVAFiles/openva_input.feather'))", self.r_code)
+        self.assertIn("arrow::read_feather(", self.r_code)
+        self.assertIn("arrow::write_feather(records3,", self.r_code)
+        self.assertNotIn("read.csv", self.r_code)
+
+    def test_results(self):
+        """Check the results read from record_storage.feather."""
+
+        va_ids = list(self.openva_input_csv["ID"])
+        write_va_file(DataFrame({"id": va_ids, "cod": "A"}),
+                      "OpenVAFiles/record_storage.feather")
+        entries = self.r_openva.merge_cod_cache()
+        self.assertEqual(len(entries), len(va_ids))
+        self.assertEqual(self.r_openva.get_summary(),
+                         {"n_processed": len(va_ids), "n_cod_missing": 0})
+
+    @classmethod
+    def tearDownClass(cls):
+
+        os.remove("ODKFiles/odk_export_new.csv")
+        for file_name in ["openva_input.feather", "pycrossva_input.feather",
+                          "record_storage.feather"]:
+            if os.path.isfile(os.path.join("OpenVAFiles", file_name)):
+                os.remove(os.path.join("OpenVAFiles", file_name))
+        shutil.rmtree(os.path.join("OpenVAFiles", cls.static_run_date),
+                      ignore_errors=True)
+        os.remove("Pipeline.db")
+
+
+class CheckProgress(unittest.TestCase):
+    """Progress lines of the R script are read while it runs."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        if os.path.isfile("ODKFiles/odk_export_prev.csv"):
+            os.remove("ODKFiles/odk_export_prev.csv")
+        shutil.copy("ODKFiles/another_export.csv",
+                    "ODKFiles/odk_export_new.csv")
+        if os.path.isfile("Pipeline.db"):
+            os.remove("Pipeline.db")
+        create_transfer_db("Pipeline.db", ".", "enilepiP")
+        pl = Pipeline(db_file_name="Pipeline.db",
+                      db_directory=".",
+                      db_key="enilepiP")
+        cls.static_run_date = datetime(
+            2018, 9, 1, 9, 0, 0).strftime("%Y_%m_%d_%H:%M:%S")
+        shutil.rmtree(os.path.join("OpenVAFiles", cls.static_run_date),
+                      ignore_errors=True)
+        cls.r_openva = OpenVA(pl.settings, cls.static_run_date)
+        cls.r_openva.prep_va_data()
+        cls.r_openva.r_script()
+        cls.progress_file = os.path.join(
+            "OpenVAFiles", cls.static_run_date,
+            "r_script_" + cls.static_run_date + ".progress")
+        with open(os.path.splitext(cls.progress_file)[0] + ".R", "r") as f:
+            cls.r_code = f.read()
+
+    def _run(self):
+        """Write progress lines (as the R script would)."""
+
+        lines = ["PROGRESS\tstart\tNA\tNA\t0",
+                 "PROGRESS\tread_input\t20\tNA\t1.5",
+                 "PROGRESS\tinterva\t20\tNA\t4",
+                 "PROGRESS\tmerge\t20\tNA\t4.25",
+                 "PROGRESS\twrite_output\t20\tNA\t5"]
+        for line in lines:
+            with open(self.progress_file, "a") as f:
+                f.write(line + "\n")
+            time.sleep(0.05)
+        return "done"
+
+    def test_r_script(self):
+        """Check that the R script writes progress lines."""
+
+        self.assertIn(self.progress_file + "' \n", self.r_code)
+        for phase in ["start", "read_input", "interva", "merge",
+                      "write_output"]:
+            self.assertIn("progress('" + phase + "'", self.r_code)
+
+    def test_run_with_progress(self):
+        """Check that the progress events are passed on while R runs."""
+
+        events = []
+        self.r_openva.progress = events.append
+        interval = openva.PROGRESS_INTERVAL
+        openva.PROGRESS_INTERVAL = 0.01
+        try:
+            self.assertEqual(self.r_openva._run_with_progress(self._run),
+                             "done")
+        finally:
+            openva.PROGRESS_INTERVAL = interval
+        self.assertEqual([event["phase"] for event in events],
+                         ["start", "read_input", "interva", "merge",
+                          "write_output"])
+        self.assertEqual(events[1]["records"], 20)
+        self.assertIsNone(events[1]["iteration"])
+        self.assertEqual(self.r_openva.phase_times(),
+                         {"read_input": 1.5, "interva": 2.5, "merge": 0.25,
+                          "write_output": 0.75})
+        self.assertEqual(progress_message(events[2]),
+                         "openVA progress: interva (20 records) after 4.0 s")
+
+    def test_heartbeat(self):
+        """Check that a heartbeat is passed on while no lines are added."""
+
+        def run():
+            time.sleep(0.2)
+            return "done"
+
+        events = []
+        self.r_openva.progress = events.append
+        self.r_openva.progress_events = []
+        intervals = openva.PROGRESS_INTERVAL, openva.HEARTBEAT_INTERVAL
+        openva.PROGRESS_INTERVAL, openva.HEARTBEAT_INTERVAL = 0.01, 0.05
+        try:
+            self.r_openva._run_with_progress(run, shard=2)
+        finally:
+            openva.PROGRESS_INTERVAL, openva.HEARTBEAT_INTERVAL = intervals
+        self.assertGreater(len(events), 0)
+        self.assertEqual({event["phase"] for event in events}, {"running"})
+        self.assertEqual(events[0]["shard"], 2)
+        self.assertEqual(self.r_openva.phase_times(), {})
+        self.assertTrue(progress_message(events[0]).startswith(
+            "openVA progress: running (shard 2) after "))
+
+    def test_chain_events(self):
+        """Check that the chain events do not end a phase."""
+
+        self.r_openva.progress_events = [
+            parse_progress("PROGRESS\tread_input\t20\tNA\t1"),
+            parse_progress("PROGRESS\tchain\t20\t2500\t30"),
+            parse_progress("PROGRESS\tchain\t20\t2510\t31"),
+            parse_progress("PROGRESS\tinsilico\t20\t5010\t32")]
+        for event in self.r_openva.progress_events:
+            event["shard"] = None
+        self.assertEqual(self.r_openva.phase_times(),
+                         {"read_input": 1.0, "insilico": 31.0})
+
+    def test_parse_progress(self):
+        """Check that other lines of the progress file are skipped."""
+
+        self.assertIsNone(parse_progress("Iteration: 100"))
+        self.assertEqual(parse_progress("PROGRESS\tinsilico\t5\t4000\t9.5"),
+                         {"phase": "insilico", "records": 5,
+                          "iteration": 4000, "elapsed": 9.5})
+
+    @classmethod
+    def tearDownClass(cls):
+
+        os.remove("ODKFiles/odk_export_new.csv")
+        for file_name in ["openva_input.csv", "pycrossva_input.csv"]:
+            if os.path.isfile(os.path.join("OpenVAFiles", file_name)):
+                os.remove(os.path.join("OpenVAFiles", file_name))
+        shutil.rmtree(os.path.join("OpenVAFiles", cls.static_run_date),
+                      ignore_errors=True)
+        os.remove("Pipeline.db")
+
+
+class CheckLimits(unittest.TestCase):
+    """SmartVA (or R) is stopped when it exceeds the limits."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        if os.path.isfile("Pipeline.db"):
+            os.remove("Pipeline.db")
+        create_transfer_db("Pipeline.db", ".", "enilepiP")
+        xfer_db = TransferDB(db_file_name="Pipeline.db",
+                             db_directory=".",
+                             db_key="enilepiP",
+                             pl_run_date=True)
+        xfer_db.update_table(
+            "Pipeline_Conf", ["algorithm", "algorithmMetadataCode"],
+            ["SmartVA", "SmartVA|2.0.0_a8|PHMRCShort|1|PHMRCShort|1"])
+        xfer_db.update_table("Pipeline_Conf",
+                             ["openvaTimeout", "openvaMemoryLimit"],
+                             ["2", "100"])
+        cls.pl = Pipeline(db_file_name="Pipeline.db",
+                          db_directory=".",
+                          db_key="enilepiP")
+        cls.static_run_date = datetime(
+            2018, 9, 1, 9, 0, 0).strftime("%Y_%m_%d_%H:%M:%S")
+        cls.fake_smartva = os.path.abspath("fake_smartva")
+
+    def _get_cod(self, code):
+        """Run get_cod() with a stand-in for the SmartVA CLI."""
+
+        with open(self.fake_smartva, "w") as f:
+            f.write("#!" + sys.executable + "\nimport time\n" + code + "\n")
+        os.chmod(self.fake_smartva, 0o755)
+        shutil.rmtree(os.path.join("OpenVAFiles", self.static_run_date),
+                      ignore_errors=True)
+        cli_smartva = OpenVA(self.pl.settings, self.static_run_date)
+        cli_smartva.cli_smartva = self.fake_smartva
+        return cli_smartva.get_cod()
+
+    def test_limits(self):
+        """Check the limits passed to the supervisor."""
+
+        limits = OpenVA(self.pl.settings, self.static_run_date)._limits()
+        self.assertEqual(limits["timeout"], 2)
+        self.assertEqual(limits["memory_limit"], 100)
+        self.assertIsNone(limits["address_space_limit"])
+        self.assertIsNone(limits["cpus"])
+
+    def test_timeout(self):
+        """Check that SmartVA is stopped after Pipeline_Conf.openvaTimeout."""
+
+        with self.assertRaises(SmartVATimeoutError):
+            self._get_cod("time.sleep(60)")
+
+    @unittest.skipUnless(os.path.isdir("/proc"), "needs /proc")
+    def test_memory_limit(self):
+        """Check that SmartVA is stopped above Pipeline_Conf.openvaMemoryLimit."""
+
+        with self.assertRaises(SmartVAMemoryError) as cm:
+            self._get_cod("x = bytearray(300 * 1024 * 1024)\ntime.sleep(60)")
+        self.assertIsInstance(cm.exception, SmartVAError)
+
+    @classmethod
+    def tearDownClass(cls):
+
+        if os.path.isfile(cls.fake_smartva):
+            os.remove(cls.fake_smartva)
+        shutil.rmtree(os.path.join("OpenVAFiles", cls.static_run_date),
+                      ignore_errors=True)
+        os.remove("Pipeline.db")
+
+
 class CheckZeroRecords(unittest.TestCase):
 
     @classmethod
@@ -218,10 +942,12 @@ class CheckInSilicoVA(unittest.TestCase):
         self.assertTrue(os.path.isfile(self.r_out_file))
 
     def test_insilicova_eav(self):
-        """Check that get_cod() creates EAV output for InSilicoVA"""
+        """Check that the EAV blob is created from the InSilicoVA output"""
 
-        self.assertTrue(
-            os.path.isfile("OpenVAFiles/entity_attribute_value.csv"))
+        record_storage = read_va_csv("OpenVAFiles/record_storage.csv")
+        eva = record_storage_to_eva(record_storage)
+        self.assertEqual(set(eva["ID"]),
+                         set(record_storage["id"].astype(str)))
 
     def test_insilicova_record_storage(self):
         """Check that get_cod() record_storage.csv for InSilicoVA"""
@@ -317,10 +1043,12 @@ class CheckInterVA(unittest.TestCase):
         self.assertTrue(os.path.isfile(self.r_out_file))
 
     def test_interva_EAV(self):
-        """Check that get_cod() creates EAV outpue for InterVA"""
+        """Check that the EAV blob is created from the InterVA output"""
 
-        self.assertTrue(
-            os.path.isfile("OpenVAFiles/entity_attribute_value.csv"))
+        record_storage = read_va_csv("OpenVAFiles/record_storage.csv")
+        eva = record_storage_to_eva(record_storage)
+        self.assertEqual(set(eva["ID"]),
+                         set(record_storage["id"].astype(str)))
 
     def test_interva_record_storage(self):
         """Check that get_cod() record_storage.csv for InterVA"""
@@ -523,10 +1251,12 @@ class CheckSmartVA(unittest.TestCase):
         self.assertTrue(os.path.isfile(self.svaOut))
 
     def test_smartva_EAV(self):
-        """Check that get_cod() creates EAV output for SmartVA"""
+        """Check that the EAV blob is created from the SmartVA output"""
 
-        self.assertTrue(
-            os.path.isfile("OpenVAFiles/entity_attribute_value.csv"))
+        record_storage = read_va_csv("OpenVAFiles/record_storage.csv")
+        eva = record_storage_to_eva(record_storage)
+        self.assertEqual(set(eva["ID"]),
+                         set(record_storage["ID"].astype(str)))
 
     def test_smartva_record_storage(self):
         """Check that get_cod() record_storage.csv for SmartVA"""
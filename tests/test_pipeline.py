@@ -3,7 +3,9 @@ from openva_pipeline.pipeline import Pipeline
 from openva_pipeline.run_pipeline import download_briefcase
 from openva_pipeline.run_pipeline import download_smartva
 from openva_pipeline.run_pipeline import create_transfer_db
+from openva_pipeline.run_pipeline import check_openva_install
 import datetime
+import sys
 import shutil
 import os
 import unittest
@@ -665,12 +667,6 @@ class CheckRunOpenVASmartVA(unittest.TestCase):
 
         self.assertTrue(os.path.isfile(self.sva_out))
 
-    def test_run_openva_smartva_eva(self):
-        """Check that run_openva() creates EAV output for SmartVA """
-
-        self.assertTrue(
-            os.path.isfile("OpenVAFiles/entity_attribute_value.csv"))
-
     def test_run_openva_smartva_record_storage(self):
         """Check that run_openva() creates record_storage.csv for SmartVA"""
 
@@ -1074,5 +1070,175 @@ class CheckPipelineCleanPipeline(unittest.TestCase):
             os.remove("OpenVAFiles/new_storage.csv")
 
 
+class CheckResumeStage(unittest.TestCase):
+    """Check the run manifest and resume_stage method:"""
+
+    def setUp(self):
+
+        if os.path.isfile("Resume_Pipeline.db"):
+            os.remove("Resume_Pipeline.db")
+        create_transfer_db("Resume_Pipeline.db", ".", "enilepiP")
+        self.output_files = ["ODKFiles/odk_export_new.csv",
+                             "OpenVAFiles/record_storage.csv"]
+        for file_name in self.output_files:
+            with open(file_name, "w") as f:
+                f.write("ID\nuuid:a\n")
+        self.pl = Pipeline("Resume_Pipeline.db", ".", "enilepiP", True)
+        for stage in ["odk", "openva"]:
+            self.pl.checkpoint(stage, "started")
+            self.pl.checkpoint(stage, "completed")
+        self.pl.checkpoint("dhis", "started")
+        self.pl.checkpoint("dhis", "failed")
+
+    def _new_pipeline(self):
+
+        pl = Pipeline("Resume_Pipeline.db", ".", "enilepiP", True)
+        pl.run_id = "2100-01-01_00:00:00"
+        return pl
+
+    def test_manifest(self):
+        """Test hashes recorded in the Run_Manifest table:"""
+
+        run_id, stages = self.pl.xfer_db.get_run_manifest()
+        self.assertEqual(run_id, self.pl.run_id)
+        self.assertEqual(stages["dhis"]["status"], "failed")
+        self.assertEqual(sorted(stages["openva"]["output_hashes"]),
+                         ["OpenVAFiles/record_storage.csv",
+                          "OpenVAFiles/record_storage.feather"])
+        self.assertIsNone(stages["openva"]["output_hashes"][
+            "OpenVAFiles/record_storage.feather"])
+        self.assertIsNone(
+            stages["openva"]["input_hashes"]["ODKFiles/odk_export_prev.csv"])
+
+    def test_resume_failed_stage(self):
+        """Test resuming at the stage that failed:"""
+
+        pl = self._new_pipeline()
+        self.assertEqual(pl.resume_stage(), "dhis")
+        self.assertEqual(pl.run_id, self.pl.run_id)
+
+    def test_resume_changed_output(self):
+        """Test resuming at a stage whose output files changed:"""
+
+        with open("OpenVAFiles/record_storage.csv", "a") as f:
+            f.write("uuid:b\n")
+        self.assertEqual(self._new_pipeline().resume_stage(), "openva")
+
+    def test_finished_run(self):
+        """Test that a completed run is not resumed:"""
+
+        for stage in ["dhis", "store", "close"]:
+            self.pl.checkpoint(stage, "completed")
+        pl = self._new_pipeline()
+        self.assertEqual(pl.resume_stage(), "odk")
+        self.assertEqual(pl.run_id, "2100-01-01_00:00:00")
+
+    def tearDown(self):
+
+        os.remove("Resume_Pipeline.db")
+        for file_name in self.output_files:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+
+# Stand-in for R CMD BATCH that counts its runs and reports the R home and
+# package directories given in fake_r.txt (without loading openVA).
+FAKE_R = """#!{python}
+import os, re, sys
+wd = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(wd, "runs"), "a") as f:
+    f.write("run\\n")
+with open(sys.argv[-2]) as f:
+    out = re.search(r"'([^']*)'\\)\\s*$", f.read()).group(1)
+with open(os.path.join(wd, "fake_r.txt")) as f:
+    paths = f.read()
+with open(out, "w") as f:
+    f.write(paths)
+open(sys.argv[-1], "w").close()
+"""
+
+
+class CheckOpenVAInstall(unittest.TestCase):
+    """Check the cached check of the openVA installation."""
+
+    def setUp(self):
+
+        self.wd = os.path.abspath("openva_install_test")
+        if os.path.isdir(self.wd):
+            shutil.rmtree(self.wd)
+        self.r_home = os.path.join(self.wd, "R")
+        os.makedirs(os.path.join(self.r_home, "library", "base"))
+        self._set_r_version("4.3.1")
+        self.packages = [os.path.join(self.wd, "library", name)
+                         for name in ["openVA", "lubridate"]]
+        for package in self.packages:
+            os.makedirs(package)
+        with open(os.path.join(self.wd, "fake_r.txt"), "w") as f:
+            f.write("\n".join([self.r_home] + self.packages) + "\n")
+        self.fake_r = os.path.join(self.wd, "fake_r")
+        with open(self.fake_r, "w") as f:
+            f.write(FAKE_R.format(python=sys.executable))
+        os.chmod(self.fake_r, 0o755)
+
+    def _set_r_version(self, version):
+
+        with open(os.path.join(self.r_home, "library", "base",
+                               "DESCRIPTION"), "w") as f:
+            f.write(f"Package: base\nVersion: {version}\n")
+
+    def _check(self, use_cache=True):
+        """Run the check and return the number of times R was started."""
+
+        self.assertTrue(check_openva_install(self.wd, use_cache=use_cache,
+                                             r_command=self.fake_r))
+        with open(os.path.join(self.wd, "runs")) as f:
+            return len(f.readlines())
+
+    def test_cached(self):
+        """Check that R is only started for the first check."""
+
+        self.assertEqual(self._check(), 1)
+        self.assertEqual(self._check(), 1)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.wd, "openva_install.json")))
+        self.assertFalse(os.path.isfile(
+            os.path.join(self.wd, "test_openva_install.R")))
+
+    def test_use_cache(self):
+        """Check that use_cache=False always starts R."""
+
+        self._check()
+        self.assertEqual(self._check(use_cache=False), 2)
+
+    def test_r_version(self):
+        """Check that a new R version is checked again."""
+
+        self._check()
+        self._set_r_version("4.4.0")
+        self.assertEqual(self._check(), 2)
+        self.assertEqual(self._check(), 2)
+
+    def test_package_updated(self):
+        """Check that an updated (or removed) package is checked again."""
+
+        self._check()
+        os.utime(self.packages[0], (0, 0))
+        self.assertEqual(self._check(), 2)
+        shutil.rmtree(self.packages[1])
+        os.makedirs(self.packages[1])
+        os.utime(self.packages[1], (0, 0))
+        self.assertEqual(self._check(), 3)
+
+    def test_r_missing(self):
+        """Check that the check fails without R."""
+
+        self.assertFalse(check_openva_install(
+            self.wd, r_command=os.path.join(self.wd, "missing_r")))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.wd, ignore_errors=True)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,189 @@
+from openva_pipeline.r_worker import RWorker
+from openva_pipeline.exceptions import OpenVAError
+import unittest
+import os
+import sys
+import shutil
+import stat
+import subprocess
+from sys import path
+
+source_path = os.path.dirname(os.path.abspath(__file__))
+path.append(source_path)
+import context
+
+os.chdir(os.path.abspath(os.path.dirname(__file__)))
+
+# Stand-in for Rscript that answers the worker protocol (without loading
+# openVA); RUN copies the script to the output file.
+FAKE_R = """#!{python}
+import shutil, socket, sys, time
+port, token = int(sys.argv[3]), sys.argv[4]
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(("127.0.0.1", port))
+server.listen()
+while True:
+    conn, _ = server.accept()
+    request = conn.makefile().readline().rstrip("\\n").split("\\t")
+    if request[0] != token:
+        conn.close()
+        continue
+    if request[1] == "STOP":
+        conn.sendall(b"BYE\\n")
+        conn.close()
+        break
+    if request[1] == "PING":
+        reply = "PONG"
+    elif request[1] == "RUN":
+        if "slow" in request[2]:
+            time.sleep(60)
+        if "crash" in request[2]:
+            sys.exit(1)
+        try:
+            shutil.copy(request[2], request[3])
+            reply = "OK"
+        except OSError as exc:
+            reply = "ERROR " + str(exc)
+    conn.sendall((reply + "\\n").encode())
+    conn.close()
+"""
+
+
+class CheckRWorker(unittest.TestCase):
+    """Check the protocol and restarts of the R worker."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.wd = "r_worker_test"
+        if os.path.isdir(cls.wd):
+            shutil.rmtree(cls.wd)
+        os.makedirs(cls.wd)
+        cls.fake_r = os.path.abspath(os.path.join(cls.wd, "fake_rscript"))
+        with open(cls.fake_r, "w") as f:
+            f.write(FAKE_R.format(python=sys.executable))
+        os.chmod(cls.fake_r, os.stat(cls.fake_r).st_mode | stat.S_IEXEC)
+        cls.r_script = os.path.join(cls.wd, "script.R")
+        with open(cls.r_script, "w") as f:
+            f.write("library(openVA) \n")
+
+    def setUp(self):
+
+        self.worker = RWorker(self.wd, r_command=self.fake_r,
+                              startup_timeout=30)
+
+    def tearDown(self):
+
+        self.worker.stop()
+
+    def test_start_and_reuse(self):
+        """A new RWorker uses the worker in the state file."""
+
+        self.worker.ensure_running()
+        self.assertTrue(self.worker.ping())
+        self.assertTrue(os.path.isfile(self.worker.state_file))
+        second = RWorker(self.wd, r_command=self.fake_r)
+        self.assertEqual(second.state, self.worker.state)
+        self.assertTrue(second.ping())
+
+    def test_run_script(self):
+        """run_script returns a CompletedProcess with the script output."""
+
+        out_file = os.path.join(self.wd, "script.Rout")
+        completed = self.worker.run_script(self.r_script, out_file)
+        self.assertEqual(completed.returncode, 0)
+        with open(out_file) as f:
+            self.assertEqual(f.read(), "library(openVA) \n")
+
+    def test_run_script_error(self):
+        """A failed script gives a return code of 1."""
+
+        completed = self.worker.run_script(
+            os.path.join(self.wd, "missing.R"),
+            os.path.join(self.wd, "missing.Rout"))
+        self.assertEqual(completed.returncode, 1)
+        self.assertIn(b"ERROR", completed.stderr)
+
+    def test_run_script_timeout(self):
+        """A script running longer than the timeout stops the worker."""
+
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.worker.run_script(os.path.join(self.wd, "slow.R"),
+                                   os.path.join(self.wd, "slow.Rout"),
+                                   timeout=1)
+        self.assertEqual(self.worker.state, {})
+        self.assertFalse(os.path.isfile(self.worker.state_file))
+
+    def test_restart(self):
+        """A worker that stopped answering is replaced."""
+
+        self.worker.ensure_running()
+        old_state = dict(self.worker.state)
+        self.worker.stop()
+        self.worker.state = old_state
+        self.assertFalse(self.worker.ping())
+        self.worker.ensure_running()
+        self.assertTrue(self.worker.ping())
+        self.assertNotEqual(self.worker.state["token"], old_state["token"])
+
+    def test_settings_change(self):
+        """A worker started with other settings is replaced."""
+
+        self.worker.ensure_running()
+        old_state = dict(self.worker.state)
+        other = RWorker(self.wd, r_command=self.fake_r, startup_timeout=30,
+                        nice=1)
+        self.assertEqual(other.state, old_state)
+        self.assertNotEqual(other.fingerprint, old_state["fingerprint"])
+        other.ensure_running()
+        self.assertNotEqual(other.state["token"], old_state["token"])
+        self.assertEqual(other.state["fingerprint"], other.fingerprint)
+        self.worker.state = old_state
+        self.assertFalse(self.worker.ping())
+        self.worker.state = other.state
+
+    def test_old_state_file(self):
+        """A worker in a state file without a fingerprint is replaced."""
+
+        self.worker.ensure_running()
+        old_state = dict(self.worker.state)
+        del self.worker.state["fingerprint"]
+        self.worker.ensure_running()
+        self.assertNotEqual(self.worker.state["token"], old_state["token"])
+
+    def test_lost_connection(self):
+        """A worker that stops while running a script is not reused."""
+
+        completed = self.worker.run_script(
+            os.path.join(self.wd, "crash.R"),
+            os.path.join(self.wd, "crash.Rout"))
+        self.assertEqual(completed.returncode, 1)
+        self.assertIn(b"lost connection", completed.stderr)
+        self.assertEqual(self.worker.state, {})
+        self.assertFalse(os.path.isfile(self.worker.state_file))
+
+    def test_wrong_token(self):
+        """Requests without the token of the worker are ignored."""
+
+        self.worker.ensure_running()
+        other = RWorker(self.wd, r_command=self.fake_r)
+        other.state["token"] = "wrong"
+        self.assertFalse(other.ping())
+        self.assertTrue(self.worker.ping())
+
+    def test_no_r(self):
+        """A missing R command raises OpenVAError."""
+
+        worker = RWorker(self.wd, r_command="not_an_r_command")
+        with self.assertRaises(OpenVAError):
+            worker.ensure_running()
+
+    @classmethod
+    def tearDownClass(cls):
+
+        shutil.rmtree(cls.wd, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,114 @@
+from openva_pipeline.supervisor import run_supervised
+from openva_pipeline.supervisor import MemoryLimitExceeded
+import unittest
+import os
+import sys
+import subprocess
+import time
+from sys import path
+
+source_path = os.path.dirname(os.path.abspath(__file__))
+path.append(source_path)
+import context
+
+os.chdir(os.path.abspath(os.path.dirname(__file__)))
+
+
+def python(code):
+    return [sys.executable, "-c", code]
+
+
+class CheckRunSupervised(unittest.TestCase):
+    """Check the limits of the supervised processes."""
+
+    def test_output(self):
+        """Check the output and return code of a command."""
+
+        completed = run_supervised(python("print('done')"))
+        self.assertEqual(completed.returncode, 0)
+        self.assertEqual(completed.stdout.strip(), b"done")
+
+    def test_check(self):
+        """Check that a failed command raises CalledProcessError."""
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_supervised(python("import sys; sys.exit(2)"), check=True)
+
+    def test_timeout(self):
+        """Check that a command is stopped after the timeout."""
+
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            run_supervised(python("import time; time.sleep(60)"),
+                           timeout=1, poll_interval=0.1)
+        self.assertLess(time.monotonic() - start, 30)
+
+    @unittest.skipUnless(os.path.isdir("/proc"), "needs /proc")
+    def test_memory_limit(self):
+        """Check that a process group using too much memory is stopped."""
+
+        code = ("import subprocess, sys; subprocess.run([sys.executable, "
+                "'-c', 'x = bytearray(300 * 1024 * 1024); "
+                "import time; time.sleep(60)'])")
+        with self.assertRaises(MemoryLimitExceeded) as cm:
+            run_supervised(python(code), memory_limit=100, poll_interval=0.1)
+        self.assertGreater(cm.exception.memory, 100)
+
+    @unittest.skipUnless(os.name == "posix", "needs POSIX")
+    def test_address_space_limit(self):
+        """Check that memory beyond the address space limit is refused."""
+
+        completed = run_supervised(
+            python("x = bytearray(1024 * 1024 * 1024)"),
+            address_space_limit=512)
+        self.assertNotEqual(completed.returncode, 0)
+        self.assertIn(b"MemoryError", completed.stderr)
+
+    @unittest.skipUnless(hasattr(os, "sched_getaffinity"), "needs Linux")
+    def test_nice_and_cpus(self):
+        """Check the nice level and CPU affinity of a command."""
+
+        nice = os.nice(0)
+        completed = run_supervised(
+            python("import os; print(os.nice(0), "
+                   "sorted(os.sched_getaffinity(0)))"),
+            nice=3, cpus=[0])
+        self.assertEqual(completed.stdout.split(b" ", 1),
+                         [str(min(nice + 3, 19)).encode(), b"[0]\n"])
+
+    @unittest.skipUnless(os.name == "posix", "needs POSIX")
+    def test_sigkill(self):
+        """Check that SIGKILL is not reported as a memory error."""
+
+        code = "import os, signal; os.kill(os.getpid(), signal.SIGKILL)"
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            run_supervised(python(code), check=True, memory_limit=4096,
+                           address_space_limit=4096)
+        self.assertEqual(cm.exception.returncode, -9)
+
+    @unittest.skipUnless(hasattr(os, "sched_getaffinity"), "needs Linux")
+    def test_limits_before_start(self):
+        """Check that the limits are set before the command starts."""
+
+        code = ("import os, resource, subprocess, sys; "
+                "print(os.nice(0), sorted(os.sched_getaffinity(0)), "
+                "resource.getrlimit(resource.RLIMIT_AS)[0] // 1024 ** 2); "
+                "sys.stdout.flush(); "
+                "subprocess.run([sys.executable, '-c', 'import os; "
+                "print(os.nice(0), sorted(os.sched_getaffinity(0)))'])")
+        nice = os.nice(0)
+        completed = run_supervised(python(code), nice=2, cpus=[0],
+                                   address_space_limit=4096)
+        first, second = completed.stdout.decode().splitlines()
+        self.assertEqual(first,
+                         f"{min(nice + 2, 19)} [0] 4096")
+        self.assertEqual(second, f"{min(nice + 2, 19)} [0]")
+
+    def test_missing_command(self):
+        """Check that a missing command raises OSError with limits too."""
+
+        with self.assertRaises(OSError):
+            run_supervised(["no_such_command_xyz"], nice=2)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -236,6 +236,61 @@ class CheckPipelineConf(unittest.TestCase):
             "workingDirectory",
             self.settings_pipeline.working_directory)
 
+    def test_pipeline_conf_pycrossva(self):
+        """Test Pipeline_Conf table has default pycrossva settings."""
+        self.assertEqual(self.settings_pipeline.pycrossva_shard_size, 1000)
+        self.assertEqual(self.settings_pipeline.pycrossva_workers, 1)
+
+    def test_pipeline_conf_interchange_format(self):
+        """Test Pipeline_Conf table has the default interchangeFormat."""
+        self.assertEqual(self.settings_pipeline.interchange_format, "csv")
+
+    def test_pipeline_conf_limits(self):
+        """Test Pipeline_Conf table has no limits for R and SmartVA."""
+        self.assertEqual(self.settings_pipeline.openva_timeout, 0)
+        self.assertEqual(self.settings_pipeline.openva_memory_limit, 0)
+        self.assertEqual(self.settings_pipeline.openva_address_space_limit, 0)
+        self.assertEqual(self.settings_pipeline.openva_nice, 0)
+        self.assertEqual(self.settings_pipeline.openva_cpus, ())
+
+    def test_pipeline_conf_cpus(self):
+        """Test that openvaCpus is read as a tuple of CPU numbers."""
+        self.xfer_db.update_table("Pipeline_Conf", "openvaCpus", "0, 2")
+        self.assertEqual(self.xfer_db.config_pipeline().openva_cpus, (0, 2))
+        self.xfer_db.update_table("Pipeline_Conf", "openvaCpus", "")
+
+    def test_pipeline_conf_older_database(self):
+        """Test defaults for columns missing from an older database."""
+        create_transfer_db("Old_Pipeline.db", ".", "enilepiP")
+        xfer_db = TransferDB(db_file_name="Old_Pipeline.db",
+                             db_directory=".",
+                             db_key="enilepiP",
+                             pl_run_date=True)
+        conn = xfer_db._connect_db()
+        for field in ["openvaShards", "openvaCpus"]:
+            conn.execute(f"ALTER TABLE Pipeline_Conf DROP COLUMN {field}")
+        conn.commit()
+        conn.close()
+        settings_pipeline = xfer_db.config_pipeline()
+        os.remove("Old_Pipeline.db")
+        self.assertEqual(settings_pipeline.openva_shards, 1)
+        self.assertEqual(settings_pipeline.openva_cpus, ())
+        self.assertEqual(settings_pipeline.openva_workers, 1)
+
+    def test_pipeline_conf_nice_exception(self):
+        """config_pipeline should fail with invalid openvaNice."""
+        self.xfer_db.update_table("Pipeline_Conf", "openvaNice", "20")
+        self.assertRaises(PipelineConfigurationError,
+                          self.xfer_db.config_pipeline)
+        self.xfer_db.update_table("Pipeline_Conf", "openvaNice", "0")
+
+    def test_pipeline_conf_pycrossva_workers_exception(self):
+        """config_pipeline should fail with invalid pycrossvaWorkers."""
+        self.xfer_db.update_table("Pipeline_Conf", "pycrossvaWorkers", "0")
+        self.assertRaises(PipelineConfigurationError,
+                          self.xfer_db.config_pipeline)
+        self.xfer_db.update_table("Pipeline_Conf", "pycrossvaWorkers", "1")
+
     @classmethod
     def tearDownClass(cls):
         os.remove("Pipeline.db")
@@ -555,6 +610,28 @@ class CheckOpenVAConfInSilicoVA(unittest.TestCase):
         """Test InSilicoVA_Conf table has valid Nsim"""
         self.assertEqual(self.settings_openva.insilicova_nsim, "4000")
 
+    def test_openva_conf_insilicova_chains(self):
+        """Test InSilicoVA_Conf table has default chain settings."""
+        self.assertEqual(self.settings_openva.insilicova_chains, "1")
+        self.assertEqual(self.settings_openva.insilicova_chains_rhat, "1.05")
+        self.assertEqual(self.settings_openva.insilicova_chains_rounds, "2")
+
+    def test_openva_conf_insilicova_chains_exception(self):
+        """config_openva should fail with invalid InSilicoVA_Conf.chains
+        and chains_rhat values."""
+        xfer_db = TransferDB(db_file_name="Pipeline.db",
+                             db_directory=".",
+                             db_key="enilepiP",
+                             pl_run_date=True)
+        xfer_db.update_table("InSilicoVA_Conf", "chains", "0")
+        self.assertRaises(OpenVAConfigurationError,
+                          xfer_db.config_openva, "InSilicoVA")
+        xfer_db.update_table("InSilicoVA_Conf", "chains", "1")
+        xfer_db.update_table("InSilicoVA_Conf", "chains_rhat", "0.9")
+        self.assertRaises(OpenVAConfigurationError,
+                          xfer_db.config_openva, "InSilicoVA")
+        xfer_db.update_table("InSilicoVA_Conf", "chains_rhat", "1.05")
+
     def test_openva_conf_insilicova_nsim_exception(self):
         """config_openva should fail with invalid 
         InSilicoVA_Conf.Nsim value."""
@@ -1408,6 +1485,284 @@ class CheckDHISStoreVA(unittest.TestCase):
         os.remove("Pipeline.db")
 
 
+class CheckFindStoredVAIds(unittest.TestCase):
+    """Test method that finds the stored VA IDs in the Transfer DB."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        if os.path.isfile("Pipeline.db"):
+            os.remove("Pipeline.db")
+        create_transfer_db("Pipeline.db", ".", "enilepiP")
+        pipeline_run_date = datetime.datetime.now().strftime(
+            "%Y-%m-%d_%H:%M:%S")
+        cls.xfer_db = TransferDB(db_file_name="Pipeline.db",
+                                 db_directory=".",
+                                 db_key="enilepiP",
+                                 pl_run_date=pipeline_run_date)
+        cls.xfer_db.config_pipeline()
+        conn = cls.xfer_db._connect_db()
+        c = conn.cursor()
+        c.execute("INSERT INTO VA_Storage (id, outcome) VALUES (?, ?)",
+                  ("uuid:stored", "Pushed to DHIS2"))
+        c.execute("INSERT INTO VA_Org_Unit_Not_Found (id) VALUES (?)",
+                  ("uuid:no_org_unit",))
+        conn.commit()
+        conn.close()
+
+    def test_find_without_dhis(self):
+        """Only the given IDs stored in VA_Storage are found."""
+
+        va_ids = ["uuid:new", "uuid:stored", "uuid:no_org_unit"]
+        self.assertEqual(self.xfer_db.find_stored_va_ids(va_ids, False),
+                         {"uuid:stored"})
+
+    def test_find_with_dhis(self):
+        """VA_Org_Unit_Not_Found is also searched if DHIS2 is used."""
+
+        va_ids = ["uuid:new", "uuid:stored", "uuid:no_org_unit", "uuid:new"]
+        self.assertEqual(self.xfer_db.find_stored_va_ids(va_ids, True),
+                         {"uuid:stored", "uuid:no_org_unit"})
+
+    def test_find_uses_index(self):
+        """The id columns have (non-unique) indexes."""
+
+        self.xfer_db.find_stored_va_ids([], True)
+        conn = self.xfer_db._connect_db()
+        c = conn.cursor()
+        c.execute("SELECT name, sql FROM SQLITE_MASTER WHERE type = 'index'")
+        indexes = dict(c.fetchall())
+        conn.close()
+        self.assertIn("VA_Storage_id", indexes)
+        self.assertIn("VA_Org_Unit_Not_Found_id", indexes)
+        self.assertNotIn("UNIQUE", indexes["VA_Storage_id"])
+        self.assertNotIn("UNIQUE", indexes["VA_Org_Unit_Not_Found_id"])
+
+    def test_unique_index_replaced(self):
+        """A unique index from an earlier version is replaced."""
+
+        conn = self.xfer_db._connect_db()
+        c = conn.cursor()
+        c.execute("DROP INDEX VA_Storage_id")
+        c.execute("CREATE UNIQUE INDEX VA_Storage_id ON VA_Storage (id)")
+        self.xfer_db._index_va_ids(c, ["VA_Storage"])
+        conn.commit()
+        c.execute("SELECT sql FROM SQLITE_MASTER WHERE name = "
+                  "'VA_Storage_id'")
+        sql = c.fetchone()[0]
+        conn.close()
+        self.assertNotIn("UNIQUE", sql)
+
+    def test_check_duplicates(self):
+        """Stored records are removed from the ODK export."""
+
+        export_file = os.path.join("ODKFiles", "odk_export_new.csv")
+        with open(export_file, "w", newline="") as f:
+            f.write("meta-instanceID,Id10007\n"
+                    "uuid:new,a\n"
+                    "uuid:stored,b\n")
+        try:
+            results = self.xfer_db.check_duplicates(False)
+            df_export = read_csv(export_file)
+        finally:
+            os.remove(export_file)
+        self.assertEqual(results["n_duplicates"], 1)
+        self.assertEqual(results["n_unique"], 1)
+        self.assertEqual(df_export["meta-instanceID"].tolist(), ["uuid:new"])
+
+    def test_check_duplicates_return_data(self):
+        """With return_data, the ODK export file is not rewritten."""
+
+        export_file = os.path.join("ODKFiles", "odk_export_new.csv")
+        with open(export_file, "w", newline="") as f:
+            f.write("meta-instanceID,Id10007\n"
+                    "uuid:new,a\n"
+                    "uuid:stored,b\n")
+        try:
+            results = self.xfer_db.check_duplicates(False, return_data=True)
+            df_export = read_csv(export_file)
+        finally:
+            os.remove(export_file)
+        self.assertEqual(results["n_unique"], 1)
+        self.assertEqual(results["va_data"]["meta-instanceID"].tolist(),
+                         ["uuid:new"])
+        self.assertEqual(df_export["meta-instanceID"].tolist(),
+                         ["uuid:new", "uuid:stored"])
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove("Pipeline.db")
+
+
+class CheckStoredIDFilter(unittest.TestCase):
+    """Test the Bloom filter used for screening stored VA IDs."""
+
+    def setUp(self):
+
+        if os.path.isfile("Pipeline.db"):
+            os.remove("Pipeline.db")
+        create_transfer_db("Pipeline.db", ".", "enilepiP")
+        pipeline_run_date = datetime.datetime.now().strftime(
+            "%Y-%m-%d_%H:%M:%S")
+        self.xfer_db = TransferDB(db_file_name="Pipeline.db",
+                                  db_directory=".",
+                                  db_key="enilepiP",
+                                  pl_run_date=pipeline_run_date)
+        self.xfer_db.config_pipeline()
+        self.stored_ids = [f"uuid:stored{i}" for i in range(2000)]
+        self._insert("VA_Storage", self.stored_ids)
+
+    def _insert(self, table, va_ids):
+
+        conn = self.xfer_db._connect_db()
+        c = conn.cursor()
+        if table == "VA_Storage":
+            c.executemany("INSERT INTO VA_Storage (id, outcome) VALUES (?, ?)",
+                          [(i, "Pushed to DHIS2") for i in va_ids])
+        else:
+            c.executemany(f"INSERT INTO {table} (id) VALUES (?)",
+                          [(i,) for i in va_ids])
+        conn.commit()
+        conn.close()
+
+    def _filter_row(self):
+        """Number of IDs in the saved filter and of IDs waiting to be added."""
+
+        conn = self.xfer_db._connect_db()
+        c = conn.cursor()
+        c.execute("SELECT nItems FROM VA_ID_Filter")
+        row = c.fetchone()
+        c.execute("SELECT COUNT(*) FROM VA_ID_Filter_New")
+        n_new = c.fetchone()[0]
+        conn.close()
+        return (None if row is None else row[0], n_new)
+
+    def test_no_false_negatives(self):
+        """Every stored ID is found (and new IDs are not)."""
+
+        self.xfer_db.update_id_filter()
+        self.assertEqual(self._filter_row(), (2000, 0))
+        new_ids = [f"uuid:new{i}" for i in range(2000)]
+        found = self.xfer_db.find_stored_va_ids(self.stored_ids + new_ids,
+                                                False)
+        self.assertEqual(found, set(self.stored_ids))
+
+    def test_find_is_read_only(self):
+        """Finding stored IDs does not change the filter."""
+
+        self.assertEqual(self._filter_row(), (None, 2000))
+        found = self.xfer_db.find_stored_va_ids(["uuid:stored5", "uuid:new"],
+                                                False)
+        self.assertEqual(found, {"uuid:stored5"})
+        self.assertEqual(self._filter_row(), (None, 2000))
+
+    def test_incremental_update(self):
+        """Records stored after the filter was saved are found, and are
+        added to it by the next update."""
+
+        self.xfer_db.update_id_filter()
+        self._insert("VA_Storage", ["uuid:later"])
+        self._insert("VA_Org_Unit_Not_Found", ["uuid:no_org_unit"])
+        self.assertEqual(self._filter_row(), (2000, 2))
+        found = self.xfer_db.find_stored_va_ids(
+            ["uuid:later", "uuid:no_org_unit", "uuid:new"], True)
+        self.assertEqual(found, {"uuid:later", "uuid:no_org_unit"})
+        self.xfer_db.update_id_filter()
+        self.assertEqual(self._filter_row(), (2002, 0))
+
+    def test_emptied_table(self):
+        """Removed records are not found if VA_Storage is emptied and
+        refilled."""
+
+        self.xfer_db.update_id_filter()
+        conn = self.xfer_db._connect_db()
+        conn.execute("DELETE FROM VA_Storage")
+        conn.commit()
+        conn.close()
+        self._insert("VA_Storage", ["uuid:refilled"])
+        found = self.xfer_db.find_stored_va_ids(
+            ["uuid:stored1", "uuid:refilled"], False)
+        self.assertEqual(found, {"uuid:refilled"})
+
+    def test_rebuild_missing_filter(self):
+        """The filter is rebuilt if its table is missing."""
+
+        self.xfer_db.update_id_filter()
+        conn = self.xfer_db._connect_db()
+        conn.execute("DROP TABLE VA_ID_Filter")
+        conn.commit()
+        conn.close()
+        found = self.xfer_db.find_stored_va_ids(["uuid:stored5"], False)
+        self.assertEqual(found, {"uuid:stored5"})
+        self.xfer_db.update_id_filter()
+        self.assertEqual(self._filter_row(), (2000, 0))
+
+    def test_remove_no_ou_va(self):
+        """Removing the last VA_Org_Unit_Not_Found record keeps it exact."""
+
+        self._insert("VA_Org_Unit_Not_Found", ["uuid:a", "uuid:b"])
+        self.xfer_db.update_id_filter()
+        self.xfer_db.remove_no_ou_va("uuid:b")
+        self._insert("VA_Org_Unit_Not_Found", ["uuid:c"])
+        found = self.xfer_db.find_stored_va_ids(
+            ["uuid:a", "uuid:b", "uuid:c"], True)
+        self.assertEqual(found, {"uuid:a", "uuid:c"})
+        self.assertEqual(self._filter_row(), (2002, 1))
+
+    def tearDown(self):
+        os.remove("Pipeline.db")
+
+
+class CheckCODCache(unittest.TestCase):
+    """Test the table with cached results of VA records."""
+
+    def setUp(self):
+
+        if os.path.isfile("Pipeline.db"):
+            os.remove("Pipeline.db")
+        create_transfer_db("Pipeline.db", ".", "enilepiP")
+        pipeline_run_date = datetime.datetime.now().strftime(
+            "%Y-%m-%d_%H:%M:%S")
+        self.xfer_db = TransferDB(db_file_name="Pipeline.db",
+                                  db_directory=".",
+                                  db_key="enilepiP",
+                                  pl_run_date=pipeline_run_date)
+        self.xfer_db.store_cod_cache(
+            {"key_a": ("uuid:a", '[["id", "uuid:a"], ["cod", "A"]]'),
+             "key_b": ("uuid:b", '[["id", "uuid:b"], ["cod", "B"]]')})
+
+    def test_get_cod_cache(self):
+        """get_cod_cache() only returns the cached keys."""
+
+        cached = self.xfer_db.get_cod_cache(["key_a", "key_c"])
+        self.assertEqual(cached,
+                         {"key_a": '[["id", "uuid:a"], ["cod", "A"]]'})
+
+    def test_remove_stored_records(self):
+        """Results for records in VA_Storage are removed."""
+
+        conn = self.xfer_db._connect_db()
+        conn.execute("INSERT INTO VA_Storage (id, outcome) VALUES (?, ?)",
+                     ("uuid:b", "Pushed to DHIS2"))
+        conn.commit()
+        conn.close()
+        self.xfer_db.store_cod_cache({})
+        cached = self.xfer_db.get_cod_cache(["key_a", "key_b"])
+        self.assertEqual(list(cached), ["key_a"])
+
+    def test_missing_table(self):
+        """The table is created for databases without it."""
+
+        conn = self.xfer_db._connect_db()
+        conn.execute("DROP TABLE COD_Cache")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.xfer_db.get_cod_cache(["key_a"]), {})
+
+    def tearDown(self):
+        os.remove("Pipeline.db")
+
+
 class CheckUpdateODKLastRun(unittest.TestCase):
     """Test methods that updates ODK_Conf.odk_last_run"""
 
@@ -1445,6 +1800,71 @@ class CheckUpdateODKLastRun(unittest.TestCase):
         os.remove("Pipeline.db")
 
 
+class CheckODKSources(unittest.TestCase):
+    """Test methods for the additional ODK forms in ODK_Sources."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        if os.path.isfile("Pipeline.db"):
+            os.remove("Pipeline.db")
+        create_transfer_db("Pipeline.db", ".", "enilepiP")
+        pipeline_run_date = datetime.datetime.now().strftime(
+            "%Y-%m-%d_%H:%M:%S")
+        cls.xfer_db = TransferDB(db_file_name="Pipeline.db",
+                                 db_directory=".",
+                                 db_key="enilepiP",
+                                 pl_run_date=pipeline_run_date)
+        cls.no_sources = cls.xfer_db.config_odk_sources()
+        conn = cls.xfer_db._connect_db()
+        c = conn.cursor()
+        c.execute("INSERT INTO ODK_Sources (odkFormID, odkProjectNumber) "
+                  "VALUES ('va_who_v1_5_1', '40');")
+        c.execute("INSERT INTO ODK_Sources (odkFormID, odkProjectNumber, "
+                  "odkLastRun, odkURL) VALUES ('va_who_v1_5_3', '41', "
+                  "'2021-03-04_05:06:07', 'https://other.odk.server');")
+        conn.commit()
+        conn.close()
+        cls.sources = cls.xfer_db.config_odk_sources()
+        cls.xfer_db.update_odk_sources_last_run(cls.sources[:1])
+        cls.updated_sources = cls.xfer_db.config_odk_sources()
+
+    def test_no_sources(self):
+        """An empty ODK_Sources table gives no additional sources."""
+
+        self.assertEqual(self.no_sources, [])
+
+    def test_sources_defaults(self):
+        """Sources use the ODK_Conf settings that are not filled in."""
+
+        settings_odk = self.xfer_db.config_odk()
+        self.assertEqual(len(self.sources), 2)
+        self.assertEqual(self.sources[0].odk_form_id, "va_who_v1_5_1")
+        self.assertEqual(self.sources[0].odk_url, settings_odk.odk_url)
+        self.assertEqual(self.sources[0].odk_last_run,
+                         settings_odk.odk_last_run)
+
+    def test_sources_overrides(self):
+        """Sources use their own settings when they are filled in."""
+
+        self.assertEqual(self.sources[1].odk_project_number, "41")
+        self.assertEqual(self.sources[1].odk_url, "https://other.odk.server")
+        self.assertEqual(self.sources[1].odk_last_run_date, "2021/03/04")
+        self.assertEqual(self.sources[1].odk_last_run_date_prev, "2021/03/03")
+
+    def test_update_sources_last_run(self):
+        """Only the sources that were downloaded get a new odkLastRun."""
+
+        self.assertEqual(self.updated_sources[0].odk_last_run,
+                         self.xfer_db.pl_run_date)
+        self.assertEqual(self.updated_sources[1].odk_last_run,
+                         "2021-03-04_05:06:07")
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove("Pipeline.db")
+
+
 class CheckUpdateTableConf(unittest.TestCase):
     """Test method for updating configuration tables (and the getter)."""
 
@@ -0,0 +1,209 @@
+from openva_pipeline.va_data import read_va_csv
+from openva_pipeline.va_data import compact_va_data
+from openva_pipeline.va_data import expand_va_data
+from openva_pipeline.va_data import record_storage_to_eva
+from openva_pipeline.va_data import read_va_file
+from openva_pipeline.va_data import write_va_file
+from openva_pipeline.va_data import find_va_file
+from openva_pipeline.va_data import interchange_extension
+from openva_pipeline.va_data import feather
+import unittest
+import os
+import shutil
+from sys import path
+from pandas import read_csv
+from pandas import DataFrame
+
+source_path = os.path.dirname(os.path.abspath(__file__))
+path.append(source_path)
+import context
+
+os.chdir(os.path.abspath(os.path.dirname(__file__)))
+
+
+class CheckReadVACSV(unittest.TestCase):
+    """Check the compact loader for VA records."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.file_name = "ODKFiles/odk_export_new_who_v151.csv"
+        cls.df_default = read_csv(cls.file_name)
+        cls.df_compact = read_va_csv(cls.file_name)
+
+    def test_categorical_responses(self):
+        """Check that yes/no/dk columns are categorical."""
+
+        dtype = self.df_compact[
+            "consented-deceased_CRVS-info_on_deceased-Id10020"].dtype
+        self.assertEqual(dtype.name, "category")
+
+    def test_free_text_not_categorical(self):
+        """Check that other text columns keep their type."""
+
+        column = "meta-instanceID"
+        self.assertEqual(self.df_compact[column].dtype,
+                         self.df_default[column].dtype)
+
+    def test_less_memory(self):
+        """Check that the compact records use less memory."""
+
+        self.assertLess(self.df_compact.memory_usage(deep=True).sum(),
+                        self.df_default.memory_usage(deep=True).sum())
+
+    def test_same_csv(self):
+        """Check that the records are written to CSV unchanged."""
+
+        self.assertEqual(self.df_compact.to_csv(index=False),
+                         self.df_default.to_csv(index=False))
+
+    def test_expand(self):
+        """Check that expand_va_data() restores the default types."""
+
+        self.assertTrue(expand_va_data(self.df_compact).equals(
+            self.df_default))
+
+    def test_small_integers(self):
+        """Check that integer columns are downcast."""
+
+        df = compact_va_data(read_csv("ODKFiles/odk_export_phmrc.csv"))
+        self.assertEqual(df["Generalmodule-general3-gen_3_1"].dtype.name,
+                         "int8")
+
+    def test_zero_records(self):
+        """Check an export without records."""
+
+        df = read_va_csv("ODKFiles/zero_records_export.csv")
+        self.assertEqual(df.shape[0], 0)
+
+
+class CheckVAFile(unittest.TestCase):
+    """Check the CSV and Feather files passed to R."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.wd = "va_file_test"
+        if os.path.isdir(cls.wd):
+            shutil.rmtree(cls.wd)
+        os.makedirs(cls.wd)
+        cls.records = read_va_csv("ODKFiles/odk_export_new_who_v151.csv")
+
+    def test_csv(self):
+        """Check that a CSV file is written as with DataFrame.to_csv."""
+
+        file_name = os.path.join(self.wd, "records.csv")
+        write_va_file(self.records, file_name)
+        with open(file_name, "r") as f:
+            self.assertEqual(f.read(), self.records.to_csv(index=False))
+        self.assertTrue(read_va_file(file_name).equals(self.records))
+
+    @unittest.skipIf(feather is None, "pyarrow is not installed")
+    def test_feather(self):
+        """Check that the records are unchanged in a Feather file."""
+
+        file_name = os.path.join(self.wd, "records.feather")
+        write_va_file(self.records, file_name)
+        records = read_va_file(file_name)
+        self.assertEqual(records.to_csv(index=False),
+                         self.records.to_csv(index=False))
+        self.assertEqual(interchange_extension("feather"), ".feather")
+
+    @unittest.skipIf(feather is None, "pyarrow is not installed")
+    def test_feather_mixed_types(self):
+        """Check that a column with numbers and text is written as text."""
+
+        file_name = os.path.join(self.wd, "mixed.feather")
+        write_va_file(DataFrame({"id": ["uuid:1", 2, None]}), file_name)
+        self.assertEqual(list(read_va_file(file_name)["id"][:2]),
+                         ["uuid:1", "2"])
+
+    def test_find_va_file(self):
+        """Check that the newer of the CSV and Feather files is found."""
+
+        self.assertEqual(find_va_file(self.wd, "missing"),
+                         os.path.join(self.wd, "missing.csv"))
+        csv_file = os.path.join(self.wd, "both.csv")
+        feather_file = os.path.join(self.wd, "both.feather")
+        for file_name in [csv_file, feather_file]:
+            with open(file_name, "w") as f:
+                f.write("id\n")
+        os.utime(csv_file, (0, 0))
+        self.assertEqual(find_va_file(self.wd, "both"), feather_file)
+        os.utime(feather_file, (0, 0))
+        os.utime(csv_file)
+        self.assertEqual(find_va_file(self.wd, "both"), csv_file)
+
+    def test_csv_extension(self):
+        """Check the extension of the CSV format."""
+
+        self.assertEqual(interchange_extension("csv"), ".csv")
+
+    @classmethod
+    def tearDownClass(cls):
+
+        shutil.rmtree(cls.wd, ignore_errors=True)
+
+
+class CheckRecordStorageToEVA(unittest.TestCase):
+    """Check the EVA blob created from record_storage.csv."""
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.record_storage = read_va_csv(
+            "OpenVAFiles/sample_record_storage.csv")
+        cls.eva = record_storage_to_eva(cls.record_storage)
+        cls.va_id = str(cls.record_storage["id"][0])
+        cls.first = cls.eva[cls.eva["ID"] == cls.va_id]
+
+    def test_records(self):
+        """Check that there is one row per record and attribute."""
+
+        n_raw = (self.record_storage.shape[1] -
+                 list(self.record_storage).index("odkMetaInstanceID") - 1)
+        self.assertEqual(self.eva.shape,
+                         (self.record_storage.shape[0] * (n_raw + 3), 3))
+        self.assertEqual(list(self.eva["ID"].unique()),
+                         list(self.record_storage["id"].astype(str)))
+
+    def test_attributes(self):
+        """Check the ID, cause, and metadata attributes of a record."""
+
+        values = dict(zip(self.first["Attribute"], self.first["Value"]))
+        self.assertEqual(list(self.first["Attribute"])[:2],
+                         ["ID", "Cause of Death"])
+        self.assertEqual(list(self.first["Attribute"])[-1], "Metadata")
+        self.assertEqual(values["ID"], self.va_id)
+        self.assertEqual(values["Cause of Death"], "Haemorrhagic fever")
+        self.assertEqual(values["Metadata"],
+                         self.record_storage["metadataCode"][0])
+        self.assertEqual(values["adult"], "y")
+
+    def test_missing_values(self):
+        """Check that missing values are empty strings."""
+
+        self.assertFalse(self.eva["Value"].isna().any())
+
+    def test_subset(self):
+        """Check that only the given records are converted."""
+
+        eva = record_storage_to_eva(self.record_storage.iloc[[0]])
+        self.assertTrue(eva.equals(self.first.reset_index(drop=True)))
+
+    def test_smartva(self):
+        """Check the SmartVA layout (cause34 and the ID last)."""
+
+        record_storage = read_csv(
+            "OpenVAFiles/sample_record_storage.csv").rename(
+            columns={"cod": "cause34", "id": "ID"})
+        record_storage["cause34"] = None
+        eva = record_storage_to_eva(record_storage.iloc[[0]])
+        self.assertNotIn("sex", list(eva["Attribute"]))
+        self.assertEqual(list(eva["Attribute"])[-1], "ID")
+        values = dict(zip(eva["Attribute"], eva["Value"]))
+        self.assertEqual(values["cause34"], "MISSING")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)